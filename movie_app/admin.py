@@ -18,6 +18,7 @@ class MovieFrameInline(admin.TabularInline, TranslationInlineModelAdmin):
 @admin.register(Movie)
 class MovieAdmin(TranslationAdmin):
     inlines = [MovieVideoInline, MovieFrameInline,]
+    readonly_fields = ('rating_sum', 'rating_count', 'rating_avg', 'rating_histogram')
 
 
     class Media:
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class MovieAppConfig(AppConfig):
     name = 'movie_app'
+
+    def ready(self):
+        from . import signals, tasks  # noqa: F401
+
@@ -0,0 +1,239 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.db import close_old_connections
+from django.db.models import Prefetch, prefetch_related_objects
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.translation import gettext_lazy as _
+from django.views import View
+from rest_framework.exceptions import APIException, NotAuthenticated, NotFound, PermissionDenied
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .autocomplete import autocomplete_index
+from .cache import response_cache
+from .conditional import cache_etag
+from .db_routing import is_pinned, reading_from_replica
+from .models import Genre, Actor, Movie
+from .permissions import UserStatusPermissions
+from .serializers import (
+    GenreDetailSerializer, ActorDetailSerializer, MovieDetailSerializer, nested_movie_page
+)
+from .views import MovieListAPIView, AutocompleteAPIView
+
+# Mirrors Movie.objects.for_list(), one lookup per concurrent prefetch.
+LIST_PREFETCH = ['country', Prefetch('genre', queryset=Genre.objects.select_related('category'))]
+DETAIL_PREFETCH = ['country', 'director', 'genre', 'actor']
+
+
+def off_loop(func):
+    # Django's async ORM runs all queries of a request on one thread, so
+    # gathering them would still execute them one after another. Independent
+    # reads run on the default executor instead, each worker thread on its
+    # own connection, which is released like at the end of a request.
+    def run(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False)
+
+
+def not_found(model):
+    # Same message as get_object_or_404 in the DRF views.
+    return NotFound(_('No %(verbose_name)s matches the given query.') % {'verbose_name': model._meta.object_name})
+
+
+async def prefetch_concurrently(instances, lookups):
+    # One thread per lookup; the caches are created up front so the threads
+    # only ever add keys to them.
+    for instance in instances:
+        instance.__dict__.setdefault('_prefetched_objects_cache', {})
+    await asyncio.gather(*(off_loop(prefetch_related_objects)(instances, lookup) for lookup in lookups))
+
+
+class AsyncJWTAuthentication(JWTAuthentication):
+    # JWTAuthentication with the user loaded through the async ORM.
+
+    async def aauthenticate(self, request):
+        header = self.get_header(request)
+        raw_token = self.get_raw_token(header) if header is not None else None
+        if raw_token is None:
+            return AnonymousUser()
+        validated_token = self.get_validated_token(raw_token)
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+        try:
+            user = await self.user_model.objects.aget(**{api_settings.USER_ID_FIELD: user_id})
+        except self.user_model.DoesNotExist:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        return user
+
+
+class AsyncCatalogView(View):
+    # Async counterparts of the hot catalog reads for ASGI deployments. They
+    # answer with the same payloads as the DRF views and share their response
+    # cache tags, replica routing and ETags; subclasses implement `load`.
+    http_method_names = ['get', 'head', 'options']
+    cache_tags = ()
+    # Like IsAuthenticated in front of the DRF view's other permissions.
+    authentication_required = False
+    renderer = JSONRenderer()
+
+    async def get(self, request, *args, **kwargs):
+        challenge = {'WWW-Authenticate': AsyncJWTAuthentication().authenticate_header(request)}
+        try:
+            user = await AsyncJWTAuthentication().aauthenticate(request)
+        except APIException as exc:
+            return self.error(exc, challenge)
+        if self.authentication_required and not user.is_authenticated:
+            return self.error(NotAuthenticated(), challenge)
+        request = Request(request)
+        request.user = user
+        replica = reading_from_replica.set(False)
+        try:
+            key, data = await off_loop(self.cached)(request, **kwargs)
+            etag = cache_etag(key)
+            response = get_conditional_response(request._request, etag=etag)
+            if response is not None:
+                response['ETag'] = etag
+                return response
+            if data is not None:
+                return self.render(data, headers={'X-Cache': 'HIT', 'ETag': etag})
+            try:
+                data = await self.load(request, **kwargs)
+            except APIException as exc:
+                return self.error(exc)
+            await off_loop(response_cache.set)(key, data)
+            return self.render(data, headers={'X-Cache': 'MISS', 'ETag': etag})
+        finally:
+            reading_from_replica.reset(replica)
+
+    def cached(self, request, **kwargs):
+        user = request.user
+        if not (user.is_authenticated and is_pinned(user.pk)):
+            reading_from_replica.set(True)
+        tags = self.get_cache_tags(request, **kwargs)
+        key = response_cache.response_key(request, tags)
+        data = response_cache.get(key)
+        if data is None and reading_from_replica.get() and response_cache.recently_invalidated(tags):
+            reading_from_replica.set(False)
+        return key, data
+
+    def get_cache_tags(self, request, **kwargs):
+        return [tag.format(**kwargs) for tag in self.cache_tags]
+
+    async def load(self, request, **kwargs):
+        raise NotImplementedError
+
+    def error(self, exc, headers=None):
+        data = exc.detail if isinstance(exc.detail, (dict, list)) else {'detail': exc.detail}
+        return self.render(data, exc.status_code, headers)
+
+    def render(self, data, status=200, headers=None):
+        return HttpResponse(self.renderer.render(data), status=status, headers=headers,
+                            content_type='application/json')
+
+
+class AsyncMovieListView(AsyncCatalogView):
+    # Filters, ordering and keyset pages come from MovieListAPIView; its two
+    # prefetches run concurrently.
+    cache_tags = MovieListAPIView.cache_tags
+
+    def get_cache_tags(self, request):
+        return MovieListAPIView(request=request, kwargs={}).get_cache_tags()
+
+    async def load(self, request):
+        view = MovieListAPIView(request=request, args=(), kwargs={}, format_kwarg=None)
+
+        def page():
+            queryset = view.filter_queryset(view.get_queryset()).prefetch_related(None)
+            return view.paginate_queryset(queryset)
+
+        movies = await off_loop(page)()
+        await prefetch_concurrently(movies, LIST_PREFETCH)
+        return view.get_paginated_response(view.get_serializer(movies, many=True).data).data
+
+
+class AsyncMovieDetailSerializer(MovieDetailSerializer):
+    # Expanded sub-resources are fetched by the view and passed in.
+    def expansion(self, pk, name):
+        return self.context['expanded'][name]
+
+
+class AsyncMovieDetailView(AsyncCatalogView):
+    # The ?expand= pages only need the pk, so they load alongside the movie;
+    # its four many-to-many lists are prefetched concurrently afterwards.
+    cache_tags = ['movie:{pk}', 'country', 'genre', 'director', 'actor']
+    authentication_required = True
+
+    async def load(self, request, pk):
+        context = {'request': request}
+        names = MovieDetailSerializer(context=context).expansions()
+        pages = asyncio.gather(*(
+            off_loop(MovieDetailSerializer(context=context).expansion)(pk, name) for name in names))
+        try:
+            movie = await Movie.objects.aget(pk=pk)
+        except Movie.DoesNotExist:
+            pages.cancel()
+            raise not_found(Movie)
+        if not UserStatusPermissions().has_object_permission(request, self, movie):
+            pages.cancel()
+            raise PermissionDenied
+        expanded = (await asyncio.gather(prefetch_concurrently([movie], DETAIL_PREFETCH), pages))[1]
+        context['expanded'] = dict(zip(names, expanded))
+        return AsyncMovieDetailSerializer(movie, context=context).data
+
+
+class AsyncGenreDetailSerializer(GenreDetailSerializer):
+    def get_movies(self, obj):
+        return self.context['movies']
+
+
+class AsyncGenreDetailView(AsyncCatalogView):
+    cache_tags = ['genre', 'movie', 'country']
+
+    async def load(self, request, pk):
+        context = {'request': request}
+        movies = off_loop(nested_movie_page)(context, Movie.objects.filter(genre=pk), 'genre_movies', pk)
+        try:
+            genre, context['movies'] = await asyncio.gather(Genre.objects.aget(pk=pk), movies)
+        except Genre.DoesNotExist:
+            raise not_found(Genre)
+        return AsyncGenreDetailSerializer(genre, context=context).data
+
+
+class AsyncActorDetailSerializer(ActorDetailSerializer):
+    def get_actor_movies(self, obj):
+        return self.context['movies']
+
+
+class AsyncActorDetailView(AsyncCatalogView):
+    cache_tags = ['actor', 'movie', 'country', 'genre']
+
+    async def load(self, request, pk):
+        context = {'request': request}
+        movies = off_loop(nested_movie_page)(context, Movie.objects.filter(actor=pk), 'actor_movies', pk)
+        try:
+            actor, context['movies'] = await asyncio.gather(Actor.objects.aget(pk=pk), movies)
+        except Actor.DoesNotExist:
+            raise not_found(Actor)
+        return AsyncActorDetailSerializer(actor, context=context).data
+
+
+class AsyncAutocompleteView(AsyncCatalogView):
+    # Served from the in-process index; only a rebuild touches the database.
+
+    async def get(self, request, *args, **kwargs):
+        if autocomplete_index.is_stale():
+            await off_loop(autocomplete_index.ensure_fresh)()
+        return self.render(AutocompleteAPIView().suggestions(Request(request)))
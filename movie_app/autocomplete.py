@@ -0,0 +1,261 @@
+import heapq
+import re
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db import connections
+
+from .models import Movie, Actor, Director, Genre
+
+# kind -> (model, translated name fields)
+AUTOCOMPLETE_KINDS = {
+    'movies': (Movie, ('movie_name_ru', 'movie_name_en')),
+    'actors': (Actor, ('full_name_ru', 'full_name_en')),
+    'directors': (Director, ('full_name_ru', 'full_name_en')),
+    'genres': (Genre, ('genre_name_ru', 'genre_name_en')),
+}
+KIND_CODES = {kind: code for code, kind in enumerate(AUTOCOMPLETE_KINDS)}
+KINDS_BY_CODE = list(AUTOCOMPLETE_KINDS)
+MAX_WORDS_PER_NAME = 6
+# Overlay entries plus void objects past which the index is merged again.
+OVERLAY_LIMIT = 5000
+
+
+def normalize(text):
+    return ' '.join(re.findall(r'\w+', (text or '').casefold().replace('ё', 'е')))
+
+
+def name_keys(labels):
+    # Every word suffix of every translation, so "riv" finds "Silent River".
+    # The whole-name key is flagged to rank names that start with the prefix first.
+    keys = {}
+    for label in labels:
+        words = normalize(label).split()[:MAX_WORDS_PER_NAME]
+        for i in range(len(words)):
+            key = ' '.join(words[i:])
+            keys[key] = keys.get(key, False) or i == 0
+    return keys
+
+
+class PrefixIndex:
+    # Two parallel sorted arrays searched with bisect: the normalized keys,
+    # and packed refs (id << 3 | kind << 1 | is_whole_name) in an
+    # array('Q'). Kept per process. The arrays are never changed in place:
+    # signals add entries to a small sorted overlay and mark the objects
+    # whose array entries are void, and a background thread merges the two
+    # back together, or rebuilds everything once AUTOCOMPLETE_MAX_AGE has
+    # passed, while searches keep using what is there.
+
+    def __init__(self, max_entries=None, max_age=None):
+        self.max_entries = max_entries or getattr(settings, 'AUTOCOMPLETE_MAX_ENTRIES', 1_000_000)
+        self.max_age = max_age if max_age is not None else getattr(settings, 'AUTOCOMPLETE_MAX_AGE', None)
+        self.lock = threading.RLock()
+        self.build_lock = threading.Lock()
+        self.keys = []
+        self.refs = array('Q')
+        # Sorted (key, ref) pairs added since the arrays were made, the
+        # objects they belong to, and the objects void in the arrays.
+        self.added = []
+        self.overlaid = set()
+        self.dead = set()
+        self.labels = {}
+        self.object_keys = {}
+        self.entries = 0
+        self.size_bytes = 0
+        self.truncated = False
+        self.built_at = None
+        # Updates made while a rebuild or merge runs, replayed onto its result.
+        self.journal = None
+
+    @property
+    def is_built(self):
+        return self.built_at is not None
+
+    @staticmethod
+    def pack(kind, pk, whole):
+        return pk << 3 | KIND_CODES[kind] << 1 | whole
+
+    @staticmethod
+    def unpack(ref):
+        return KINDS_BY_CODE[ref >> 1 & 3], ref >> 3, ref & 1
+
+    @staticmethod
+    def key_size(key):
+        return sys.getsizeof(key) + 16
+
+    def build(self):
+        with self.lock:
+            self.journal = []
+        pairs, labels, object_keys = [], {}, {}
+        truncated = False
+        for kind, (model, fields) in AUTOCOMPLETE_KINDS.items():
+            for pk, *names in model.objects.values_list('pk', *fields).iterator(chunk_size=2000):
+                keys = name_keys(names)
+                if len(pairs) + len(keys) > self.max_entries:
+                    truncated = True
+                    continue
+                labels[(kind, pk)] = tuple(names)
+                object_keys[(kind, pk)] = tuple(keys)
+                pairs.extend((key, self.pack(kind, pk, whole)) for key, whole in keys.items())
+        pairs.sort()
+        self.install(pairs, labels, object_keys, truncated, rebuilt=True)
+
+    def merge(self):
+        # Folds the overlay and the void entries into fresh arrays.
+        with self.lock:
+            self.journal = []
+            keys, refs, added, dead = self.keys, self.refs, list(self.added), set(self.dead)
+            labels, object_keys, truncated = dict(self.labels), dict(self.object_keys), self.truncated
+        kept = ((key, ref) for key, ref in zip(keys, refs) if self.unpack(ref)[:2] not in dead)
+        self.install(list(heapq.merge(kept, added)), labels, object_keys, truncated)
+
+    def install(self, pairs, labels, object_keys, truncated, rebuilt=False):
+        keys = [key for key, _ in pairs]
+        refs = array('Q', (ref for _, ref in pairs))
+        del pairs
+        size_bytes = sum(self.key_size(key) for key in keys) + sys.getsizeof(keys) + refs.itemsize * len(refs)
+        with self.lock:
+            self.keys, self.refs, self.labels, self.object_keys = keys, refs, labels, object_keys
+            self.added, self.overlaid, self.dead = [], set(), set()
+            self.entries, self.size_bytes, self.truncated = len(keys), size_bytes, truncated
+            if rebuilt:
+                self.built_at = time.monotonic()
+            journal, self.journal = self.journal or [], None
+            for kind, pk, names in journal:
+                self.apply(kind, pk, names)
+
+    def is_stale(self):
+        return not self.is_built or (self.max_age is not None and time.monotonic() - self.built_at > self.max_age)
+
+    def ensure_fresh(self):
+        # Other processes' writes only reach this index through a rebuild, so
+        # AUTOCOMPLETE_MAX_AGE bounds how stale a worker can get. Only the
+        # first build runs on the calling thread.
+        if not self.is_built:
+            with self.build_lock:
+                if not self.is_built:
+                    self.build()
+        elif self.is_stale():
+            self.in_background(self.build)
+
+    def in_background(self, refresh):
+        if not self.build_lock.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                refresh()
+            finally:
+                with self.lock:
+                    self.journal = None
+                self.build_lock.release()
+                connections.close_all()
+
+        threading.Thread(target=run, name='autocomplete-refresh', daemon=True).start()
+
+    def update(self, kind, pk, names):
+        with self.lock:
+            if self.journal is not None:
+                self.journal.append((kind, pk, names))
+            self.apply(kind, pk, names)
+
+    def remove(self, kind, pk):
+        self.update(kind, pk, None)
+
+    def apply(self, kind, pk, names):
+        # Drops the entries of (kind, pk) and adds those of `names` unless
+        # it is None, in O(log n + overlay size).
+        obj = (kind, pk)
+        self.labels.pop(obj, None)
+        stale = self.object_keys.pop(obj, ())
+        if obj in self.overlaid:
+            self.overlaid.discard(obj)
+            for key in stale:
+                index = bisect_left(self.added, (key,))
+                while index < len(self.added) and self.added[index][0] == key:
+                    if self.unpack(self.added[index][1])[:2] == obj:
+                        del self.added[index]
+                        break
+                    index += 1
+        elif stale:
+            self.dead.add(obj)
+        self.entries -= len(stale)
+        self.size_bytes -= sum(self.key_size(key) + self.refs.itemsize for key in stale)
+        if names is None:
+            return
+        keys = name_keys(names)
+        if self.entries + len(keys) > self.max_entries:
+            self.truncated = True
+            return
+        self.labels[obj] = tuple(names)
+        self.object_keys[obj] = tuple(keys)
+        self.overlaid.add(obj)
+        for key, whole in keys.items():
+            insort(self.added, (key, self.pack(kind, pk, whole)))
+        self.entries += len(keys)
+        self.size_bytes += sum(self.key_size(key) + self.refs.itemsize for key in keys)
+        if len(self.added) + len(self.dead) > OVERLAY_LIMIT:
+            self.in_background(self.merge)
+
+    def scan(self, prefix, scan_limit):
+        # Live (key, ref) pairs starting with `prefix`, from the arrays and
+        # then the overlay, at most `scan_limit` of each looked at.
+        start = bisect_left(self.keys, prefix)
+        for index in range(start, min(start + scan_limit, len(self.keys))):
+            key = self.keys[index]
+            if not key.startswith(prefix):
+                break
+            ref = self.refs[index]
+            if self.unpack(ref)[:2] not in self.dead:
+                yield key, ref
+        start = bisect_left(self.added, (prefix,))
+        for key, ref in self.added[start:start + scan_limit]:
+            if not key.startswith(prefix):
+                break
+            yield key, ref
+
+    def search(self, prefix, limit=5, scan_limit=2000):
+        prefix = normalize(prefix)
+        results = {kind: [] for kind in AUTOCOMPLETE_KINDS}
+        if not prefix:
+            return results
+        candidates = {}
+        with self.lock:
+            for key, ref in self.scan(prefix, scan_limit):
+                kind, pk, whole = self.unpack(ref)
+                rank = (not whole, len(key))
+                if rank < candidates.get((kind, pk), (True, sys.maxsize)):
+                    candidates[(kind, pk)] = rank
+            labels = {ref: self.labels[ref] for ref in candidates}
+        for (kind, pk), _ in sorted(candidates.items(), key=lambda item: item[1]):
+            if len(results[kind]) < limit:
+                results[kind].append((pk, labels[(kind, pk)]))
+        return results
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': self.entries,
+                'objects': len(self.labels),
+                'overlay_entries': len(self.added),
+                'void_objects': len(self.dead),
+                'max_entries': self.max_entries,
+                'approx_bytes': self.size_bytes,
+                'truncated': self.truncated,
+                'refreshing': self.build_lock.locked(),
+                'age_seconds': None if self.built_at is None else round(time.monotonic() - self.built_at, 1),
+            }
+
+
+autocomplete_index = PrefixIndex()
+
+
+def kind_for_model(model):
+    for kind, (kind_model, fields) in AUTOCOMPLETE_KINDS.items():
+        if kind_model is model:
+            return kind, fields
+    return None, ()
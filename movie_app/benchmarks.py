@@ -0,0 +1,118 @@
+import datetime
+import math
+import random
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext, setup_databases, teardown_databases
+
+from .models import Category, Genre, Country, Director, Actor, Movie
+from .search import get_search_backend
+
+WORDS_EN = ['silent', 'river', 'night', 'city', 'last', 'summer', 'empire', 'shadow', 'winter', 'road',
+            'secret', 'garden', 'storm', 'kingdom', 'mountain', 'dream', 'station', 'mirror', 'sky', 'house']
+WORDS_RU = ['тихая', 'река', 'ночь', 'город', 'последний', 'лето', 'империя', 'тень', 'зима', 'дорога',
+            'тайна', 'сад', 'буря', 'королевство', 'гора', 'сон', 'станция', 'зеркало', 'небо', 'дом']
+SYLLABLES_EN = ['ka', 'ro', 'mi', 'ten', 'sa', 'lu', 'vor', 'ne', 'di', 'zan', 'el', 'po', 'ri', 'ash', 'to', 'gu']
+SYLLABLES_RU = ['ка', 'ро', 'ми', 'тен', 'са', 'лу', 'вор', 'не', 'ди', 'зан', 'эл', 'по', 'ри', 'аш', 'то', 'гу']
+
+
+def vocabulary(syllables):
+    # 4096 synthetic words, so term frequencies look like a real catalog
+    # rather than a handful of words repeated across every title.
+    return [a + b + c for a in syllables for b in syllables for c in syllables]
+
+NAMES = ['anna', 'boris', 'chen', 'david', 'elena', 'farid', 'gulnara', 'hiro', 'ivan', 'jamila',
+         'kairat', 'lena', 'maria', 'nurlan', 'oleg', 'pavel', 'rustam', 'sara', 'timur', 'zarina']
+
+
+@contextmanager
+def benchmark_database(response_cache=False):
+    # Benchmarks seed a throwaway test database, never the configured one,
+    # and by default measure the uncached code path.
+    caches = dict(settings.CACHES)
+    if not response_cache:
+        caches[settings.CATALOG_CACHE_ALIAS] = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+    with override_settings(CACHES=caches):
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            yield
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+
+def seed_catalog(movies=2000, genres=30, countries=40, actors=500, directors=200, seed=0):
+    rnd = random.Random(seed)
+    birth_date = datetime.date(1970, 1, 1)
+
+    categories = Category.objects.bulk_create(
+        [Category(category_name=f'Category {i}') for i in range(max(genres // 5, 1))])
+    genre_objs = Genre.objects.bulk_create(
+        [Genre(genre_name=f'Genre {i}', category=categories[i % len(categories)]) for i in range(genres)])
+    country_objs = Country.objects.bulk_create(
+        [Country(country_name=f'Country {i}') for i in range(countries)])
+    actor_objs = Actor.objects.bulk_create([
+        Actor(full_name_en=f'Actor {NAMES[i % 20].title()} {i}', full_name_ru=f'Актёр {i}',
+              actor_photo='actor_images/a.png', birth_date=birth_date, bio='')
+        for i in range(actors)])
+    director_objs = Director.objects.bulk_create([
+        Director(full_name_en=f'Director {NAMES[i % 20].title()} {i}', full_name_ru=f'Режиссёр {i}',
+                 director_photo='director_images/d.png', birth_date=birth_date, bio='')
+        for i in range(directors)])
+
+    movie_types = [choice for choice, _ in Movie.MovieTypeChoices]
+    vocabulary_en, vocabulary_ru = vocabulary(SYLLABLES_EN), vocabulary(SYLLABLES_RU)
+    movie_objs = []
+    for i in range(movies):
+        title = rnd.sample(range(len(vocabulary_en)), 2)
+        description = rnd.sample(range(len(vocabulary_en)), 12)
+        word = rnd.randrange(len(WORDS_EN))
+        movie_objs.append(Movie(
+            movie_name_en=f'{WORDS_EN[word].title()} {vocabulary_en[title[0]]} {vocabulary_en[title[1]]} {i}',
+            movie_name_ru=f'{WORDS_RU[word].title()} {vocabulary_ru[title[0]]} {vocabulary_ru[title[1]]} {i}',
+            description_en=' '.join(vocabulary_en[index] for index in description),
+            description_ru=' '.join(vocabulary_ru[index] for index in description),
+            year=datetime.date(1950 + i % 75, 1, 1),
+            movie_type=rnd.choice(movie_types), movie_time=rnd.randint(60, 200),
+            movie_poster='movie_poster/p.png', trailer='https://example.com/trailer',
+            status=rnd.choice(['simple', 'pro'])))
+    movie_objs = Movie.objects.bulk_create(movie_objs, batch_size=500)
+
+    links = (
+        (Movie.country.through, 'country_id', country_objs, 2),
+        (Movie.genre.through, 'genre_id', genre_objs, 3),
+        (Movie.actor.through, 'actor_id', actor_objs, 5),
+        (Movie.director.through, 'director_id', director_objs, 1),
+    )
+    for through, column, targets, per_movie in links:
+        through.objects.bulk_create([
+            through(movie_id=movie.pk, **{column: target.pk})
+            for movie in movie_objs
+            for target in rnd.sample(targets, min(per_movie, len(targets)))
+        ], batch_size=2000)
+    # bulk_create skips the signals that keep derived indexes current.
+    get_search_backend().rebuild()
+    return movie_objs
+
+
+def measure(url, repeat=20, client=None, **extra):
+    client = client or Client()
+    timings = []
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url, **extra)
+    if response.status_code != 200:
+        raise AssertionError(f'GET {url} returned {response.status_code}')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        client.get(url, **extra)
+        timings.append((time.perf_counter() - started) * 1000)
+    return len(queries), percentile(timings, 95)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = max(math.ceil(len(ordered) * pct / 100) - 1, 0)
+    return ordered[index]
@@ -0,0 +1,135 @@
+import os
+import time
+from collections import Counter
+
+from django.core.files.storage import default_storage
+from django.db.models import F
+
+from .images import IMAGE_FIELDS
+from .models import MediaBlob, MovieFrame, MovieVideo
+from .storage import BLOB_DIR, blob_hash
+
+# model -> file columns counted as references to stored uploads
+MEDIA_FIELDS = {**IMAGE_FIELDS, MovieVideo: ('video',)}
+# model -> untranslated columns behind translated file fields. modeltranslation
+# copies a language column into them on save, so they are not references of
+# their own; only querysets with rewrite(False) reach them.
+BASE_FIELDS = {MovieFrame: ('image',)}
+
+
+def file_names(instance, fields):
+    return [getattr(instance, field).name for field in fields if getattr(instance, field)]
+
+
+def stored_size(name):
+    try:
+        return default_storage.size(name)
+    except OSError:
+        return 0
+
+
+def adjust_refcounts(added=(), removed=()):
+    changes = Counter(added)
+    changes.subtract(removed)
+    changes = {name: delta for name, delta in changes.items() if name and delta}
+    if not changes:
+        return
+    MediaBlob.objects.bulk_create(
+        [MediaBlob(name=name, size=stored_size(name)) for name, delta in changes.items() if delta > 0],
+        ignore_conflicts=True)
+    for name, delta in changes.items():
+        MediaBlob.objects.filter(name=name).update(refcount=F('refcount') + delta)
+
+
+def referenced_names():
+    counts = Counter()
+    for model, fields in MEDIA_FIELDS.items():
+        for field in fields:
+            names = model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+            counts.update(names.values_list(field, flat=True).iterator())
+    return counts
+
+
+def recount():
+    # Rebuilds every refcount from the file columns; signals keep them
+    # current, but queryset.update() and raw SQL bypass those.
+    counts = referenced_names()
+    blobs = {blob.name: blob for blob in MediaBlob.objects.only('name', 'refcount')}
+    MediaBlob.objects.bulk_create(
+        [MediaBlob(name=name, size=stored_size(name), refcount=count)
+         for name, count in counts.items() if name not in blobs],
+        ignore_conflicts=True)
+    changed = []
+    for name, blob in blobs.items():
+        if blob.refcount != counts.get(name, 0):
+            blob.refcount = counts.get(name, 0)
+            changed.append(blob)
+    MediaBlob.objects.bulk_update(changed, ['refcount'], batch_size=500)
+    return counts
+
+
+def adopt(dry_run=False):
+    # Moves uploads saved under their original names into the blob store and
+    # repoints the rows at them, which also folds the *_AbC123x duplicates.
+    adopted = {}
+    for model, fields in MEDIA_FIELDS.items():
+        timestamps = ['updated_at'] if any(field.name == 'updated_at' for field in model._meta.fields) else []
+        for field in fields:
+            legacy = (model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+                      .exclude(**{f'{field}__startswith': f'{BLOB_DIR}/'}))
+            for instance in legacy.iterator():
+                name = getattr(instance, field).name
+                if name not in adopted:
+                    if not default_storage.exists(name):
+                        continue
+                    if dry_run:
+                        adopted[name] = None
+                        continue
+                    with default_storage.open(name, 'rb') as source:
+                        adopted[name] = default_storage.save(name, source)
+                if not dry_run:
+                    setattr(instance, field, adopted[name])
+                    instance.save(update_fields=[field, *timestamps])
+    # Saving a language column leaves the base column alone, which must not
+    # keep the name of a file deleted below.
+    for model, fields in BASE_FIELDS.items():
+        rows = model.objects.rewrite(False)
+        for field in fields:
+            names = rows.exclude(**{f'{field}__startswith': f'{BLOB_DIR}/'}).values_list(field, flat=True)
+            for name in set(names.distinct()) & adopted.keys():
+                if adopted[name] is not None:
+                    rows.filter(**{field: name}).update(**{field: adopted[name]})
+    freed = 0
+    for name in adopted:
+        freed += stored_size(name)
+        if not dry_run:
+            default_storage.delete(name)
+    return len(adopted), freed
+
+
+def collect(grace=24 * 3600, dry_run=False):
+    # Deletes blobs nothing refers to. Files younger than `grace` seconds are
+    # kept, as their upload may not have been saved to a row yet.
+    counts = recount()
+    cutoff = time.time() - grace
+    root = default_storage.path(BLOB_DIR)
+    removed, freed = [], 0
+    for directory, _, files in os.walk(root):
+        for file in files:
+            path = os.path.join(directory, file)
+            name = os.path.relpath(path, default_storage.location).replace(os.sep, '/')
+            is_upload = blob_hash(name) is not None
+            if (is_upload and counts.get(name)) or os.path.getmtime(path) > cutoff:
+                continue
+            if not is_upload and not name.startswith(f'{BLOB_DIR}/tmp/'):
+                continue
+            freed += os.path.getsize(path)
+            removed.append(name)
+            if not dry_run:
+                os.remove(path)
+    if not dry_run:
+        for start in range(0, len(removed), 500):
+            MediaBlob.objects.filter(name__in=removed[start:start + 500]).delete()
+        # Unreferenced pre-blob-store names are not garbage collected, only forgotten.
+        MediaBlob.objects.filter(refcount__lte=0).exclude(name__startswith=f'{BLOB_DIR}/').delete()
+    return removed, freed
@@ -0,0 +1,119 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import get_language
+from rest_framework.response import Response
+
+from .db_routing import reading_from_replica, replica_aliases
+
+CATALOG_CACHE_ALIAS = getattr(settings, 'CATALOG_CACHE_ALIAS', 'catalog')
+# Bumped by rating aggregate changes instead of 'movie': only movie details
+# and pages ordered or filtered by rating_avg show them.
+RATING_CACHE_TAG = 'movie_rating'
+
+
+class ResponseCache:
+    # Cached payloads embed the current version of every tag they depend on,
+    # so bumping a tag's version makes all dependent entries unreachable
+    # without having to know their keys. Any Django cache backend works
+    # (locmem, file, Redis); multi-process deployments need a shared one.
+
+    def __init__(self, alias=CATALOG_CACHE_ALIAS):
+        self.alias = alias
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    def tag_key(self, tag):
+        return f'catalog:tag:{tag}'
+
+    def bumped_key(self, tag):
+        return f'catalog:tag:{tag}:bumped'
+
+    def tag_versions(self, tags):
+        keys = [self.tag_key(tag) for tag in tags]
+        versions = self.backend.get_many(keys)
+        missing = {key: time.time_ns() for key in keys if key not in versions}
+        for key, version in missing.items():
+            # A fresh, never-reused version keeps evicted tags from
+            # resurrecting stale entries.
+            if not self.backend.add(key, version, None):
+                missing[key] = self.backend.get(key, version)
+        versions.update(missing)
+        return [versions[key] for key in keys]
+
+    def invalidate(self, *tags):
+        backend = self.backend
+        for tag in set(tags):
+            key = self.tag_key(tag)
+            try:
+                backend.incr(key)
+            except ValueError:
+                backend.add(key, time.time_ns(), None)
+        # Replicas may lag the write behind this bump for as long as writers
+        # stay pinned to the primary; entries filled meanwhile are read there.
+        sticky = getattr(settings, 'REPLICA_STICKY_SECONDS', 10)
+        if sticky and replica_aliases():
+            backend.set_many({self.bumped_key(tag): time.time() for tag in set(tags)}, sticky)
+
+    def recently_invalidated(self, tags):
+        return bool(tags) and bool(self.backend.get_many([self.bumped_key(tag) for tag in tags]))
+
+    def response_key(self, request, tags):
+        tier = getattr(request.user, 'status', None) or 'anonymous'
+        query = request.META.get('QUERY_STRING', '')
+        versions = self.tag_versions(tags)
+        raw = '|'.join([request.path, query, get_language() or '', tier] + [str(v) for v in versions])
+        return 'catalog:response:v2:' + hashlib.md5(raw.encode()).hexdigest()
+
+    def entry(self, key):
+        # {'data': payload} or None
+        return self.backend.get(key)
+
+    def get(self, key):
+        entry = self.entry(key)
+        return entry['data'] if entry is not None else None
+
+    def set(self, key, data):
+        entry = {'data': data}
+        self.backend.set(key, entry)
+        return entry
+
+
+response_cache = ResponseCache()
+
+
+def invalidate(*tags):
+    response_cache.invalidate(*tags)
+
+
+class CachedResponseMixin:
+    # `cache_tags` may reference URL kwargs, e.g. 'movie:{pk}'.
+    cache_tags = ()
+
+    def get_cache_tags(self):
+        return [tag.format(**self.kwargs) for tag in self.cache_tags]
+
+    def get_cache_entry(self, request):
+        # (key, entry) for this request, looked up once; ConditionalGetMixin
+        # reads it before the view runs.
+        if not hasattr(self, '_cache_entry'):
+            key = response_cache.response_key(request, self.get_cache_tags())
+            self._cache_entry = key, response_cache.entry(key)
+        return self._cache_entry
+
+    def get(self, request, *args, **kwargs):
+        key, entry = self.get_cache_entry(request)
+        if entry is not None:
+            return Response(entry['data'], headers={'X-Cache': 'HIT'})
+        if reading_from_replica.get() and response_cache.recently_invalidated(self.get_cache_tags()):
+            # Would cache a lagging replica's rows under the new versions.
+            reading_from_replica.set(False)
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            self._cache_entry = key, response_cache.set(key, response.data)
+        response['X-Cache'] = 'MISS'
+        return response
@@ -0,0 +1,357 @@
+import csv
+import json
+from itertools import groupby
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from modeltranslation.settings import AVAILABLE_LANGUAGES, DEFAULT_LANGUAGE
+
+from .cache import invalidate
+from .models import Category, Genre, Country, Director, Actor, Movie
+from .search import get_search_backend
+from .signals import CATALOG_CACHE_TAGS, MOVIE_LINK_LOOKUPS, touch_movies
+
+# The default language comes first, so a natural key names an object the
+# same way whichever translations a dump happens to carry.
+LANGUAGES = [DEFAULT_LANGUAGE] + [language for language in AVAILABLE_LANGUAGES if language != DEFAULT_LANGUAGE]
+
+
+def as_key(value):
+    return tuple(as_key(item) for item in value) if isinstance(value, (list, tuple)) else value
+
+
+def plain_value(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+class CatalogKind:
+    # One exportable model. Objects are matched by natural key: the first
+    # non-empty translation of `key[0]`, the remaining `key` fields and,
+    # for genres, the parent's own key.
+
+    def __init__(self, name, model, translated, plain=(), key=(), parent=None, links=None):
+        self.name = name
+        self.model = model
+        self.translated = translated
+        self.plain = plain
+        self.key = key
+        self.parent = parent
+        self.links = links or {}
+
+    @property
+    def translated_columns(self):
+        return [f'{field}_{language}' for field in self.translated for language in LANGUAGES]
+
+    @property
+    def columns(self):
+        return self.translated_columns + list(self.plain)
+
+    @property
+    def header(self):
+        return self.columns + ([self.parent[0]] if self.parent else []) + list(self.links)
+
+    def parent_kind(self):
+        return CATALOG_KINDS[self.parent[1]]
+
+    def key_of(self, values, parent_key=None):
+        name = next((values.get(f'{self.key[0]}_{language}') for language in LANGUAGES
+                     if values.get(f'{self.key[0]}_{language}')), None)
+        key = (name,) + tuple(plain_value(values.get(field)) for field in self.key[1:])
+        return key + (parent_key,) if self.parent else key
+
+    def key_rows(self, queryset):
+        fk = [f'{self.parent[0]}_id'] if self.parent else []
+        rows = list(queryset.values('pk', *[f'{self.key[0]}_{language}' for language in LANGUAGES],
+                                    *self.key[1:], *fk))
+        parent_keys = self.parent_kind().keys_for({row[fk[0]] for row in rows}) if self.parent else {}
+        return [(row['pk'], self.key_of(row, parent_keys.get(row[fk[0]]) if fk else None)) for row in rows]
+
+    def keys_for(self, pks):
+        if not pks:
+            return {}
+        return dict(self.key_rows(self.model.objects.filter(pk__in=pks)))
+
+    def lookup(self, keys):
+        keys = set(keys)
+        if not keys:
+            return {}
+        names = {key[0] for key in keys}
+        name_filter = Q()
+        for language in LANGUAGES:
+            name_filter |= Q(**{f'{self.key[0]}_{language}__in': names})
+        return {key: pk for pk, key in self.key_rows(self.model.objects.filter(name_filter)) if key in keys}
+
+    def export(self, chunk_size=1000):
+        # Keyset chunks, so memory stays flat however large the table is.
+        fk = [f'{self.parent[0]}_id'] if self.parent else []
+        last = 0
+        while True:
+            rows = list(self.model.objects.filter(pk__gt=last).order_by('pk')
+                        .values('pk', *self.columns, *fk)[:chunk_size])
+            if not rows:
+                return
+            last = rows[-1]['pk']
+            parent_keys = self.parent_kind().keys_for({row[fk[0]] for row in rows}) if self.parent else {}
+            links = {field: self.export_links(field, [row['pk'] for row in rows]) for field in self.links}
+            for row in rows:
+                record = {'kind': self.name}
+                record.update((column, plain_value(row[column])) for column in self.columns)
+                if self.parent:
+                    record[self.parent[0]] = parent_keys.get(row[fk[0]])
+                for field, linked in links.items():
+                    record[field] = sorted(linked.get(row['pk'], []), key=str)
+                yield record
+
+    def through(self, field):
+        through = getattr(self.model, field).through
+        target = self.model._meta.get_field(field).related_model
+        return through, f'{self.model._meta.model_name}_id', f'{target._meta.model_name}_id'
+
+    def export_links(self, field, pks):
+        through, source, target = self.through(field)
+        pairs = list(through.objects.filter(**{f'{source}__in': pks}).values_list(source, target))
+        keys = CATALOG_KINDS[self.links[field]].keys_for({target_pk for _, target_pk in pairs})
+        linked = {}
+        for source_pk, target_pk in pairs:
+            linked.setdefault(source_pk, []).append(keys[target_pk])
+        return linked
+
+    def parse(self, record):
+        values = {}
+        for column in self.translated_columns:
+            if column in record:
+                values[column] = record[column]
+        for field in self.plain:
+            if field in record and record[field] not in (None, ''):
+                values[field] = self.model._meta.get_field(field).to_python(record[field])
+        return values
+
+    def missing_fields(self, values):
+        missing = [field for field in self.key[1:] if field not in values]
+        for field in self.plain:
+            model_field = self.model._meta.get_field(field)
+            if (field not in values and not model_field.null and not model_field.has_default()
+                    and not model_field.empty_strings_allowed):
+                missing.append(field)
+        return missing
+
+    def import_chunk(self, records, report):
+        parsed = {}
+        for record in records:
+            values = self.parse(record)
+            parent_key = as_key(record.get(self.parent[0])) if self.parent else None
+            key = self.key_of(values, parent_key)
+            if key[0] is None or (self.parent and parent_key is None):
+                report.error(self.name, record, 'no natural key')
+                continue
+            parsed[key] = (values, parent_key, {field: as_key(record[field]) for field in self.links if field in record})
+
+        parent_pks = self.parent_kind().lookup(item[1] for item in parsed.values()) if self.parent else {}
+        existing = self.lookup(parsed)
+        instances = self.model.objects.in_bulk(list(existing.values()))
+        now = timezone.now()
+        created, updated, linked = [], [], []
+        update_fields = {'updated_at'}
+        for key, (values, parent_key, links) in parsed.items():
+            obj = instances.get(existing.get(key))
+            if obj is None:
+                missing = self.missing_fields(values)
+                if missing:
+                    report.error(self.name, key, f'missing {", ".join(missing)}')
+                    continue
+                # Explicit translations spare modeltranslation's per-field
+                # default lookups, the bulk of instantiation cost.
+                obj = self.model(**{**dict.fromkeys(self.translated_columns), **values})
+            if self.parent:
+                if parent_key not in parent_pks:
+                    report.error(self.name, key, f'unknown {self.parent[0]} {parent_key}')
+                    continue
+                values[f'{self.parent[0]}_id'] = parent_pks[parent_key]
+            changed = obj.pk is None or any(getattr(obj, column) != value for column, value in values.items())
+            if changed:
+                for column, value in values.items():
+                    setattr(obj, column, value)
+                update_fields.update(values)
+                obj.updated_at = now
+                (updated if obj.pk else created).append(obj)
+            linked.append((obj, links))
+
+        # The untranslated columns are derived from the translations on save.
+        update_fields.update(field for field in self.translated
+                             if any(f'{field}_{language}' in update_fields for language in LANGUAGES))
+        with transaction.atomic():
+            # One INSERT ... ON CONFLICT (id) DO UPDATE for new and changed
+            # rows alike; bulk_update's CASE expressions are far slower.
+            self.model.objects.bulk_create(created + updated, batch_size=500, update_conflicts=True,
+                                           unique_fields=['id'], update_fields=sorted(update_fields))
+            relinked = set()
+            for field in self.links:
+                relinked |= self.import_links(
+                    field, [(obj.pk, links[field]) for obj, links in linked if field in links], report)
+            relinked -= {obj.pk for obj in created + updated}
+            if relinked:
+                self.model.objects.filter(pk__in=relinked).update(updated_at=now)
+        unchanged = len(linked) - len(created) - len(updated) - len(relinked)
+        report.add(self.name, len(created), len(updated) + len(relinked), unchanged)
+        return [obj.pk for obj in created], [obj.pk for obj in updated] + list(relinked)
+
+    def import_links(self, field, rows, report):
+        # A record's link list replaces the object's links for that field;
+        # only objects whose links differ are rewritten. Returns their pks.
+        if not rows:
+            return set()
+        through, source, target = self.through(field)
+        kind = CATALOG_KINDS[self.links[field]]
+        targets = kind.lookup(key for _, keys in rows for key in keys)
+        current = {}
+        for source_pk, target_pk in through.objects.filter(
+                **{f'{source}__in': [pk for pk, _ in rows]}).values_list(source, target):
+            current.setdefault(source_pk, set()).add(target_pk)
+        desired = {}
+        for pk, keys in rows:
+            desired[pk] = set()
+            for key in keys:
+                if key in targets:
+                    desired[pk].add(targets[key])
+                else:
+                    report.error(self.name, key, f'unknown {field}')
+        changed = {pk for pk, target_pks in desired.items() if current.get(pk, set()) != target_pks}
+        if changed:
+            through.objects.filter(**{f'{source}__in': changed}).delete()
+            # Plain executemany: link rows are too many and too simple to be
+            # worth instantiating as models.
+            table, quote = through._meta.db_table, connection.ops.quote_name
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    f'INSERT INTO {quote(table)} ({quote(source)}, {quote(target)}) VALUES (%s, %s)',
+                    [(pk, target_pk) for pk in changed for target_pk in desired[pk]])
+        return changed
+
+
+CATALOG_KINDS = {kind.name: kind for kind in [
+    CatalogKind('categories', Category, ('category_name',), key=('category_name',)),
+    CatalogKind('countries', Country, ('country_name',), key=('country_name',)),
+    CatalogKind('genres', Genre, ('genre_name',), key=('genre_name',), parent=('category', 'categories')),
+    CatalogKind('directors', Director, ('full_name', 'bio'), ('director_photo', 'birth_date'),
+                key=('full_name', 'birth_date')),
+    CatalogKind('actors', Actor, ('full_name', 'bio'), ('actor_photo', 'birth_date'),
+                key=('full_name', 'birth_date')),
+    CatalogKind('movies', Movie, ('movie_name', 'description'),
+                ('year', 'movie_type', 'movie_time', 'movie_poster', 'trailer', 'status'),
+                key=('movie_name', 'year'),
+                links={'country': 'countries', 'genre': 'genres', 'director': 'directors', 'actor': 'actors'}),
+]}
+
+
+class ImportReport:
+    max_errors = 50
+
+    def __init__(self):
+        self.created = dict.fromkeys(CATALOG_KINDS, 0)
+        self.updated = dict.fromkeys(CATALOG_KINDS, 0)
+        self.unchanged = dict.fromkeys(CATALOG_KINDS, 0)
+        self.error_count = 0
+        self.errors = []
+
+    def add(self, kind, created, updated, unchanged):
+        self.created[kind] += created
+        self.updated[kind] += updated
+        self.unchanged[kind] += unchanged
+
+    def error(self, kind, key, message):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append(f'{kind} {key}: {message}')
+
+
+def import_records(records, chunk_size=1000, kinds=None):
+    # Records of one kind are written in chunks of `chunk_size`; a dump must
+    # list parents before the objects that link to them, as export does.
+    # The bulk writes bypass the signals, so the workers' in-process
+    # autocomplete and facet indexes only catch up at their next rebuild
+    # (AUTOCOMPLETE_MAX_AGE / FACETS_MAX_AGE), and MediaBlob refcounts of
+    # imported posters and photos until collect_media_garbage recounts them.
+    report = ImportReport()
+    backend = get_search_backend()
+    tags = set()
+    for kind_name, group in groupby(records, key=lambda record: record.get('kind')):
+        if kind_name not in CATALOG_KINDS:
+            report.error(kind_name, '-', 'unknown kind')
+            continue
+        if kinds and kind_name not in kinds:
+            continue
+        kind = CATALOG_KINDS[kind_name]
+        tags.add(CATALOG_CACHE_TAGS[kind.model])
+        chunk = []
+        for record in group:
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                sync_derived(kind, *kind.import_chunk(chunk, report), backend=backend)
+                chunk = []
+        if chunk:
+            sync_derived(kind, *kind.import_chunk(chunk, report), backend=backend)
+    if tags:
+        invalidate(*tags)
+    return report
+
+
+def sync_derived(kind, created, updated, backend):
+    # bulk_create/bulk_update skip the signals that keep the search index and
+    # the movies' updated_at current.
+    if kind.model is Movie:
+        backend.update_movies(created + updated)
+    elif updated and kind.model in MOVIE_LINK_LOOKUPS:
+        lookup = {f'{MOVIE_LINK_LOOKUPS[kind.model]}__in': updated}
+        touch_movies(**lookup)
+        if kind.model in (Actor, Director):
+            backend.update_movies(Movie.objects.filter(**lookup).values_list('pk', flat=True).distinct())
+
+
+def export_records(kinds=None, chunk_size=1000):
+    for name, kind in CATALOG_KINDS.items():
+        if not kinds or name in kinds:
+            yield from kind.export(chunk_size)
+
+
+def write_jsonl(records, stream):
+    count = 0
+    for record in records:
+        stream.write(json.dumps(record, ensure_ascii=False) + '\n')
+        count += 1
+    return count
+
+
+def read_jsonl(stream):
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+def write_csv(kind, records, stream):
+    # Parent and link keys are JSON inside their cells.
+    writer = csv.DictWriter(stream, fieldnames=kind.header, extrasaction='ignore')
+    writer.writeheader()
+    count = 0
+    for record in records:
+        writer.writerow({
+            column: json.dumps(value, ensure_ascii=False) if isinstance(value, (list, tuple)) else value
+            for column, value in record.items()
+        })
+        count += 1
+    return count
+
+
+def read_csv(kind, stream):
+    relations = ([kind.parent[0]] if kind.parent else []) + list(kind.links)
+    for row in csv.DictReader(stream):
+        record = {'kind': kind.name, **row}
+        for column in kind.translated_columns:
+            if record.get(column) == '':
+                record[column] = None
+        for column in relations:
+            if record.get(column):
+                record[column] = json.loads(record[column])
+            else:
+                record.pop(column, None)
+        yield record
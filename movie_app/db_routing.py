@@ -0,0 +1,91 @@
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+
+# Set for the duration of a catalog read view whose user is not pinned.
+reading_from_replica = ContextVar('reading_from_replica', default=False)
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias != DEFAULT_DB_ALIAS]
+
+
+def pin_cache():
+    # Must be shared between processes for pins to follow a user across workers.
+    return caches[getattr(settings, 'REPLICA_PIN_CACHE_ALIAS', 'replica_pins')]
+
+
+def pin_key(user_id):
+    return f'db:pin:{user_id}'
+
+
+def pin_to_primary(user_id):
+    seconds = getattr(settings, 'REPLICA_STICKY_SECONDS', 10)
+    if seconds:
+        pin_cache().set(pin_key(user_id), time.time() + seconds, seconds)
+
+
+def is_pinned(user_id):
+    until = pin_cache().get(pin_key(user_id))
+    return until is not None and until > time.time()
+
+
+class ReplicaRouter:
+    # Writes and ordinary reads go to the primary; only catalog views using
+    # ReplicaReadMixin read from a replica, and not for users who wrote
+    # something in the last REPLICA_STICKY_SECONDS (read-your-writes).
+
+    def db_for_read(self, model, **hints):
+        if reading_from_replica.get():
+            replicas = replica_aliases()
+            if replicas:
+                return random.choice(replicas)
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaReadMixin:
+    # For read-only catalog views: their queries may be served by a replica.
+
+    def dispatch(self, request, *args, **kwargs):
+        token = reading_from_replica.set(False)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            reading_from_replica.reset(token)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        user = request.user
+        if request.method in ('GET', 'HEAD', 'OPTIONS') and not (user.is_authenticated and is_pinned(user.pk)):
+            reading_from_replica.set(True)
+
+
+class ReplicaStickinessMiddleware:
+    # After a successful write, pins the user to the primary so their next
+    # reads do not hit a replica that has not caught up yet.
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE') and response.status_code < 400:
+            # DRF copies the token-authenticated user onto the Django request.
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated and replica_aliases():
+                pin_to_primary(user.pk)
+        return response
@@ -0,0 +1,181 @@
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import connections
+
+from .models import Movie
+
+FACETS = ('genre', 'country', 'year', 'movie_type', 'status')
+# facet -> type of its query-string values
+FACET_TYPES = {'genre': int, 'country': int, 'year': int, 'movie_type': str, 'status': str}
+# many-to-many facets -> (link table, column)
+LINK_FACETS = {
+    'genre': (Movie.genre.through, 'genre_id'),
+    'country': (Movie.country.through, 'country_id'),
+}
+EMPTY = np.empty(0, dtype=np.int64)
+
+
+def year_bucket(year):
+    # Decades: 1994 -> 1990.
+    return year.year // 10 * 10
+
+
+def load(movie_ids=None):
+    # Sorted ids of the movies and their posting lists, facet -> value ->
+    # sorted array of movie ids; for every movie or just `movie_ids`.
+    movies = Movie.objects.order_by()
+    if movie_ids is not None:
+        movies = movies.filter(pk__in=movie_ids)
+    grouped = {facet: {} for facet in FACETS}
+    ids = []
+    for pk, year, movie_type, status in movies.values_list('pk', 'year', 'movie_type', 'status').iterator(
+            chunk_size=5000):
+        ids.append(pk)
+        grouped['year'].setdefault(year_bucket(year), []).append(pk)
+        grouped['movie_type'].setdefault(movie_type, []).append(pk)
+        grouped['status'].setdefault(status, []).append(pk)
+    for facet, (through, column) in LINK_FACETS.items():
+        links = through.objects.order_by()
+        if movie_ids is not None:
+            links = links.filter(movie_id__in=movie_ids)
+        for movie_id, value in links.values_list('movie_id', column).iterator(chunk_size=20_000):
+            grouped[facet].setdefault(value, []).append(movie_id)
+    postings = {facet: {value: np.unique(np.array(members, dtype=np.int64)) for value, members in values.items()}
+                for facet, values in grouped.items()}
+    return np.unique(np.array(ids, dtype=np.int64)), postings
+
+
+def without(posting, movie_ids):
+    found = np.searchsorted(posting, movie_ids)
+    found = found[found < len(posting)]
+    found = found[np.isin(posting[found], movie_ids)]
+    return np.delete(posting, found) if len(found) else posting
+
+
+class FacetIndex:
+    # Per-facet posting lists of movie ids, kept per process and updated
+    # through the Movie save/delete and genre/country m2m_changed signals.
+    # Filters intersect them as bitmaps over movie ids, and each value's
+    # count is the number of its postings left set, so a query costs a few
+    # passes over the posting lists instead of M2M joins and GROUP BYs.
+
+    def __init__(self, max_age=None):
+        self.max_age = max_age if max_age is not None else getattr(settings, 'FACETS_MAX_AGE', None)
+        self.lock = threading.RLock()
+        self.build_lock = threading.Lock()
+        self.movie_ids = EMPTY
+        self.postings = {facet: {} for facet in FACETS}
+        self.built_at = None
+        # Movies reloaded while a rebuild runs, reloaded again on its result.
+        self.journal = None
+
+    @property
+    def is_built(self):
+        return self.built_at is not None
+
+    def build(self):
+        with self.lock:
+            self.journal = set()
+        movie_ids, postings = load()
+        with self.lock:
+            self.movie_ids, self.postings = movie_ids, postings
+            self.built_at = time.monotonic()
+            journal, self.journal = self.journal or set(), None
+        if journal:
+            self.reload(journal)
+
+    def is_stale(self):
+        return not self.is_built or (self.max_age is not None and time.monotonic() - self.built_at > self.max_age)
+
+    def ensure_fresh(self):
+        # Other processes' writes only reach this index through a rebuild, so
+        # FACETS_MAX_AGE bounds how stale a worker can get. Only the first
+        # build runs on the calling thread; afterwards searches keep using
+        # the stale lists while a background thread rebuilds them.
+        if not self.is_built:
+            with self.build_lock:
+                if not self.is_built:
+                    self.build()
+        elif self.is_stale() and self.build_lock.acquire(blocking=False):
+            threading.Thread(target=self.rebuild_in_background, name='facets-rebuild', daemon=True).start()
+
+    def rebuild_in_background(self):
+        # Runs holding build_lock, taken by ensure_fresh.
+        try:
+            self.build()
+        finally:
+            with self.lock:
+                self.journal = None
+            self.build_lock.release()
+            connections.close_all()
+
+    def reload(self, movie_ids):
+        # Re-reads the facet values of `movie_ids` after they were saved,
+        # relinked or deleted. Arrays are replaced, never changed in place,
+        # so searches holding the old ones are unaffected.
+        movie_ids = np.unique(np.array(list(movie_ids), dtype=np.int64))
+        with self.lock:
+            if self.journal is not None:
+                self.journal.update(movie_ids.tolist())
+        fresh_ids, fresh = load(movie_ids.tolist())
+        with self.lock:
+            self.movie_ids = np.union1d(without(self.movie_ids, movie_ids), fresh_ids)
+            for facet, values in self.postings.items():
+                for value in values.keys() | fresh[facet].keys():
+                    posting = without(values.get(value, EMPTY), movie_ids)
+                    if value in fresh[facet]:
+                        posting = np.union1d(posting, fresh[facet][value])
+                    if len(posting):
+                        values[value] = posting
+                    else:
+                        values.pop(value, None)
+
+    def search(self, filters):
+        # filters: facet -> selected values, OR-ed within a facet and AND-ed
+        # across facets. Returns the sorted ids of the matching movies and,
+        # per facet, [(value, count)] by count: each facet is counted with
+        # every filter but its own, so a client can see what widening its
+        # selection would give.
+        with self.lock:
+            movie_ids = self.movie_ids
+            postings = {facet: dict(values) for facet, values in self.postings.items()}
+        size = int(movie_ids[-1]) + 1 if len(movie_ids) else 1
+        selected = {}
+        for facet, values in filters.items():
+            mask = np.zeros(size, dtype=bool)
+            for value in values:
+                mask[postings[facet].get(value, EMPTY)] = True
+            selected[facet] = mask
+
+        def matching(skip=None):
+            mask = np.zeros(size, dtype=bool)
+            mask[movie_ids] = True
+            for facet, selection in selected.items():
+                if facet != skip:
+                    mask &= selection
+            return mask
+
+        everything = matching()
+        counts = {}
+        for facet in FACETS:
+            mask = matching(facet) if facet in selected else everything
+            values = [(value, int(np.count_nonzero(mask[posting]))) for value, posting in postings[facet].items()]
+            counts[facet] = sorted([item for item in values if item[1]], key=lambda item: (-item[1], item[0]))
+        return movie_ids[everything[movie_ids]], counts
+
+    def stats(self):
+        with self.lock:
+            postings = [posting for values in self.postings.values() for posting in values.values()]
+            return {
+                'movies': len(self.movie_ids),
+                'posting_lists': len(postings),
+                'postings': sum(len(posting) for posting in postings),
+                'approx_bytes': self.movie_ids.nbytes + sum(posting.nbytes for posting in postings),
+                'age_seconds': None if self.built_at is None else round(time.monotonic() - self.built_at, 1),
+            }
+
+
+facet_index = FacetIndex()
@@ -1,5 +1,22 @@
-from django_filters import FilterSet
+import datetime
+
+from django import forms
+from django_filters import BaseInFilter, CharFilter, FilterSet, NumberFilter
+from rest_framework.filters import SearchFilter
 from .models import Country, Genre, Movie, Actor
+from .search import get_search_backend
+
+
+class IntegerFilter(NumberFilter):
+    field_class = forms.IntegerField
+
+
+class IntegerInFilter(BaseInFilter, IntegerFilter):
+    pass
+
+
+class CharInFilter(BaseInFilter, CharFilter):
+    pass
 
 
 class CountryFilter(FilterSet):
@@ -19,13 +36,54 @@ class GenreFilter(FilterSet):
 
 
 class MovieFilter(FilterSet):
+    # ?year_min=1990&year_max=1999 and ?movie_time_min=90&movie_time_max=120
+    # are ranges; ?genre=1,2 matches any of the genres and ?genre_all=1,2
+    # all of them, likewise for country and actor; ?movie_type=720p,1080p is
+    # a set; ?rating_min=7 reads the stored rating_avg. Link filters are
+    # semi-joins on the link tables' (<link>_id, movie_id) indexes rather
+    # than joins, so pages need no DISTINCT.
+    LINKS = {
+        'genre': (Movie.genre.through, 'genre_id'),
+        'country': (Movie.country.through, 'country_id'),
+        'actor': (Movie.actor.through, 'actor_id'),
+    }
+
+    year_min = IntegerFilter(method='filter_year', min_value=1, max_value=9999)
+    year_max = IntegerFilter(method='filter_year', min_value=1, max_value=9999)
+    movie_time_min = IntegerFilter(field_name='movie_time', lookup_expr='gte')
+    movie_time_max = IntegerFilter(field_name='movie_time', lookup_expr='lte')
+    genre = IntegerInFilter(method='filter_any')
+    genre_all = IntegerInFilter(method='filter_all')
+    country = IntegerInFilter(method='filter_any')
+    country_all = IntegerInFilter(method='filter_all')
+    actor = IntegerInFilter(method='filter_any')
+    actor_all = IntegerInFilter(method='filter_all')
+    movie_type = CharInFilter(field_name='movie_type', lookup_expr='in')
+    rating_min = NumberFilter(field_name='rating_avg', lookup_expr='gte')
+
     class Meta:
         model = Movie
         fields = {
             'status': ['exact'],
-            'country': ['exact']
         }
 
+    def filter_year(self, queryset, name, value):
+        if name == 'year_min':
+            return queryset.filter(year__gte=datetime.date(value, 1, 1))
+        return queryset.filter(year__lte=datetime.date(value, 12, 31))
+
+    def linked(self, name, ids):
+        through, column = self.LINKS[name]
+        return through.objects.filter(**{f'{column}__in': ids}).values('movie_id')
+
+    def filter_any(self, queryset, name, value):
+        return queryset.filter(pk__in=self.linked(name, value))
+
+    def filter_all(self, queryset, name, value):
+        for pk in set(value):
+            queryset = queryset.filter(pk__in=self.linked(name.removesuffix('_all'), [pk]))
+        return queryset
+
 
 class ActorFilter(FilterSet):
     class Meta:
@@ -33,3 +91,13 @@ class ActorFilter(FilterSet):
         fields = {
             'full_name': ['exact']
         }
+
+
+class MovieSearchFilter(SearchFilter):
+    # ?search= goes through the full-text index over both translations and
+    # actor/director names instead of LIKE scans on search_fields.
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '')
+        if not query.strip():
+            return queryset
+        return get_search_backend().filter_queryset(queryset, query)
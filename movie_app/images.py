@@ -0,0 +1,234 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import Q
+from PIL import Image, ImageOps, features
+
+from .cache import invalidate
+from .models import UserProfile, Director, Actor, Movie, MovieFrame, ActorImage, Review
+from .storage import blob_hash
+
+# model -> image columns (translated images list each language column)
+IMAGE_FIELDS = {
+    Movie: ('movie_poster',),
+    MovieFrame: ('image_ru', 'image_en'),
+    Actor: ('actor_photo',),
+    Director: ('director_photo',),
+    ActorImage: ('image',),
+    UserProfile: ('user_photo',),
+}
+# model -> cache tags of the responses that show its images' srcsets
+IMAGE_CACHE_TAGS = {
+    Movie: lambda pks: ['movie', *[f'movie:{pk}' for pk in pks]],
+    MovieFrame: lambda pks: [f'movie:{pk}' for pk in MovieFrame.objects.filter(pk__in=pks)
+                             .values_list('movie_id', flat=True).distinct()],
+    Actor: lambda pks: ['actor'],
+    Director: lambda pks: ['director'],
+    ActorImage: lambda pks: ['actor'],
+    # Reviews inlined into movie details.
+    UserProfile: lambda pks: [f'movie:{pk}' for pk in Review.objects.filter(user_id__in=pks)
+                              .values_list('movie_id', flat=True).distinct()],
+}
+DERIVATIVE_DIR = 'derivatives'
+HASH_CHUNK_SIZE = 1 << 20
+FORMAT_OPTIONS = {
+    'avif': ('AVIF', {'quality': 55}),
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def derivative_widths():
+    return sorted(getattr(settings, 'IMAGE_DERIVATIVE_WIDTHS', (160, 320, 640, 1280)))
+
+
+def derivative_formats():
+    # AVIF needs a Pillow built with libavif; the others always work.
+    formats = getattr(settings, 'IMAGE_DERIVATIVE_FORMATS', ('avif', 'webp', 'jpeg'))
+    return [fmt for fmt in formats if fmt != 'avif' or features.check('avif')]
+
+
+def derivative_path(*parts):
+    return os.path.join(settings.MEDIA_ROOT, DERIVATIVE_DIR, *parts)
+
+
+def alias_path(name):
+    # Per-upload pointer to the content-addressed derivatives of its bytes.
+    digest = hashlib.sha1(name.encode()).hexdigest()
+    return derivative_path('names', digest[:2], f'{digest}.json')
+
+
+def content_hash(name):
+    if blob_hash(name):
+        return blob_hash(name)
+    digest = hashlib.sha256()
+    with default_storage.open(name, 'rb') as source:
+        for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temporary, 'wb') as target:
+        target.write(data)
+    os.replace(temporary, path)
+
+
+def encode(image, fmt):
+    pil_format, options = FORMAT_OPTIONS[fmt]
+    if fmt == 'jpeg' and image.mode != 'RGB':
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A') if 'A' in image.getbands() else None)
+        image = background
+    buffer = io.BytesIO()
+    image.save(buffer, pil_format, **options)
+    return buffer.getvalue()
+
+
+def generate(name):
+    # Builds every width/format of one upload. Derivatives live under the
+    # sha256 of the original, so identical uploads share one set and only
+    # the first is ever resized. Returns (manifest, 'generated' | 'deduplicated').
+    digest = content_hash(name)
+    blob_dir = derivative_path('blobs', digest[:2], digest)
+    manifest_path = os.path.join(blob_dir, 'manifest.json')
+    outcome = 'deduplicated'
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as stream:
+            manifest = json.load(stream)
+    else:
+        outcome = 'generated'
+        with default_storage.open(name, 'rb') as source:
+            image = Image.open(source)
+            orientation = image.getexif().get(0x0112, 1)
+            full_width, full_height = image.size if orientation < 5 else image.size[::-1]
+            widths = [width for width in derivative_widths() if width < full_width] or [full_width]
+            # JPEG decoders can downscale by powers of two while decoding.
+            image.draft('RGB', (widths[-1], widths[-1]))
+            image = ImageOps.exif_transpose(image)
+            image = image.convert('RGBA' if 'A' in image.getbands() or image.mode == 'P' else 'RGB')
+        formats = derivative_formats()
+        for width in reversed(widths):
+            height = max(1, round(full_height * width / full_width))
+            # Each smaller width is resized from the previous one, not the original.
+            image = image.resize((width, height), Image.Resampling.LANCZOS) if image.width != width else image
+            for fmt in formats:
+                write_atomic(os.path.join(blob_dir, f'{width}.{fmt}'), encode(image, fmt))
+        manifest = {'hash': digest, 'width': full_width, 'height': full_height,
+                    'widths': widths, 'formats': formats}
+        write_atomic(manifest_path, json.dumps(manifest).encode())
+    ready = os.path.exists(alias_path(name))
+    write_atomic(alias_path(name), json.dumps(manifest).encode())
+    if not ready:
+        # Responses cached before now hold a None srcset for this upload.
+        invalidate(*image_cache_tags(name))
+    return manifest, outcome
+
+
+def image_cache_tags(name):
+    tags = []
+    for model, fields in IMAGE_FIELDS.items():
+        query = Q()
+        for field in fields:
+            query |= Q(**{field: name})
+        pks = list(model.objects.filter(query).values_list('pk', flat=True))
+        if pks:
+            tags += IMAGE_CACHE_TAGS[model](pks)
+    return tags
+
+
+class DerivativePipeline:
+    # Runs `generate` on a small thread pool (Pillow releases the GIL while
+    # resizing and encoding) so uploads and list requests never wait on it.
+    # Ready manifests are memoized per process; failures are retried after
+    # `retry_after` seconds instead of on every request.
+    retry_after = 600
+    max_cached = 20_000
+
+    def __init__(self, workers=None):
+        self.workers = workers or getattr(settings, 'IMAGE_DERIVATIVE_WORKERS', 2)
+        self.lock = threading.Lock()
+        self.executor = None
+        self.in_flight = set()
+        self.failed = {}
+        self.manifests = OrderedDict()
+
+    def submit(self, name):
+        if not name:
+            return
+        with self.lock:
+            if name in self.in_flight or time.monotonic() < self.failed.get(name, 0):
+                return
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix='image-derivatives')
+            self.in_flight.add(name)
+        self.executor.submit(self.run, name)
+
+    def run(self, name):
+        try:
+            manifest, _ = generate(name)
+        except Exception:
+            with self.lock:
+                self.failed[name] = time.monotonic() + self.retry_after
+            return
+        finally:
+            with self.lock:
+                self.in_flight.discard(name)
+        self.remember(name, manifest)
+
+    def remember(self, name, manifest):
+        with self.lock:
+            self.manifests[name] = manifest
+            self.manifests.move_to_end(name)
+            while len(self.manifests) > self.max_cached:
+                self.manifests.popitem(last=False)
+
+    def manifest(self, name):
+        # The manifest of a ready upload; otherwise queue it and return None.
+        with self.lock:
+            manifest = self.manifests.get(name)
+            if manifest is None and name in self.in_flight:
+                return None
+        if manifest is not None:
+            return manifest
+        try:
+            with open(alias_path(name)) as stream:
+                manifest = json.load(stream)
+        except (OSError, ValueError):
+            self.submit(name)
+            return None
+        self.remember(name, manifest)
+        return manifest
+
+
+image_pipeline = DerivativePipeline()
+
+
+def srcset(name, build_url=None):
+    manifest = image_pipeline.manifest(name) if name else None
+    if manifest is None:
+        return None
+    build_url = build_url or (lambda url: url)
+    digest = manifest['hash']
+
+    def url(width, fmt):
+        return build_url(f'{settings.MEDIA_URL}{DERIVATIVE_DIR}/blobs/{digest[:2]}/{digest}/{width}.{fmt}')
+
+    widths = manifest['widths']
+    fallback = 'jpeg' if 'jpeg' in manifest['formats'] else manifest['formats'][-1]
+    return {
+        'width': manifest['width'],
+        'height': manifest['height'],
+        'src': url(widths[len(widths) // 2], fallback),
+        **{fmt: ', '.join(f'{url(width, fmt)} {width}w' for width in widths) for fmt in manifest['formats']},
+    }
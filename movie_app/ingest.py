@@ -0,0 +1,170 @@
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+
+from .models import History, Movie, UserProfile
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryBuffer:
+    # Watch events wait in memory and a background thread writes them with
+    # one bulk INSERT per flush, when `flush_size` events are pending or
+    # `flush_interval` seconds have passed. A user re-sending the movie they
+    # just sent within `dedup_window` seconds (playback heartbeats) is
+    # collapsed into the pending row. A batch that does not fit in
+    # `max_events` is refused whole, so clients back off instead of the
+    # process growing without bound. Rows are stamped at flush time. A batch
+    # whose write fails goes back to the front of the queue and is retried
+    # every `flush_interval` seconds, `flush_retries` times, before it is
+    # dropped.
+
+    def __init__(self, max_events=None, flush_size=None, flush_interval=None, dedup_window=None, flush_retries=None):
+        self.max_events = max_events or getattr(settings, 'HISTORY_BUFFER_MAX_EVENTS', 50_000)
+        self.flush_size = flush_size or getattr(settings, 'HISTORY_BUFFER_FLUSH_SIZE', 500)
+        self.flush_interval = flush_interval or getattr(settings, 'HISTORY_BUFFER_FLUSH_INTERVAL', 1.0)
+        self.dedup_window = dedup_window if dedup_window is not None else getattr(settings, 'HISTORY_DEDUP_WINDOW', 30)
+        self.flush_retries = (flush_retries if flush_retries is not None
+                              else getattr(settings, 'HISTORY_BUFFER_FLUSH_RETRIES', 3))
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.flush_lock = threading.Lock()
+        self.pending = []
+        self.last_seen = {}
+        # Failed writes in a row of the first `retrying` pending events.
+        self.failures = self.retrying = 0
+        self.flusher = None
+        self.counters = dict.fromkeys([
+            'received', 'accepted', 'collapsed', 'rejected', 'flushes',
+            'rows_written', 'rows_retried', 'rows_dropped', 'flush_errors', 'high_water'], 0)
+        self.last_flush_ms = None
+        self.max_flush_ms = 0.0
+
+    def add(self, user_id, movie_ids):
+        # Returns (accepted, collapsed); (0, 0) means the batch was refused.
+        now = time.monotonic()
+        with self.lock:
+            self.counters['received'] += len(movie_ids)
+            if len(self.pending) + len(movie_ids) > self.max_events:
+                self.counters['rejected'] += len(movie_ids)
+                return 0, 0
+            accepted = collapsed = 0
+            for movie_id in movie_ids:
+                last = self.last_seen.get(user_id)
+                self.last_seen[user_id] = (movie_id, now)
+                if last is not None and last[0] == movie_id and now - last[1] < self.dedup_window:
+                    collapsed += 1
+                    continue
+                self.pending.append((user_id, movie_id))
+                accepted += 1
+            self.counters['accepted'] += accepted
+            self.counters['collapsed'] += collapsed
+            self.counters['high_water'] = max(self.counters['high_water'], len(self.pending))
+            if len(self.pending) >= self.flush_size:
+                self.ready.notify()
+        self.ensure_flusher()
+        return accepted, collapsed
+
+    def ensure_flusher(self):
+        # Also restarts the thread in forked workers, which do not inherit it.
+        if self.flusher is None or not self.flusher.is_alive():
+            with self.lock:
+                if self.flusher is None or not self.flusher.is_alive():
+                    self.flusher = threading.Thread(target=self.run, name='history-flusher', daemon=True)
+                    self.flusher.start()
+
+    def run(self):
+        while True:
+            with self.lock:
+                self.ready.wait_for(lambda: len(self.pending) >= self.flush_size, timeout=self.flush_interval)
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+            if self.failures:
+                # Back off instead of hammering the database with the batch
+                # that just failed.
+                time.sleep(self.flush_interval)
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                batch, self.pending = self.pending, []
+                cutoff = time.monotonic() - self.dedup_window
+                self.last_seen = {user_id: seen for user_id, seen in self.last_seen.items() if seen[1] > cutoff}
+            if not batch:
+                return 0
+            started = time.perf_counter()
+            error = None
+            try:
+                written = self.write(batch)
+            except Exception as exc:
+                written, error = 0, exc
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            dropped = []
+            with self.lock:
+                self.counters['flushes'] += 1
+                self.counters['flush_errors'] += error is not None
+                self.counters['rows_written'] += written
+                if error is None:
+                    self.counters['rows_dropped'] += len(batch) - written
+                    self.failures, self.retrying = 0, 0
+                else:
+                    # The first `retrying` events have now failed `failures`
+                    # times, the newer ones behind them once. Those out of
+                    # retries are dropped, the rest go back for another try.
+                    prefix = self.retrying if self.failures else len(batch)
+                    self.failures += 1
+                    if self.failures > self.flush_retries:
+                        dropped, batch = batch[:prefix], batch[prefix:]
+                        self.failures, prefix = (1, len(batch)) if batch else (0, 0)
+                    self.retrying = prefix
+                    self.pending[:0] = batch
+                    self.counters['rows_dropped'] += len(dropped)
+                    self.counters['rows_retried'] += len(batch)
+                self.last_flush_ms = round(elapsed_ms, 2)
+                self.max_flush_ms = max(self.max_flush_ms, self.last_flush_ms)
+            if dropped:
+                logger.error('History flush failed, dropped %d events after %d retries',
+                             len(dropped), self.flush_retries, exc_info=error)
+            elif error is not None:
+                logger.warning('History flush of %d events failed, retry %d of %d',
+                               len(batch), self.failures, self.flush_retries, exc_info=error)
+            return written
+
+    def write(self, batch):
+        rows = [History(user_id=user_id, movie_id=movie_id) for user_id, movie_id in batch]
+        try:
+            with transaction.atomic():
+                History.objects.bulk_create(rows, batch_size=self.flush_size)
+            return len(rows)
+        except IntegrityError:
+            # A movie or user was deleted while its events were pending.
+            movie_ids = set(Movie.objects.filter(pk__in={row.movie_id for row in rows}).values_list('pk', flat=True))
+            user_ids = set(UserProfile.objects.filter(pk__in={row.user_id for row in rows}).values_list('pk', flat=True))
+            rows = [History(user_id=row.user_id, movie_id=row.movie_id) for row in rows
+                    if row.movie_id in movie_ids and row.user_id in user_ids]
+            with transaction.atomic():
+                History.objects.bulk_create(rows, batch_size=self.flush_size)
+            return len(rows)
+
+    def stats(self):
+        with self.lock:
+            return {
+                **self.counters,
+                'pending': len(self.pending),
+                'max_events': self.max_events,
+                'utilization': round(len(self.pending) / self.max_events, 3),
+                'flush_size': self.flush_size,
+                'flush_interval': self.flush_interval,
+                'last_flush_ms': self.last_flush_ms,
+                'max_flush_ms': self.max_flush_ms,
+            }
+
+
+history_buffer = HistoryBuffer()
+atexit.register(history_buffer.flush)
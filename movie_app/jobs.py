@@ -0,0 +1,176 @@
+import os
+import random
+import socket
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+
+from .models import Job
+
+TASKS = {}
+PERIODIC = {}
+
+
+class Task:
+    def __init__(self, func, name, max_attempts, backoff):
+        self.func = func
+        self.name = name
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+
+    def __call__(self, **kwargs):
+        return self.func(**kwargs)
+
+    def delay(self, key=None, countdown=0, **kwargs):
+        return enqueue(self.name, key=key, countdown=countdown, **kwargs)
+
+
+def task(name=None, max_attempts=5, backoff=30):
+    # Registers a function as a job handler. Handlers take JSON-serializable
+    # keyword arguments and must be safe to run more than once.
+    def register(func):
+        registered = Task(func, name or func.__name__, max_attempts, backoff)
+        TASKS[registered.name] = registered
+        return registered
+    return register
+
+
+def periodic(every, name=None, **options):
+    # A task the worker schedules itself every `every` seconds.
+    def register(func):
+        registered = task(name, **options)(func)
+        PERIODIC[registered.name] = every
+        return registered
+    return register
+
+
+def jobs_in_background():
+    return getattr(settings, 'JOBS_BACKGROUND', False)
+
+
+def enqueue(name, key=None, countdown=0, **kwargs):
+    # Adds a job, or returns the already queued one holding the same
+    # idempotency key: repeated requests for the same work coalesce until a
+    # worker picks it up. JOBS_EAGER runs the handler right away instead.
+    if getattr(settings, 'JOBS_EAGER', False):
+        TASKS[name](**kwargs)
+        return None
+    task = TASKS[name]
+    job = Job(name=name, kwargs=kwargs, key=key, max_attempts=task.max_attempts,
+              run_after=timezone.now() + timedelta(seconds=countdown))
+    if key is None:
+        job.save()
+        return job
+    try:
+        with transaction.atomic():
+            job.save()
+        return job
+    except IntegrityError:
+        return Job.objects.filter(key=key, status='queued').first()
+
+
+def dispatch(task, key=None, **kwargs):
+    # Runs `task` inline, or once the surrounding transaction commits as a
+    # queued job when JOBS_BACKGROUND is on.
+    if jobs_in_background():
+        transaction.on_commit(lambda: task.delay(key=key, **kwargs))
+    else:
+        task(**kwargs)
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def claim(limit):
+    # A conditional UPDATE per job, so concurrent workers never run the same
+    # job twice, on any database backend.
+    claimed = []
+    due = (Job.objects.filter(status='queued', run_after__lte=timezone.now())
+           .order_by('run_after', 'id').values_list('pk', flat=True)[:limit * 2])
+    for pk in due:
+        if Job.objects.filter(pk=pk, status='queued').update(
+                status='running', worker=worker_name(), updated_at=timezone.now()):
+            claimed.append(pk)
+            if len(claimed) == limit:
+                break
+    return claimed
+
+
+def retry_delay(task, attempts):
+    # Exponential backoff with jitter, capped at an hour.
+    return min(task.backoff * 2 ** (attempts - 1), 3600) * random.uniform(0.8, 1.2)
+
+
+def execute(job_id):
+    # Pool entry point; records the outcome on the Job row.
+    close_old_connections()
+    try:
+        job = Job.objects.get(pk=job_id)
+        job.attempts += 1
+        Job.objects.filter(pk=job_id).update(attempts=job.attempts)
+        task = TASKS.get(job.name)
+        try:
+            if task is None:
+                raise LookupError(f'Unknown task {job.name!r}')
+            task(**job.kwargs)
+        except Exception:
+            error = traceback.format_exc()[-4000:]
+            if task is not None and job.attempts < job.max_attempts:
+                requeue(job_id, last_error=error,
+                        run_after=timezone.now() + timedelta(seconds=retry_delay(task, job.attempts)))
+                return job_id, 'retry'
+            Job.objects.filter(pk=job_id).update(status='failed', last_error=error, updated_at=timezone.now())
+            return job_id, 'failed'
+        Job.objects.filter(pk=job_id).update(status='done', updated_at=timezone.now())
+        return job_id, 'done'
+    finally:
+        close_old_connections()
+
+
+def schedule_periodic():
+    # Keeps exactly one queued job per periodic task; its key makes
+    # concurrent workers agree on it.
+    for name, every in PERIODIC.items():
+        if not Job.objects.filter(name=name, status__in=['queued', 'running']).exists():
+            last = Job.objects.filter(name=name).order_by('-created_date').values_list('created_date', flat=True).first()
+            countdown = 0 if last is None else max(0, (last + timedelta(seconds=every) - timezone.now()).total_seconds())
+            enqueue(name, key=f'periodic:{name}', countdown=countdown)
+
+
+def requeue(job_id, **fields):
+    # A job whose key was queued again meanwhile is superseded by that job.
+    try:
+        with transaction.atomic():
+            Job.objects.filter(pk=job_id).update(status='queued', updated_at=timezone.now(), **fields)
+    except IntegrityError:
+        Job.objects.filter(pk=job_id).update(status='done', updated_at=timezone.now(),
+                                             last_error='superseded by a newer queued job with the same key')
+
+
+def requeue_stale(minutes):
+    # Jobs left 'running' by a worker that died.
+    cutoff = timezone.now() - timedelta(minutes=minutes)
+    stale = list(Job.objects.filter(status='running', updated_at__lt=cutoff).values_list('pk', flat=True))
+    for pk in stale:
+        requeue(pk)
+    return len(stale)
+
+
+def purge_finished(days):
+    cutoff = timezone.now() - timedelta(days=days)
+    return Job.objects.filter(status='done', updated_at__lt=cutoff).delete()[0]
+
+
+def run_pending(limit=None):
+    # Drains due jobs in this thread; for tests and one-off local runs.
+    outcomes = []
+    while limit is None or len(outcomes) < limit:
+        claimed = claim(1)
+        if not claimed:
+            break
+        outcomes.append(execute(claimed[0]))
+    return outcomes
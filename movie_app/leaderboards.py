@@ -0,0 +1,183 @@
+import math
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import Movie, History, Leaderboard, LeaderboardEntry
+
+TRENDING = 'trending'
+TOP_RATED = 'top_rated'
+BOARDS = (TRENDING, TOP_RATED)
+# Trending scores are log(sum(exp(rate * (viewed_at - EPOCH)))) over a
+# movie's views: a new view is added without decaying anything stored, the
+# order is that of the decayed view counts, and the logs never overflow.
+EPOCH = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+# Views younger than this may still sit in uncommitted transactions behind
+# smaller ids, so a refresh stops at the first one.
+SETTLE = timedelta(seconds=10)
+# Movies whose decayed view count falls below this leave the trending board.
+TRENDING_MIN_VIEWS = 0.05
+# A full rebuild replays this many half-lives of history.
+TRENDING_HORIZON = 10
+# Every top-rated score is recomputed once the catalog mean drifts this far.
+MEAN_TOLERANCE = 0.01
+CHUNK_SIZE = 1000
+
+
+def decay_rate():
+    return math.log(2) / (getattr(settings, 'LEADERBOARD_HALF_LIFE_HOURS', 48) * 3600)
+
+
+def rating_prior():
+    return getattr(settings, 'LEADERBOARD_RATING_PRIOR', 20)
+
+
+def log_weight(when):
+    return decay_rate() * (when - EPOCH).total_seconds()
+
+
+def log_add(a, b):
+    high, low = max(a, b), min(a, b)
+    return high if low == -math.inf else high + math.log1p(math.exp(low - high))
+
+
+def bayesian(rating_sum, rating_count, mean, prior):
+    return (prior * mean + rating_sum) / (prior + rating_count)
+
+
+def scope(genre=None, country=None):
+    parts = ([f'genre:{genre}'] if genre else []) + ([f'country:{country}'] if country else [])
+    return '|'.join(parts) or 'all'
+
+
+def scopes(genre_ids, country_ids):
+    return ([scope()] + [scope(genre=genre) for genre in genre_ids]
+            + [scope(country=country) for country in country_ids]
+            + [scope(genre, country) for genre in genre_ids for country in country_ids])
+
+
+def display_score(board, score, now=None):
+    # Trending: views decayed to now; top rated: the weighted rating.
+    if board == TRENDING:
+        score = math.exp(score - log_weight(now or timezone.now()))
+    return round(score, 3)
+
+
+def chunks(values):
+    values = list(values)
+    for start in range(0, len(values), CHUNK_SIZE):
+        yield values[start:start + CHUNK_SIZE]
+
+
+def view_gains(views, settled_before, cursor):
+    # Log-summed weights of new views per movie, in id order up to the first
+    # unsettled view. Returns them with the id to resume after.
+    gains = {}
+    rate = decay_rate()
+    rows = views.order_by('pk').values_list('pk', 'movie_id', 'created_date')
+    for pk, movie_id, created_date in rows.iterator(chunk_size=10_000):
+        if created_date > settled_before:
+            break
+        gains[movie_id] = log_add(gains.get(movie_id, -math.inf), rate * (created_date - EPOCH).total_seconds())
+        cursor = pk
+    return gains, cursor
+
+
+def movie_links(movie_ids):
+    # movie id -> (status, genre ids, country ids)
+    links = {}
+    for chunk in chunks(movie_ids):
+        for movie_id, status in Movie.objects.filter(pk__in=chunk).values_list('pk', 'status'):
+            links[movie_id] = (status, [], [])
+        for through, field, position in ((Movie.genre.through, 'genre_id', 1),
+                                         (Movie.country.through, 'country_id', 2)):
+            for movie_id, link_id in through.objects.filter(movie_id__in=chunk).values_list('movie_id', field):
+                links[movie_id][position].append(link_id)
+    return links
+
+
+def stored_scores(board, movie_ids):
+    scores = {}
+    for chunk in chunks(movie_ids):
+        scores.update(LeaderboardEntry.objects.filter(board=board, scope=scope(), movie_id__in=chunk)
+                      .values_list('movie_id', 'score'))
+    return scores
+
+
+def write(board, movie_ids, scores, replace_all=False):
+    # Replaces the entries of `movie_ids` (of the whole board with
+    # `replace_all`) by one per scope of every movie that has a score.
+    entries = LeaderboardEntry.objects.filter(board=board)
+    if replace_all:
+        entries.delete()
+    else:
+        for chunk in chunks(movie_ids):
+            entries.filter(movie_id__in=chunk).delete()
+    links = movie_links([movie_id for movie_id in movie_ids if movie_id in scores])
+    LeaderboardEntry.objects.bulk_create([
+        LeaderboardEntry(board=board, scope=name, movie_id=movie_id, status=status, score=scores[movie_id])
+        for movie_id, (status, genre_ids, country_ids) in links.items()
+        for name in scopes(genre_ids, country_ids)
+    ], batch_size=2000)
+    return len(links)
+
+
+def refresh(full=False):
+    # One micro-batch: folds the views logged since the last run into the
+    # trending scores, rescores the top-rated movies whose ratings changed,
+    # and rewrites the entries of movies whose genres, countries or status
+    # changed. Movie edits are found through Movie.updated_at, which rating,
+    # link and status changes all bump. `full=True` rebuilds both boards.
+    started = time.perf_counter()
+    now = timezone.now()
+    for name in BOARDS:
+        Leaderboard.objects.get_or_create(name=name)
+    with transaction.atomic():
+        states = {state.name: state for state in Leaderboard.objects.select_for_update().filter(name__in=BOARDS)}
+        trending, top_rated = states[TRENDING], states[TOP_RATED]
+        full = full or trending.synced_at is None or top_rated.synced_at is None
+        changed = set()
+        if not full:
+            since = min(trending.synced_at, top_rated.synced_at) - SETTLE
+            changed = set(Movie.objects.filter(updated_at__gt=since).values_list('pk', flat=True))
+
+        # Trending: the new views on top of the stored scores.
+        if full:
+            horizon = now - timedelta(hours=TRENDING_HORIZON * getattr(settings, 'LEADERBOARD_HALF_LIFE_HOURS', 48))
+            gains, trending.cursor = view_gains(History.objects.filter(created_date__gte=horizon),
+                                                now - SETTLE, trending.cursor)
+            stored = {}
+        else:
+            gains, trending.cursor = view_gains(History.objects.filter(pk__gt=trending.cursor),
+                                                now - SETTLE, trending.cursor)
+            stored = stored_scores(TRENDING, changed | set(gains))
+        floor = log_weight(now) + math.log(TRENDING_MIN_VIEWS)
+        scores = {movie_id: log_add(stored.get(movie_id, -math.inf), gains.get(movie_id, -math.inf))
+                  for movie_id in stored.keys() | gains.keys()}
+        scores = {movie_id: score for movie_id, score in scores.items() if score >= floor}
+        trending_written = write(TRENDING, scores.keys() | stored.keys(), scores, replace_all=full)
+        LeaderboardEntry.objects.filter(board=TRENDING, score__lt=floor).delete()
+
+        # Top rated: every movie when the catalog mean moved, else the edited ones.
+        totals = Movie.objects.aggregate(rating_sum=Sum('rating_sum'), rating_count=Sum('rating_count'))
+        mean = (totals['rating_sum'] or 0) / totals['rating_count'] if totals['rating_count'] else 0
+        rescore_all = full or abs(mean - top_rated.mean) > MEAN_TOLERANCE
+        movies = Movie.objects.all() if rescore_all else Movie.objects.filter(pk__in=changed)
+        prior = rating_prior()
+        scores = {movie_id: bayesian(rating_sum, rating_count, mean, prior) for movie_id, rating_sum, rating_count
+                  in movies.filter(rating_count__gt=0).values_list('pk', 'rating_sum', 'rating_count').iterator()}
+        top_rated_written = write(TOP_RATED, scores.keys() if rescore_all else changed, scores,
+                                  replace_all=rescore_all)
+        top_rated.mean = mean
+
+        for state in states.values():
+            state.synced_at = now
+            state.save()
+    return {
+        'full': full, 'movies_viewed': len(gains), 'trending': trending_written, 'top_rated': top_rated_written,
+        'seconds': time.perf_counter() - started,
+    }
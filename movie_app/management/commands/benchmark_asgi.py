@@ -0,0 +1,233 @@
+import asyncio
+import importlib.util
+import multiprocessing
+import os
+import random
+import resource
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from movie_app.benchmarks import benchmark_database, seed_catalog
+from movie_app.models import Actor, Genre, Movie, UserProfile
+
+HOST = '127.0.0.1'
+# Run as `python -m <command>`; {workers}/{threads} come from the options.
+# Both servers are pinned in req-bench.txt.
+SERVERS = {
+    'wsgi': 'gunicorn mysite.wsgi:application --bind {host}:{port} --workers {workers} '
+            '--worker-class gthread --threads {threads} --backlog 4096 --keep-alive 30',
+    'asgi': 'uvicorn mysite.asgi:application --host {host} --port {port} --workers {workers} '
+            '--lifespan off --no-access-log --backlog 4096 --timeout-keep-alive 30',
+}
+
+
+async def fetch(reader, writer, path, token):
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: {HOST}\r\nAccept: application/json\r\n'
+                 f'Authorization: Bearer {token}\r\n\r\n'.encode())
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ', 2)[1])
+    headers = dict(line.lower().split(': ', 1) for line in lines[1:] if ': ' in line)
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding') == 'chunked':
+        while size := int((await reader.readuntil(b'\r\n')).split(b';')[0], 16):
+            await reader.readexactly(size + 2)
+        await reader.readuntil(b'\r\n')
+    return status, headers.get('connection') != 'close'
+
+
+async def keep_requesting(port, paths, token, deadline, results):
+    # One keep-alive connection issuing requests back to back.
+    rnd = random.Random()
+    writer = None
+    while time.monotonic() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(HOST, port)
+            started = time.perf_counter()
+            status, keep_alive = await fetch(reader, writer, rnd.choice(paths), token)
+            results['latencies'].append(time.perf_counter() - started)
+            results['statuses'][status] += 1
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            results['errors'] += 1
+            keep_alive = False
+            await asyncio.sleep(0.05)
+        if not keep_alive and writer is not None:
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+def drive(port, paths, token, connections_count, duration):
+    # Load generator process: `connections_count` concurrent connections for
+    # `duration` seconds on one event loop.
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (max(soft, min(hard, connections_count + 256)), hard))
+    results = {'latencies': [], 'statuses': Counter(), 'errors': 0}
+
+    async def main():
+        deadline = time.monotonic() + duration
+        await asyncio.gather(*(keep_requesting(port, paths, token, deadline, results)
+                               for _ in range(connections_count)))
+
+    asyncio.run(main())
+    return results
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind((HOST, 0))
+        return probe.getsockname()[1]
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] * 1000 if values else 0.0
+
+
+class Command(BaseCommand):
+    help = ('Seed a throwaway database, serve it with a WSGI server (sync DRF views) and an ASGI '
+            'server (async/ views), and compare their throughput under many concurrent connections.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movies', type=int, default=3000)
+        parser.add_argument('--connections', type=int, default=1000)
+        parser.add_argument('--duration', type=float, default=20.0)
+        parser.add_argument('--warmup', type=float, default=3.0)
+        parser.add_argument('--workers', type=int, default=2, help='Server processes for each server.')
+        parser.add_argument('--threads', type=int, default=16, help='Threads per WSGI worker.')
+        parser.add_argument('--client-processes', type=int, default=max(1, (os.cpu_count() or 2) // 2))
+        parser.add_argument('--wsgi-command', default=SERVERS['wsgi'])
+        parser.add_argument('--asgi-command', default=SERVERS['asgi'])
+        parser.add_argument('--cached', action='store_true', help='Keep the response cache enabled.')
+        parser.add_argument('--max-error-rate', type=float, default=0.01)
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory(prefix='benchmark-asgi-') as directory:
+            database = connections['default']
+            if database.vendor == 'sqlite':
+                # The servers run in other processes, so the database must be a file.
+                database.settings_dict['TEST']['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+            with benchmark_database():
+                seed_catalog(movies=options['movies'])
+                user = UserProfile.objects.create_user(username='bench', password='bench', status='pro')
+                token = str(RefreshToken.for_user(user).access_token)
+                paths = self.paths()
+                env = {
+                    **os.environ,
+                    'DB_NAME': str(database.settings_dict['NAME']),
+                    'DB_REPLICA_HOSTS': '',
+                    'PYTHONPATH': os.pathsep.join(filter(None, [str(settings.BASE_DIR), os.getenv('PYTHONPATH')])),
+                }
+                if not options['cached']:
+                    env['CATALOG_CACHE_BACKEND'] = 'django.core.cache.backends.dummy.DummyCache'
+                connections.close_all()
+                results = {}
+                for kind, prefix in (('wsgi', '/en/'), ('asgi', '/en/async/')):
+                    with self.server(kind, options[f'{kind}_command'], options, env, directory) as port:
+                        kind_paths = [prefix + path for path in paths]
+                        self.run_load(port, kind_paths, token, min(options['connections'], 50),
+                                      options['warmup'], options)
+                        results[kind] = self.run_load(port, kind_paths, token, options['connections'],
+                                                      options['duration'], options)
+
+        failures = []
+        for kind, (rate, p50, p99, total, failed) in results.items():
+            self.stdout.write(f'{kind}  {rate:9.0f} req/s  p50={p50:7.1f}ms  p99={p99:7.1f}ms  '
+                              f'requests={total} failed={failed}')
+            if total and failed / total > options['max_error_rate']:
+                failures.append(f'{kind}: {failed} of {total} requests failed')
+        wsgi_rate = results['wsgi'][0]
+        if wsgi_rate:
+            self.stdout.write(f'asgi/wsgi throughput {results["asgi"][0] / wsgi_rate:.2f}x '
+                              f'at {options["connections"]} connections')
+        if failures:
+            raise CommandError('Load test failed:\n' + '\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS('Load test finished'))
+
+    def paths(self):
+        # The hot read mix: list pages, details (some expanded), genre and
+        # actor pages and autocomplete keystrokes.
+        rnd = random.Random(0)
+        movie_ids = list(Movie.objects.values_list('pk', flat=True))
+        genre_ids = list(Genre.objects.values_list('pk', flat=True))
+        actor_ids = list(Actor.objects.values_list('pk', flat=True))
+        names = list(Movie.objects.values_list('movie_name_en', flat=True)[:200])
+        paths = []
+        for _ in range(100):
+            paths += [
+                'movie/', f'movie/?genre={rnd.choice(genre_ids)}', 'movie/?ordering=-year&page_size=20',
+                f'movie/{rnd.choice(movie_ids)}/', f'movie/{rnd.choice(movie_ids)}/',
+                f'movie/{rnd.choice(movie_ids)}/?expand=ratings,reviews,frames,videos',
+                f'genre/{rnd.choice(genre_ids)}/', f'actor/{rnd.choice(actor_ids)}/',
+                f'autocomplete/?q={rnd.choice(names)[:rnd.randint(1, 4)].lower()}',
+                f'autocomplete/?q={rnd.choice(names)[:rnd.randint(1, 4)].lower()}',
+            ]
+        return paths
+
+    def server(self, kind, template, options, env, directory):
+        port = free_port()
+        command = shlex.split(template.format(host=HOST, port=port, workers=options['workers'],
+                                              threads=options['threads']))
+        if importlib.util.find_spec(command[0]) is None:
+            raise CommandError(f'{command[0]} is not installed (needed for the {kind} server; pip install -r req-bench.txt)')
+        return RunningServer([sys.executable, '-m', *command], port, env, os.path.join(directory, f'{kind}.log'))
+
+    def run_load(self, port, paths, token, connections_count, duration, options):
+        processes = max(1, min(options['client_processes'], connections_count))
+        shares = [connections_count // processes + (i < connections_count % processes) for i in range(processes)]
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(processes, mp_context=context, initializer=django.setup) as pool:
+            parts = list(pool.map(drive, *zip(*[(port, paths, token, share, duration) for share in shares])))
+        latencies = sorted(latency for part in parts for latency in part['latencies'])
+        statuses = sum((part['statuses'] for part in parts), Counter())
+        failed = sum(part['errors'] for part in parts) + sum(n for status, n in statuses.items() if status != 200)
+        total = len(latencies) + sum(part['errors'] for part in parts)
+        return len(latencies) / duration, percentile(latencies, 0.5), percentile(latencies, 0.99), total, failed
+
+
+class RunningServer:
+    startup_timeout = 60
+
+    def __init__(self, command, port, env, log_path):
+        self.command, self.port, self.env, self.log_path = command, port, env, log_path
+
+    def __enter__(self):
+        self.log = open(self.log_path, 'wb')
+        self.process = subprocess.Popen(self.command, cwd=settings.BASE_DIR, env=self.env,
+                                        stdout=self.log, stderr=subprocess.STDOUT)
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                self.log.close()
+                with open(self.log_path, errors='replace') as log:
+                    raise CommandError(f'{self.command[2]} exited:\n{log.read()[-2000:]}')
+            try:
+                socket.create_connection((HOST, self.port), timeout=1).close()
+                return self.port
+            except OSError:
+                time.sleep(0.2)
+        self.__exit__()
+        raise CommandError(f'{self.command[2]} did not start within {self.startup_timeout}s')
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.log.close()
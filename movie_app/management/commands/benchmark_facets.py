@@ -0,0 +1,103 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+from movie_app.benchmarks import benchmark_database, seed_catalog, measure, percentile
+from movie_app.facets import FACETS, facet_index, year_bucket
+from movie_app.models import Country, Genre, Movie
+
+
+class Command(BaseCommand):
+    help = ('Seed a throwaway catalog, build the facet posting lists, check their counts against '
+            'the database and fail if filtered facet queries exceed the p95 budget.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movies', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=200)
+        parser.add_argument('--p95-ms', type=float, default=20.0, help='Budget for one index query.')
+        parser.add_argument('--endpoint-p95-ms', type=float, default=100.0)
+
+    def handle(self, *args, **options):
+        rnd = random.Random(0)
+        with benchmark_database():
+            started = time.perf_counter()
+            seed_catalog(movies=options['movies'])
+            self.stdout.write(f'seeded {options["movies"]} movies in {time.perf_counter() - started:.1f}s')
+            started = time.perf_counter()
+            facet_index.build()
+            self.stdout.write(f'built facet index in {time.perf_counter() - started:.2f}s: {facet_index.stats()}')
+
+            genre_ids = list(Genre.objects.values_list('pk', flat=True))
+            country_ids = list(Country.objects.values_list('pk', flat=True))
+            choices = {
+                'genre': genre_ids,
+                'country': country_ids,
+                'year': sorted({year_bucket(year) for year in Movie.objects.dates('year', 'year')}),
+                'movie_type': [value for value, _ in Movie.MovieTypeChoices],
+                'status': ['simple', 'pro'],
+            }
+            combinations = []
+            for _ in range(50):
+                facets = rnd.sample(FACETS, rnd.randint(0, 3))
+                combinations.append({facet: set(rnd.sample(choices[facet], rnd.randint(1, 2))) for facet in facets})
+
+            mismatches = [filters for filters in combinations[:10] if not self.matches_database(filters)]
+            timings = []
+            for i in range(options['repeat']):
+                query_started = time.perf_counter()
+                facet_index.search(combinations[i % len(combinations)])
+                timings.append((time.perf_counter() - query_started) * 1000)
+            p95 = percentile(timings, 95)
+            self.stdout.write(f'index search p50={percentile(timings, 50):.2f}ms p95={p95:.2f}ms')
+
+            # The same counts straight from the database, for comparison.
+            filters = {'genre': {genre_ids[0]}, 'status': {'pro'}}
+            started = time.perf_counter()
+            self.database_counts(filters)
+            self.stdout.write(f'database GROUP BY counts for {filters}: {(time.perf_counter() - started) * 1000:.1f}ms')
+
+            queries, endpoint_p95 = measure(f'/en/movie/facets/?genre={genre_ids[0]},{genre_ids[1]}'
+                                            f'&country={country_ids[0]}&status=pro', repeat=50)
+            self.stdout.write(f'movie/facets/ queries={queries} p95={endpoint_p95:.1f}ms')
+
+        failures = [f'index counts differ from the database for {filters}' for filters in mismatches]
+        if p95 > options['p95_ms']:
+            failures.append(f'index search p95 {p95:.2f}ms exceeds {options["p95_ms"]}ms')
+        if endpoint_p95 > options['endpoint_p95_ms']:
+            failures.append(f'movie/facets/ p95 {endpoint_p95:.1f}ms exceeds {options["endpoint_p95_ms"]}ms')
+        if failures:
+            raise CommandError('Facet budget exceeded:\n' + '\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS('Facets are within budget'))
+
+    def filtered(self, filters, skip=None):
+        movies = Movie.objects.all()
+        for facet, values in filters.items():
+            if facet == skip:
+                continue
+            if facet == 'year':
+                movies = movies.filter(pk__in=Movie.objects.filter(
+                    year__year__in=[year for decade in values for year in range(decade, decade + 10)]))
+            else:
+                movies = movies.filter(pk__in=Movie.objects.filter(**{f'{facet}__in': values}))
+        return movies
+
+    def database_counts(self, filters):
+        counts = {}
+        for facet in FACETS:
+            movies = self.filtered(filters, skip=facet)
+            if facet == 'year':
+                years = movies.values_list('year__year').annotate(total=Count('id')).order_by()
+                totals = {}
+                for year, total in years:
+                    totals[year // 10 * 10] = totals.get(year // 10 * 10, 0) + total
+            else:
+                totals = dict(movies.values_list(facet).annotate(total=Count('id')).order_by())
+            counts[facet] = {value: total for value, total in totals.items() if value is not None and total}
+        return counts
+
+    def matches_database(self, filters):
+        movie_ids, counts = facet_index.search(filters)
+        return (set(movie_ids.tolist()) == set(self.filtered(filters).values_list('pk', flat=True))
+                and {facet: dict(items) for facet, items in counts.items()} == self.database_counts(filters))
@@ -0,0 +1,64 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from movie_app.benchmarks import benchmark_database, seed_catalog
+from movie_app.ingest import history_buffer
+from movie_app.models import History, Movie, UserProfile
+
+
+class Command(BaseCommand):
+    help = ('Seed a throwaway database and compare sustained watch-history write throughput of '
+            'single-row POST history/ against batched POST history/events/.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=20000)
+        parser.add_argument('--single-events', type=int, default=1000)
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--min-speedup', type=float, default=10.0)
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            seed_catalog(movies=200)
+            movie_ids = list(Movie.objects.values_list('pk', flat=True))
+            user = UserProfile.objects.create_user(username='bench', password='bench', status='pro')
+            client = Client(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(user).access_token))
+
+            started = time.perf_counter()
+            for i in range(options['single_events']):
+                response = client.post('/en/history/', {'movie_id': movie_ids[i % len(movie_ids)]})
+                if response.status_code != 201:
+                    raise CommandError(f'history/ answered {response.status_code}')
+            single_rate = options['single_events'] / (time.perf_counter() - started)
+            History.objects.all().delete()
+
+            events = [{'movie_id': movie_ids[i % len(movie_ids)]} for i in range(options['events'])]
+            size = options['batch_size']
+            started = time.perf_counter()
+            for start in range(0, len(events), size):
+                response = client.post('/en/history/events/', {'events': events[start:start + size]},
+                                       content_type='application/json')
+                if response.status_code == 503:
+                    time.sleep(0.01)
+                    history_buffer.flush()
+                    response = client.post('/en/history/events/', {'events': events[start:start + size]},
+                                           content_type='application/json')
+                if response.status_code != 202:
+                    raise CommandError(f'history/events/ answered {response.status_code}')
+            history_buffer.flush()
+            batch_rate = len(events) / (time.perf_counter() - started)
+
+            written = History.objects.count()
+            stats = history_buffer.stats()
+        speedup = batch_rate / single_rate
+        self.stdout.write(f'single-row  {single_rate:10.0f} events/s')
+        self.stdout.write(f'batched     {batch_rate:10.0f} events/s  ({speedup:.1f}x)')
+        self.stdout.write(f'rows={written} flushes={stats["flushes"]} max_flush={stats["max_flush_ms"]}ms '
+                          f'high_water={stats["high_water"]} rejected={stats["rejected"]}')
+        if written != len(events):
+            raise CommandError(f'{written} of {len(events)} events were written')
+        if speedup < options['min_speedup']:
+            raise CommandError(f'Batched ingestion is only {speedup:.1f}x faster (need {options["min_speedup"]}x)')
+        self.stdout.write(self.style.SUCCESS('Batched history ingestion is within budget'))
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from movie_app.benchmarks import benchmark_database, seed_catalog, measure
+from movie_app.models import Country, Genre, Actor
+
+
+class Command(BaseCommand):
+    help = ('Seed a throwaway database and fail if the movie list endpoint exceeds its '
+            'query or p95 latency budget, or if its query count depends on the page size.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movies', type=int, default=3000)
+        parser.add_argument('--repeat', type=int, default=30)
+        parser.add_argument('--max-queries', type=int, default=6)
+        parser.add_argument('--p95-ms', type=float, default=250.0)
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            seed_catalog(movies=options['movies'])
+            country = Country.objects.first()
+            genre = Genre.objects.first()
+            actor = Actor.objects.first()
+            scenarios = {
+                'default': '/en/movie/',
+                'search': '/en/movie/?search=river',
+                'ordering': '/en/movie/?ordering=-year',
+                'country': f'/en/movie/?country={country.pk}',
+                'genre': f'/en/movie/?genre={genre.pk}',
+                'status': '/en/movie/?status=simple',
+                'actor': f'/en/movie/?actor={actor.pk}',
+                'pages': '/en/movie/?page=3',
+            }
+            failures = []
+            for name, url in scenarios.items():
+                counts = set()
+                for page_size in (5, 50, 100):
+                    separator = '&' if '?' in url else '?'
+                    queries, p95 = measure(f'{url}{separator}page_size={page_size}', repeat=options['repeat'])
+                    counts.add(queries)
+                    self.stdout.write(f'{name:10} page_size={page_size:<4} queries={queries:<3} p95={p95:.1f}ms')
+                    if queries > options['max_queries']:
+                        failures.append(f'{name} page_size={page_size}: {queries} queries')
+                    if p95 > options['p95_ms']:
+                        failures.append(f'{name} page_size={page_size}: p95 {p95:.1f}ms')
+                if len(counts) > 1:
+                    failures.append(f'{name}: query count varies with page size {sorted(counts)}')
+        if failures:
+            raise CommandError('Movie list budget exceeded:\n' + '\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS('Movie list endpoint is within budget'))
@@ -0,0 +1,99 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from movie_app.benchmarks import benchmark_database, seed_catalog, measure
+from movie_app.models import Movie, MovieNeighbors, Rating, UserProfile
+from movie_app.recommendations import neighbor_count, rows, train
+
+
+class Command(BaseCommand):
+    help = ('Seed a throwaway database with synthetic taste-clustered ratings, then time a full '
+            'recommendation training run, an incremental retrain after a burst of new ratings on a '
+            'few movies, and the similar/recommendation endpoints.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movies', type=int, default=5000)
+        parser.add_argument('--users', type=int, default=50000)
+        parser.add_argument('--ratings', type=int, default=1_000_000)
+        parser.add_argument('--new-ratings', type=int, default=20000)
+        parser.add_argument('--hot-movies', type=int, default=100, help='Movies the new ratings go to.')
+        parser.add_argument('--min-speedup', type=float, default=2.0)
+        parser.add_argument('--min-overlap', type=float, default=0.95)
+        parser.add_argument('--p95-ms', type=float, default=100.0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        with benchmark_database():
+            seed_catalog(movies=options['movies'])
+            UserProfile.objects.bulk_create(
+                [UserProfile(username=f'bench{i}', password='!') for i in range(options['users'])], batch_size=2000)
+            user_ids = np.fromiter(UserProfile.objects.values_list('pk', flat=True), dtype=np.int64)
+            links = rows(Movie.genre.through.objects.all(), ['genre_id', 'movie_id'])
+            links = links[np.argsort(links[:, 0], kind='stable')]
+            genres, starts, counts = np.unique(links[:, 0], return_index=True, return_counts=True)
+            tastes = rng.integers(0, len(genres), size=(len(user_ids), 2))
+
+            def add_ratings(count, movie_pool=None):
+                # 80% of ratings go to one of the user's two genres and score high.
+                users = rng.integers(0, len(user_ids), count)
+                genre = tastes[users, rng.integers(0, 2, count)]
+                liked = links[starts[genre] + (rng.random(count) * counts[genre]).astype(np.int64), 1]
+                pool = movie_pool if movie_pool is not None else links[:, 1]
+                movies = np.where(rng.random(count) < 0.8, liked, pool[rng.integers(0, len(pool), count)])
+                if movie_pool is not None:
+                    movies = np.where(np.isin(movies, movie_pool), movies, pool[rng.integers(0, len(pool), count)])
+                stars = np.where(movies == liked, rng.integers(7, 11, count), rng.integers(1, 7, count))
+                for start in range(0, count, 50_000):
+                    batch = slice(start, start + 50_000)
+                    # The base manager skips the per-batch aggregate rebuild.
+                    Rating._base_manager.bulk_create([
+                        Rating(user_id=user_id, movie_id=movie_id, stars=score) for user_id, movie_id, score
+                        in zip(user_ids[users[batch]].tolist(), movies[batch].tolist(), stars[batch].tolist())
+                    ], batch_size=5000)
+                Movie.rebuild_rating_aggregates(set(movies.tolist()))
+
+            started = time.perf_counter()
+            add_ratings(options['ratings'])
+            self.stdout.write(f'seeded {options["ratings"]} ratings in {time.perf_counter() - started:.1f}s')
+
+            full = train(full=True)
+            self.stdout.write(f'full train         {full["seconds"]:7.2f}s  rescored={full["rescored"]} '
+                              f'users={full["users"]} interactions={full["interactions"]}')
+
+            hot = rng.choice(np.unique(links[:, 1]), options['hot_movies'], replace=False)
+            add_ratings(options['new_ratings'], movie_pool=hot)
+            incremental = train()
+            self.stdout.write(f'incremental train  {incremental["seconds"]:7.2f}s  rescored={incremental["rescored"]} '
+                              f'written={incremental["written"]}')
+            after_incremental = dict(MovieNeighbors.objects.values_list('movie_id', 'neighbor_ids'))
+            rebuilt = train(full=True)
+            after_full = dict(MovieNeighbors.objects.values_list('movie_id', 'neighbor_ids'))
+            overlaps = [len(set(after_incremental.get(movie_id, [])) & set(neighbor_ids)) / len(neighbor_ids)
+                        for movie_id, neighbor_ids in after_full.items() if neighbor_ids]
+            overlap = float(np.mean(overlaps)) if overlaps else 1.0
+            speedup = rebuilt['seconds'] / max(incremental['seconds'], 0.01)
+            self.stdout.write(f'incremental vs full: {speedup:.1f}x faster, neighbor overlap {overlap:.3f}')
+
+            user = UserProfile.objects.get(pk=int(user_ids[0]))
+            client = Client(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(user).access_token))
+            movie_id = next(iter(after_full))
+            timings = {
+                'similar': measure(f'/en/movie/{movie_id}/similar/?limit={neighbor_count()}', client=client),
+                'recommendations': measure('/en/user/recommendations/?limit=20', client=client),
+            }
+            for name, (queries, p95) in timings.items():
+                self.stdout.write(f'{name:16} queries={queries:<3} p95={p95:.1f}ms')
+
+        failures = []
+        if speedup < options['min_speedup']:
+            failures.append(f'incremental retrain only {speedup:.1f}x faster than a full one')
+        if overlap < options['min_overlap']:
+            failures.append(f'incremental neighbors overlap the full rebuild by {overlap:.3f}')
+        failures += [f'{name}: p95 {p95:.1f}ms' for name, (_, p95) in timings.items() if p95 > options['p95_ms']]
+        if failures:
+            raise CommandError('Recommendation budget exceeded:\n' + '\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS('Recommendations are within budget'))
@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from movie_app.benchmarks import (
+    benchmark_database, seed_catalog, percentile, vocabulary, SYLLABLES_EN, SYLLABLES_RU, WORDS_EN, NAMES
+)
+from movie_app.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Seed a throwaway catalog, build the search index and fail if ranked queries exceed the p95 budget.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movies', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=200)
+        parser.add_argument('--p95-ms', type=float, default=10.0)
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            started = time.perf_counter()
+            seed_catalog(movies=options['movies'], actors=5000, directors=1000)
+            backend = get_search_backend()
+            self.stdout.write(f'Seeded and indexed {options["movies"]} movies in {time.perf_counter() - started:.1f}s '
+                              f'with {type(backend).__name__}')
+
+            # Whole words, multi-word prefixes and person-name lookups in both
+            # languages; single two- or three-letter prefixes belong to the
+            # autocomplete endpoint.
+            vocabulary_en, vocabulary_ru = vocabulary(SYLLABLES_EN), vocabulary(SYLLABLES_RU)
+            queries = ([f'{a} {b}' for a, b in zip(vocabulary_en[::97], WORDS_EN)]
+                       + [f'{a} {b[:4]}' for a, b in zip(vocabulary_ru[::89], vocabulary_ru[5::89])]
+                       + [word[:5] for word in vocabulary_en[3::211]]
+                       + [f'{name} {word[:4]}' for name, word in zip(NAMES, vocabulary_en[7::199])])
+            timings = []
+            for i in range(options['repeat']):
+                query = queries[i % len(queries)]
+                query_started = time.perf_counter()
+                backend.search(query, limit=20, offset=0)
+                timings.append((time.perf_counter() - query_started) * 1000)
+        p95 = percentile(timings, 95)
+        self.stdout.write(f'search p50={percentile(timings, 50):.2f}ms p95={p95:.2f}ms')
+        if p95 > options['p95_ms']:
+            raise CommandError(f'Search p95 {p95:.2f}ms exceeds the {options["p95_ms"]}ms budget')
+        self.stdout.write(self.style.SUCCESS('Search is within budget'))
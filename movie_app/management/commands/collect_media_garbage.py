@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from movie_app.blobs import adopt, collect
+from movie_app.uploads import expire_sessions
+
+
+class Command(BaseCommand):
+    help = ('Drop abandoned upload sessions, recount media blob references and delete blobs no row refers to. '
+            'With --adopt, first move uploads stored under their original names into the blob store.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--adopt', action='store_true')
+        parser.add_argument('--grace-hours', type=float, default=24.0,
+                            help='Keep unreferenced blobs younger than this (uploads not saved yet).')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        verb = 'would be removed' if dry_run else 'removed'
+        if options['adopt']:
+            adopted, freed = adopt(dry_run=dry_run)
+            self.stdout.write(f'{adopted} legacy uploads moved to the blob store, '
+                              f'{freed / 1e6:.1f} MB of originals {verb}')
+        expired, freed = expire_sessions(dry_run=dry_run)
+        self.stdout.write(f'{expired} abandoned upload sessions {verb} ({freed / 1e6:.1f} MB)')
+        removed, freed = collect(grace=options['grace_hours'] * 3600, dry_run=dry_run)
+        for name in removed:
+            self.stdout.write(f'  {name}')
+        self.stdout.write(self.style.SUCCESS(f'{len(removed)} orphaned blobs {verb} ({freed / 1e6:.1f} MB)'))
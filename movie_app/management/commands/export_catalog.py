@@ -0,0 +1,38 @@
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from movie_app.catalog_io import CATALOG_KINDS, export_records, write_csv, write_jsonl
+
+
+class Command(BaseCommand):
+    help = ('Stream categories, countries, genres, directors, actors and movies, with all '
+            'translations and links, to JSON Lines (one file, "-" for stdout) or CSV (one '
+            '<kind>.csv per kind in a directory).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('output')
+        parser.add_argument('--format', choices=['jsonl', 'csv'], default='jsonl')
+        parser.add_argument('--kinds', nargs='+', choices=list(CATALOG_KINDS))
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        kinds, chunk_size = options['kinds'], options['chunk_size']
+        if options['format'] == 'jsonl':
+            if options['output'] == '-':
+                count = write_jsonl(export_records(kinds, chunk_size), sys.stdout)
+            else:
+                with open(options['output'], 'w', encoding='utf-8') as stream:
+                    count = write_jsonl(export_records(kinds, chunk_size), stream)
+        else:
+            if options['output'] == '-':
+                raise CommandError('CSV export needs a directory')
+            os.makedirs(options['output'], exist_ok=True)
+            count = 0
+            for name, kind in CATALOG_KINDS.items():
+                if kinds and name not in kinds:
+                    continue
+                with open(os.path.join(options['output'], f'{name}.csv'), 'w', encoding='utf-8', newline='') as stream:
+                    count += write_csv(kind, kind.export(chunk_size), stream)
+        self.stderr.write(self.style.SUCCESS(f'Exported {count} records'))
@@ -0,0 +1,48 @@
+import os
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from movie_app.catalog_io import CATALOG_KINDS, import_records, read_csv, read_jsonl
+
+
+class Command(BaseCommand):
+    help = ('Upsert catalog records by natural key from a JSON Lines file ("-" for stdin) '
+            'or a directory of <kind>.csv files, in chunked bulk writes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('input')
+        parser.add_argument('--format', choices=['jsonl', 'csv'], default='jsonl')
+        parser.add_argument('--kinds', nargs='+', choices=list(CATALOG_KINDS))
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        if options['format'] == 'jsonl':
+            if options['input'] == '-':
+                report = import_records(read_jsonl(sys.stdin), options['chunk_size'], options['kinds'])
+            else:
+                with open(options['input'], encoding='utf-8') as stream:
+                    report = import_records(read_jsonl(stream), options['chunk_size'], options['kinds'])
+        else:
+            if not os.path.isdir(options['input']):
+                raise CommandError('CSV import needs a directory of <kind>.csv files')
+            report = import_records(self.csv_records(options['input']), options['chunk_size'], options['kinds'])
+
+        for name in CATALOG_KINDS:
+            if report.created[name] or report.updated[name] or report.unchanged[name]:
+                self.stdout.write(f'{name:12} created={report.created[name]} updated={report.updated[name]} '
+                                  f'unchanged={report.unchanged[name]}')
+        for error in report.errors:
+            self.stderr.write(error)
+        elapsed = time.perf_counter() - started
+        message = f'Imported in {elapsed:.1f}s with {report.error_count} skipped records or links'
+        self.stdout.write(self.style.SUCCESS(message) if not report.error_count else self.style.WARNING(message))
+
+    def csv_records(self, directory):
+        for name, kind in CATALOG_KINDS.items():
+            path = os.path.join(directory, f'{name}.csv')
+            if os.path.exists(path):
+                with open(path, encoding='utf-8', newline='') as stream:
+                    yield from read_csv(kind, stream)
@@ -0,0 +1,61 @@
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from movie_app.models import MovieVideo, VideoPackage
+from movie_app.packaging import claim, enqueue, requeue_stale, run_package
+
+
+class Command(BaseCommand):
+    help = ('Package queued MovieVideo uploads into HLS renditions in a process pool. '
+            'Runs until interrupted unless --once is given.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'VIDEO_PACKAGING_WORKERS', 2))
+        parser.add_argument('--enqueue', type=int, nargs='*', default=(), metavar='VIDEO_ID',
+                            help='(Re)queue these videos first.')
+        parser.add_argument('--all', action='store_true', help='Queue every video that has no package yet.')
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty.')
+        parser.add_argument('--poll', type=float, default=5.0)
+        parser.add_argument('--stale-minutes', type=float, default=60.0)
+
+    def handle(self, *args, **options):
+        if options['all']:
+            enqueue(list(MovieVideo.objects.filter(package__isnull=True).values_list('pk', flat=True)))
+        if options['enqueue']:
+            enqueue(options['enqueue'])
+        requeued = requeue_stale(options['stale_minutes'])
+        if requeued:
+            self.stdout.write(f'{requeued} stale jobs requeued')
+        workers = options['workers']
+        # spawn, not fork: children must not share the parent's DB connections
+        context = multiprocessing.get_context('spawn')
+        counts = {'ready': 0, 'failed': 0}
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=django.setup) as pool:
+            running = {}
+            while True:
+                if len(running) < workers:
+                    for pk in claim(workers - len(running)):
+                        running[pool.submit(run_package, pk)] = pk
+                if not running:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll'])
+                    continue
+                done, _ = wait(running, timeout=options['poll'], return_when=FIRST_COMPLETED)
+                for future in done:
+                    pk = running.pop(future)
+                    try:
+                        _, outcome = future.result()
+                    except Exception as error:
+                        VideoPackage.objects.filter(pk=pk).update(status='failed', error=str(error)[:4000])
+                        outcome = 'failed'
+                    counts[outcome] += 1
+                    package = VideoPackage.objects.get(pk=pk)
+                    style = self.style.SUCCESS if outcome == 'ready' else self.style.ERROR
+                    self.stdout.write(style(f'video {package.video_id}: {outcome} {package.error[:200]}'.rstrip()))
+        self.stdout.write(f"{counts['ready']} packaged, {counts['failed']} failed")
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from movie_app.models import Movie
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored rating sum, count, average and histogram of every movie from scratch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('movie_ids', nargs='*', type=int, help='Only rebuild these movies.')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rebuilt = Movie.rebuild_rating_aggregates(options['movie_ids'] or None, chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rating aggregates for {rebuilt} movies'))
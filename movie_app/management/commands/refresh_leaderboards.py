@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from movie_app.leaderboards import refresh
+
+
+class Command(BaseCommand):
+    help = ('Fold new views and edited movies into the trending and top-rated leaderboards, '
+            'or rebuild both from scratch with --full.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rebuild both boards.')
+
+    def handle(self, *args, **options):
+        stats = refresh(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Rebuilt" if stats["full"] else "Refreshed"} leaderboards: {stats["trending"]} trending and '
+            f'{stats["top_rated"]} top-rated movies written, {stats["movies_viewed"]} movies with new views, '
+            f'in {stats["seconds"]:.2f}s'))
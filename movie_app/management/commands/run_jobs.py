@@ -0,0 +1,54 @@
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from movie_app.jobs import claim, execute, purge_finished, requeue_stale, schedule_periodic
+
+
+class Command(BaseCommand):
+    help = ('Run queued background jobs (see movie_app/jobs.py) on a thread or process pool, '
+            'and schedule the periodic ones. Runs until interrupted unless --once is given.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'JOBS_WORKERS', 4))
+        parser.add_argument('--processes', action='store_true',
+                            help='Use worker processes instead of threads (CPU-bound handlers).')
+        parser.add_argument('--once', action='store_true', help='Exit when no job is due.')
+        parser.add_argument('--poll', type=float, default=1.0)
+        parser.add_argument('--stale-minutes', type=float, default=30.0)
+        parser.add_argument('--keep-days', type=float, default=7.0, help='Delete finished jobs older than this.')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        requeue_stale(options['stale_minutes'])
+        purge_finished(options['keep_days'])
+        if options['processes']:
+            # spawn, not fork: children must not share the parent's DB connections
+            pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=django.setup)
+        else:
+            pool = ThreadPoolExecutor(workers, thread_name_prefix='jobs')
+        counts = {'done': 0, 'retry': 0, 'failed': 0}
+        with pool:
+            running = set()
+            while True:
+                if not options['once']:
+                    schedule_periodic()
+                if len(running) < workers:
+                    running.update(pool.submit(execute, pk) for pk in claim(workers - len(running)))
+                if not running:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll'])
+                    continue
+                done, running = wait(running, timeout=options['poll'], return_when=FIRST_COMPLETED)
+                for future in done:
+                    job_id, outcome = future.result()
+                    counts[outcome] += 1
+                    if outcome != 'done':
+                        self.stderr.write(f'job {job_id}: {outcome}')
+        self.stdout.write(f"{counts['done']} done, {counts['retry']} retried later, {counts['failed']} failed")
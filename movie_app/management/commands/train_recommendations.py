@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from movie_app.recommendations import train
+
+
+class Command(BaseCommand):
+    help = ('Retrain the similar-movie neighbor table. Only movies whose interactions or links '
+            'changed since the last run are rescored unless --full is given.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rescore every movie.')
+
+    def handle(self, *args, **options):
+        stats = train(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rescored {stats["rescored"]} of {stats["movies"]} movies, wrote {stats["written"]} neighbor '
+            f'lists ({stats["interactions"]} interactions from {stats["users"]} users) in {stats["seconds"]}s'))
@@ -0,0 +1,52 @@
+# Generated by Django 6.0 on 2026-10-17 17:33
+
+import movie_app.models
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_rating_aggregates(apps, schema_editor):
+    Movie = apps.get_model('movie_app', 'Movie')
+    Rating = apps.get_model('movie_app', 'Rating')
+    histograms = {}
+    rows = Rating.objects.values_list('movie_id', 'stars').annotate(total=Count('id')).order_by()
+    for movie_id, stars, total in rows:
+        histograms.setdefault(movie_id, {})[str(stars)] = total
+    for movie in Movie.objects.filter(pk__in=histograms):
+        histogram = {**movie_app.models.rating_histogram_default(), **histograms[movie.pk]}
+        movie.rating_histogram = histogram
+        movie.rating_count = sum(histogram.values())
+        movie.rating_sum = sum(int(stars) * count for stars, count in histogram.items())
+        movie.rating_avg = round(movie.rating_sum / movie.rating_count, 2)
+        movie.save(update_fields=['rating_sum', 'rating_count', 'rating_avg', 'rating_histogram'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_app', '0007_alter_category_category_name_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='rating_avg',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_histogram',
+            field=models.JSONField(default=movie_app.models.rating_histogram_default, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_rating_aggregates, migrations.RunPython.noop),
+    ]
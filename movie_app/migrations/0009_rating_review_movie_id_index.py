@@ -0,0 +1,21 @@
+# Generated by Django 6.0 on 2026-10-17 17:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_app', '0008_movie_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rating',
+            index=models.Index(fields=['movie', 'id'], name='movie_app_r_movie_i_dc8fd1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['movie', 'id'], name='movie_app_r_movie_i_dcf06b_idx'),
+        ),
+    ]
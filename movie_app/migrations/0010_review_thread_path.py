@@ -0,0 +1,59 @@
+# Generated by Django 6.0 on 2026-10-17 17:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_thread_paths(apps, schema_editor):
+    Review = apps.get_model('movie_app', 'Review')
+    parents = dict(Review.objects.values_list('id', 'parent_id'))
+    positions = {}
+
+    def position(review_id):
+        if review_id not in positions:
+            segment = f'{review_id:010d}/'
+            parent_id = parents[review_id]
+            if parent_id is None:
+                positions[review_id] = (review_id, 0, segment)
+            else:
+                root_id, depth, path = position(parent_id)
+                positions[review_id] = (root_id, depth + 1, path + segment)
+        return positions[review_id]
+
+    for review_id in parents:
+        root_id, depth, path = position(review_id)
+        Review.objects.filter(pk=review_id).update(root_id=root_id, depth=depth, path=path)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_app', '0009_rating_review_movie_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='review',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='path',
+            field=models.CharField(default='', editable=False, max_length=1100),
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='root',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='thread_reviews', to='movie_app.review'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['movie', 'depth', 'id'], name='movie_app_r_movie_i_f2b8bc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['root', 'path'], name='movie_app_r_root_id_9654a4_idx'),
+        ),
+        migrations.RunPython(populate_thread_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 6.0 on 2026-10-17 17:45
+
+from django.db import migrations
+
+SEARCH_TABLE = 'movie_app_movie_search'
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+            name_ru, name_en, description_ru, description_en, people,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    ''')
+    schema_editor.execute(
+        f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rank) VALUES ('rank', 'bm25(10.0, 10.0, 1.0, 1.0, 3.0)')")
+    schema_editor.execute(f'''
+        INSERT INTO {SEARCH_TABLE} (rowid, name_ru, name_en, description_ru, description_en, people)
+        SELECT m.id, coalesce(m.movie_name_ru, ''), coalesce(m.movie_name_en, ''),
+               coalesce(m.description_ru, ''), coalesce(m.description_en, ''),
+               coalesce((SELECT group_concat(coalesce(a.full_name_ru, '') || ' ' || coalesce(a.full_name_en, ''), ' ')
+                         FROM movie_app_movie_actor ma JOIN movie_app_actor a ON a.id = ma.actor_id
+                         WHERE ma.movie_id = m.id), '')
+               || ' ' ||
+               coalesce((SELECT group_concat(coalesce(d.full_name_ru, '') || ' ' || coalesce(d.full_name_en, ''), ' ')
+                         FROM movie_app_movie_director md JOIN movie_app_director d ON d.id = md.director_id
+                         WHERE md.movie_id = m.id), '')
+        FROM movie_app_movie m
+    ''')
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_app', '0011_catalog_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 6.0 on 2026-10-17 17:58
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def remove_duplicate_favorite_items(apps, schema_editor):
+    FavoriteItem = apps.get_model('movie_app', 'FavoriteItem')
+    keep = (FavoriteItem.objects.values('favorite_id', 'movie_id')
+            .annotate(keep_id=Min('id')).values('keep_id'))
+    FavoriteItem.objects.exclude(id__in=keep).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_app', '0013_movie_year_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='history',
+            index=models.Index(fields=['user', '-created_date', '-id'], name='movie_app_h_user_id_fe5529_idx'),
+        ),
+        migrations.RunPython(remove_duplicate_favorite_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='favoriteitem',
+            constraint=models.UniqueConstraint(fields=('favorite', 'movie'), name='unique_favorite_movie'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 6.0 on 2026-10-17 18:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_app', '0014_user_scoped_lists'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='actor',
+            index=models.Index(fields=['full_name_ru'], name='actor_full_name_ru_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='actor',
+            index=models.Index(fields=['full_name_en'], name='actor_full_name_en_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='director',
+            index=models.Index(fields=['full_name_ru'], name='director_full_name_ru_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='director',
+            index=models.Index(fields=['full_name_en'], name='director_full_name_en_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['movie_name_ru'], name='movie_name_ru_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['movie_name_en'], name='movie_name_en_idx'),
+        ),
+    ]
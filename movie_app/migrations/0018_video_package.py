@@ -0,0 +1,28 @@
+# Generated by Django 6.0 on 2026-10-17 18:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_app', '0017_upload_sessions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VideoPackage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'queued'), ('running', 'running'), ('ready', 'ready'), ('failed', 'failed')], db_index=True, default='queued', max_length=20)),
+                ('progress', models.FloatField(default=0)),
+                ('renditions', models.JSONField(blank=True, default=list)),
+                ('source', models.CharField(blank=True, max_length=255)),
+                ('error', models.TextField(blank=True)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('video', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='package', to='movie_app.movievideo')),
+            ],
+        ),
+    ]
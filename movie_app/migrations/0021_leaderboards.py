@@ -0,0 +1,37 @@
+# Generated by Django 6.0 on 2026-10-17 19:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_app', '0020_movie_neighbors'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Leaderboard',
+            fields=[
+                ('name', models.CharField(choices=[('trending', 'trending'), ('top_rated', 'top_rated')], max_length=20, primary_key=True, serialize=False)),
+                ('cursor', models.BigIntegerField(default=0)),
+                ('mean', models.FloatField(default=0)),
+                ('synced_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('board', models.CharField(choices=[('trending', 'trending'), ('top_rated', 'top_rated')], max_length=20)),
+                ('scope', models.CharField(max_length=50)),
+                ('status', models.CharField(choices=[('pro', 'pro'), ('simple', 'simple')], max_length=20)),
+                ('score', models.FloatField()),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leaderboard_entries', to='movie_app.movie')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['board', 'scope', '-score', '-id'], name='movie_app_l_board_e0d738_idx'), models.Index(fields=['board', 'scope', 'status', '-score', '-id'], name='movie_app_l_board_4cc7ba_idx')],
+            },
+        ),
+    ]
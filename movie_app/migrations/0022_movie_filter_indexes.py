@@ -0,0 +1,54 @@
+# Generated by Django 6.0 on 2026-10-17 19:18
+
+from django.db import migrations, models
+
+# Auto-created link tables cannot declare Meta.indexes; these cover
+# MovieFilter's semi-joins, (<link>_id, movie_id) -> movie ids.
+LINK_INDEXES = {
+    'genre': 'movie_genre_link_idx',
+    'country': 'movie_country_link_idx',
+    'actor': 'movie_actor_link_idx',
+}
+
+
+def link_indexes(apps):
+    movie = apps.get_model('movie_app', 'Movie')
+    for field, name in LINK_INDEXES.items():
+        yield movie._meta.get_field(field).remote_field.through, models.Index(fields=[field, 'movie'], name=name)
+
+
+def add_link_indexes(apps, schema_editor):
+    for through, index in link_indexes(apps):
+        schema_editor.add_index(through, index)
+
+
+def remove_link_indexes(apps, schema_editor):
+    for through, index in link_indexes(apps):
+        schema_editor.remove_index(through, index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_app', '0021_leaderboards'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['movie_time', 'id'], name='movie_app_m_movie_t_e6dd29_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['rating_avg', 'id'], name='movie_app_m_rating__161103_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['movie_type', 'id'], name='movie_app_m_movie_t_20f798_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['status', 'id'], name='movie_app_m_status_4264d3_idx'),
+        ),
+        migrations.RunPython(add_link_indexes, remove_link_indexes),
+    ]
@@ -1,12 +1,26 @@
-from django.db import models
+import uuid
+
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Window
+from django.db.models.functions import Coalesce, RowNumber
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
 from phonenumber_field.modelfields import PhoneNumberField
 from django.core.validators import MinValueValidator, MaxValueValidator
 
+from .cache import RATING_CACHE_TAG, invalidate
+
 StatusChoices = (
         ('pro', 'pro'),
         ('simple', 'simple'))
 
+RATING_STARS = range(1, 11)
+RATING_AGGREGATE_FIELDS = ['rating_sum', 'rating_count', 'rating_avg', 'rating_histogram']
+
+
+def rating_histogram_default():
+    return {str(i): 0 for i in RATING_STARS}
+
 
 class UserProfile(AbstractUser):
     phone_number = PhoneNumberField(null=True, blank=True)
@@ -22,6 +36,7 @@ class UserProfile(AbstractUser):
 
 class Category(models.Model):
    category_name = models.CharField(max_length=100, unique=True)
+   updated_at = models.DateTimeField(auto_now=True)
 
 
    def __str__(self):
@@ -31,6 +46,7 @@ class Category(models.Model):
 class Genre(models.Model):
     genre_name = models.CharField(max_length=30)
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='genres')
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f'{self.genre_name}, {self.category}'
@@ -39,6 +55,7 @@ class Genre(models.Model):
 
 class Country(models.Model):
     country_name = models.CharField(max_length=100, unique=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.country_name
@@ -48,7 +65,13 @@ class Director(models.Model):
     director_photo = models.ImageField(upload_to='director_images')
     birth_date = models.DateField()
     bio = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['full_name_ru'], name='director_full_name_ru_idx'),
+            models.Index(fields=['full_name_en'], name='director_full_name_en_idx'),
+        ]
 
     def __str__(self):
         return self.full_name
@@ -59,11 +82,28 @@ class Actor(models.Model):
     actor_photo = models.ImageField(upload_to='actor_images')
     birth_date = models.DateField()
     bio = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['full_name_ru'], name='actor_full_name_ru_idx'),
+            models.Index(fields=['full_name_en'], name='actor_full_name_en_idx'),
+        ]
 
     def __str__(self):
         return self.full_name
 
 
+class MovieQuerySet(models.QuerySet):
+    def for_list(self):
+        # MovieListSerializer nests country and genre; prefetching keeps the
+        # number of queries per page constant regardless of page size.
+        return self.prefetch_related(
+            'country',
+            models.Prefetch('genre', queryset=Genre.objects.select_related('category')),
+        )
+
+
 class Movie(models.Model):
     movie_name = models.CharField(max_length=100)
     # slogan =models.CharField(max_length=100, null=True, blank=True)
@@ -84,18 +124,87 @@ class Movie(models.Model):
     trailer = models.URLField()
     description = models.TextField()
     status = models.CharField(max_length=20, choices=StatusChoices, default='simple')
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_avg = models.FloatField(default=0, editable=False)
+    rating_histogram = models.JSONField(default=rating_histogram_default, editable=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = MovieQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # keyset pages for ?ordering=year / -year
+            models.Index(fields=['year', 'id']),
+            # MovieFilter ranges and sets, each still scanned in id order
+            models.Index(fields=['movie_time', 'id']),
+            models.Index(fields=['rating_avg', 'id']),
+            models.Index(fields=['movie_type', 'id']),
+            models.Index(fields=['status', 'id']),
+            # natural-key lookups of import_catalog; named because the
+            # translation fields only exist once modeltranslation has run
+            models.Index(fields=['movie_name_ru'], name='movie_name_ru_idx'),
+            models.Index(fields=['movie_name_en'], name='movie_name_en_idx'),
+        ]
 
     def __str__(self):
         return self.movie_name
 
     def get_avg_rating(self):
-        all_ratings = self.ratings.all()
-        if all_ratings.exists():
-            return round(sum([i.stars for i in all_ratings]) / all_ratings.count(), 2)
-        return 0
+        return self.rating_avg
 
     def get_count_rating(self):
-        return self.ratings.count()
+        return self.rating_count
+
+    def set_rating_aggregates(self, histogram):
+        self.rating_histogram = {**rating_histogram_default(), **histogram}
+        self.rating_count = sum(self.rating_histogram.values())
+        self.rating_sum = sum(int(stars) * count for stars, count in self.rating_histogram.items())
+        self.rating_avg = round(self.rating_sum / self.rating_count, 2) if self.rating_count else 0
+
+    @classmethod
+    def apply_rating_changes(cls, movie_id, changes):
+        # changes: iterable of (stars, delta) pairs, e.g. [(7, -1), (9, 1)] for a 7 -> 9 edit
+        with transaction.atomic():
+            movie = cls.objects.select_for_update().only(*RATING_AGGREGATE_FIELDS).filter(pk=movie_id).first()
+            if movie is None:
+                return
+            histogram = {**rating_histogram_default(), **movie.rating_histogram}
+            for stars, delta in changes:
+                histogram[str(stars)] = max(histogram[str(stars)] + delta, 0)
+            movie.set_rating_aggregates(histogram)
+            movie.save(update_fields=RATING_AGGREGATE_FIELDS + ['updated_at'])
+
+    @classmethod
+    def rebuild_rating_aggregates(cls, movie_ids=None, chunk_size=1000):
+        movies = cls.objects.only(*RATING_AGGREGATE_FIELDS, 'updated_at').order_by('pk')
+        if movie_ids is not None:
+            movies = movies.filter(pk__in=set(movie_ids))
+        rebuilt = 0
+        last_pk = 0
+        while True:
+            chunk = list(movies.filter(pk__gt=last_pk)[:chunk_size])
+            if not chunk:
+                return rebuilt
+            histograms = {movie.pk: {} for movie in chunk}
+            rows = (Rating.objects.filter(movie_id__in=histograms)
+                    .values_list('movie_id', 'stars').annotate(total=Count('id')).order_by())
+            for movie_id, stars, total in rows:
+                histograms[movie_id][str(stars)] = total
+            changed = []
+            now = timezone.now()
+            for movie in chunk:
+                before = [getattr(movie, field) for field in RATING_AGGREGATE_FIELDS]
+                movie.set_rating_aggregates(histograms[movie.pk])
+                if before != [getattr(movie, field) for field in RATING_AGGREGATE_FIELDS]:
+                    movie.updated_at = now
+                    changed.append(movie)
+            cls.objects.bulk_update(changed, RATING_AGGREGATE_FIELDS + ['updated_at'])
+            if changed:
+                # bulk_update() sends no post_save for catalog_changed.
+                invalidate(RATING_CACHE_TAG, *[f'movie:{movie.pk}' for movie in changed])
+            rebuilt += len(chunk)
+            last_pk = chunk[-1].pk
 
 class MovieVideo(models.Model):
     video_name = models.CharField(max_length=100)
@@ -115,26 +224,177 @@ class MovieFrame(models.Model):
         return f'{self.movie}, {self.image}'
 
 
+class RatingQuerySet(models.QuerySet):
+    # Bulk operations bypass the per-row signals, so they rebuild the
+    # aggregates of every movie they touched instead.
+
+    def _affected_movie_ids(self):
+        return set(self.values_list('movie_id', flat=True).order_by().distinct())
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        Movie.rebuild_rating_aggregates({obj.movie_id for obj in objs})
+        return objs
+
+    def update(self, **kwargs):
+        # bulk_update() comes through here too, one update per batch.
+        if not {'stars', 'movie', 'movie_id'} & set(kwargs):
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db):
+            movie_ids = self._affected_movie_ids()
+            movie = kwargs.get('movie', kwargs.get('movie_id'))
+            pks = list(self.values_list('pk', flat=True)) if hasattr(movie, 'resolve_expression') else None
+            updated = super().update(**kwargs)
+            if pks is not None:
+                # A per-row CASE from bulk_update(): the new movies are only
+                # known once it ran.
+                movie_ids |= set(Rating.objects.filter(pk__in=pks).values_list('movie_id', flat=True).distinct())
+            elif movie is not None:
+                movie_ids.add(getattr(movie, 'pk', movie))
+            Movie.rebuild_rating_aggregates(movie_ids)
+        return updated
+
+    def delete(self):
+        with transaction.atomic(using=self.db):
+            movie_ids = self._affected_movie_ids()
+            deleted = super().delete()
+            Movie.rebuild_rating_aggregates(movie_ids)
+        return deleted
+
+
 class Rating(models.Model):
     user = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='ratings')
-    stars = models.PositiveIntegerField(choices=[(i, str(i))for i in range(1, 11)])
+    stars = models.PositiveIntegerField(choices=[(i, str(i))for i in RATING_STARS])
     created_date = models.DateTimeField(auto_now_add=True)
 
+    objects = RatingQuerySet.as_manager()
+
+    class Meta:
+        indexes = [models.Index(fields=['movie', 'id'])]
 
     def __str__(self):
         return f'{self.user}, {self.movie}, {self.stars}'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_rating = (instance.__dict__.get('movie_id'), instance.__dict__.get('stars'))
+        return instance
+
+REVIEW_PATH_STEP = 10
+# Deepest reply level; the path column holds one segment per level.
+REVIEW_MAX_DEPTH = 99
+
+
+class ReviewQuerySet(models.QuerySet):
+    def with_like_count(self):
+        likes = (ReviewLike.objects.filter(review=OuterRef('pk')).order_by()
+                 .values('review').annotate(total=Count('pk')).values('total'))
+        return self.annotate(like_count=Coalesce(Subquery(likes), 0))
+
+    def thread_rows(self, replies=None):
+        # Depth-first rows of whole threads; with `replies`, each thread is cut
+        # to its root plus the first `replies` descendants in path order.
+        rows = self.select_related('user').with_like_count().order_by('-root_id', 'path')
+        if replies is not None:
+            rows = rows.annotate(
+                thread_rank=Window(RowNumber(), partition_by=[F('root_id')], order_by=F('path').asc()),
+            ).filter(thread_rank__lte=replies + 1)
+        return rows
+
+
+def build_review_tree(rows):
+    # `rows` must be in path order, so every parent precedes its replies.
+    nodes = {}
+    roots = []
+    for review in rows:
+        review.replies = []
+        nodes[review.pk] = review
+        parent = nodes.get(review.parent_id)
+        if parent is None:
+            roots.append(review)
+        else:
+            parent.replies.append(review)
+    return roots
+
+
 class Review(models.Model):
     user = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='reviews')
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True)
     comment = models.TextField()
     created_date = models.DateTimeField(auto_now_add=True)
+    root = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True,
+                             related_name='thread_reviews', editable=False)
+    path = models.CharField(max_length=(REVIEW_PATH_STEP + 1) * (REVIEW_MAX_DEPTH + 1), default='', editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    objects = ReviewQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['movie', 'id']),
+            models.Index(fields=['movie', 'depth', 'id']),
+            models.Index(fields=['root', 'path']),
+        ]
 
     def __str__(self):
         return f'{self.user}, {self.comment}'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_parent_id = instance.__dict__.get('parent_id')
+        return instance
+
+    def parent_error(self, parent, movie_id):
+        # Why `parent` cannot hold this review (with its replies), or None.
+        if parent is None:
+            return None
+        if parent.movie_id != movie_id:
+            return 'Ответ должен относиться к тому же фильму'
+        if self.pk is not None and (parent.pk == self.pk or (self.path and parent.path.startswith(self.path))):
+            return 'Нельзя сделать отзыв ответом на самого себя или на свой ответ'
+        levels = 0
+        if self.path:
+            deepest = Review.objects.filter(root_id=self.root_id, path__startswith=self.path).aggregate(
+                deepest=models.Max('depth'))['deepest']
+            levels = (deepest or self.depth) - self.depth
+        if parent.depth + 1 + levels > REVIEW_MAX_DEPTH:
+            return 'Слишком глубокая ветка ответов'
+        return None
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        moved = adding or self.parent_id != getattr(self, '_loaded_parent_id', self.parent_id)
+        if moved:
+            error = self.parent_error(self.parent, self.movie_id)
+            if error:
+                raise ValueError(error)
+        super().save(*args, **kwargs)
+        if moved:
+            self.set_thread_position()
+        self._loaded_parent_id = self.parent_id
+
+    def set_thread_position(self):
+        old_root_id, old_path = self.root_id, self.path
+        segment = f'{self.pk:0{REVIEW_PATH_STEP}d}/'
+        if self.parent_id is None:
+            self.root_id, self.depth, self.path = self.pk, 0, segment
+        else:
+            parent = self.parent
+            self.root_id, self.depth, self.path = parent.root_id or parent.pk, parent.depth + 1, parent.path + segment
+        Review.objects.filter(pk=self.pk).update(root_id=self.root_id, depth=self.depth, path=self.path)
+        if not old_path or old_path == self.path:
+            return
+        descendants = list(Review.objects.filter(root_id=old_root_id, path__startswith=old_path).exclude(pk=self.pk))
+        for review in descendants:
+            review.root_id = self.root_id
+            review.path = self.path + review.path[len(old_path):]
+            review.depth = review.path.count('/') - 1
+        Review.objects.bulk_update(descendants, ['root', 'path', 'depth'], batch_size=500)
+
 
 
 class Favorite(models.Model):
@@ -149,6 +409,11 @@ class FavoriteItem(models.Model):
     favorite = models.ForeignKey(Favorite, on_delete=models.CASCADE)
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['favorite', 'movie'], name='unique_favorite_movie'),
+        ]
+
     def __str__(self):
         return f'{self.movie}'
 
@@ -159,6 +424,12 @@ class History(models.Model):
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
     created_date = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # a user's history, newest first, paged on (created_date, id)
+            models.Index(fields=['user', '-created_date', '-id']),
+        ]
+
     def __str__(self):
         return f'{self.user}, {self.movie}, {self.created_date}'
 
@@ -181,3 +452,154 @@ class ReviewLike(models.Model):
 
     def __str__(self):
         return f'{self.user}, {self.review}'
+
+
+class MediaBlob(models.Model):
+    # One row per stored upload; refcount is the number of file-field values
+    # that point at it (see blobs.py).
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField(default=0)
+    refcount = models.IntegerField(default=0)
+    created_date = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.name} ({self.refcount})'
+
+
+class UploadSession(models.Model):
+    # A resumable MovieVideo upload; chunks are written straight into a
+    # preallocated file at MEDIA_ROOT/uploads/<id>.part (see uploads.py).
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
+    video_name = models.CharField(max_length=100)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    created_date = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return f'{self.filename}, {self.movie}'
+
+
+class UploadChunk(models.Model):
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='chunks')
+    offset = models.BigIntegerField()
+    length = models.BigIntegerField()
+    sha256 = models.CharField(max_length=64)
+
+    class Meta:
+        unique_together = ('session', 'offset')
+
+    def __str__(self):
+        return f'{self.session_id}, {self.offset}+{self.length}'
+
+
+class VideoPackage(models.Model):
+    # HLS renditions of a MovieVideo, produced by the package_videos worker
+    # (see packaging.py); `renditions` lists the finished tiers and `source`
+    # the file they were cut from.
+    PackageStatusChoices = (
+        ('queued', 'queued'),
+        ('running', 'running'),
+        ('ready', 'ready'),
+        ('failed', 'failed'),)
+    video = models.OneToOneField(MovieVideo, on_delete=models.CASCADE, related_name='package')
+    status = models.CharField(max_length=20, choices=PackageStatusChoices, default='queued', db_index=True)
+    progress = models.FloatField(default=0)
+    renditions = models.JSONField(default=list, blank=True)
+    source = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    created_date = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.video}, {self.status}'
+
+
+class Job(models.Model):
+    # A unit of background work for the run_jobs worker (see jobs.py).
+    # Only one queued job may hold a given idempotency key at a time.
+    JobStatusChoices = (
+        ('queued', 'queued'),
+        ('running', 'running'),
+        ('done', 'done'),
+        ('failed', 'failed'),)
+    name = models.CharField(max_length=100)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=JobStatusChoices, default='queued')
+    key = models.CharField(max_length=255, null=True, blank=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    last_error = models.TextField(blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    created_date = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # the worker's claim query: due queued jobs, oldest first
+            models.Index(fields=['status', 'run_after']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['key'], condition=models.Q(status='queued'), name='unique_queued_job_key'),
+        ]
+
+    def __str__(self):
+        return f'{self.name}, {self.status}'
+
+
+class MovieNeighbors(models.Model):
+    # Precomputed top-K similar movies (see recommendations.py), best first,
+    # with their blended similarity scores. `fingerprint` summarises the
+    # movie's interactions and features at training time so retraining can
+    # skip movies whose inputs did not change.
+    movie = models.OneToOneField(Movie, on_delete=models.CASCADE, primary_key=True, related_name='neighbors')
+    neighbor_ids = models.JSONField(default=list)
+    scores = models.JSONField(default=list)
+    fingerprint = models.CharField(max_length=64)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.movie_id}, {len(self.neighbor_ids)}'
+
+
+LeaderboardChoices = (
+    ('trending', 'trending'),
+    ('top_rated', 'top_rated'))
+
+
+class Leaderboard(models.Model):
+    # Refresh state of one board (see leaderboards.py): the last History id
+    # folded into the trending scores, the catalog-wide mean rating the
+    # top-rated scores were computed with, and when movie edits were last
+    # picked up.
+    name = models.CharField(max_length=20, choices=LeaderboardChoices, primary_key=True)
+    cursor = models.BigIntegerField(default=0)
+    mean = models.FloatField(default=0)
+    synced_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.name}, {self.synced_at}'
+
+
+class LeaderboardEntry(models.Model):
+    # One row per board, movie and scope: 'all', 'genre:<id>',
+    # 'country:<id>' and 'genre:<id>|country:<id>' for each of the movie's
+    # links. Any genre/country/status filter is then one range scan of an
+    # index already in score order.
+    board = models.CharField(max_length=20, choices=LeaderboardChoices)
+    scope = models.CharField(max_length=50)
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='leaderboard_entries')
+    status = models.CharField(max_length=20, choices=StatusChoices)
+    score = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['board', 'scope', '-score', '-id']),
+            models.Index(fields=['board', 'scope', 'status', '-score', '-id']),
+        ]
+
+    def __str__(self):
+        return f'{self.board}, {self.scope}, {self.movie_id}, {self.score}'
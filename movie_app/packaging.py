@@ -0,0 +1,216 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Movie, VideoPackage
+from .storage import blob_hash
+
+HLS_DIR = 'hls'
+SEGMENT_SECONDS = 6
+PROGRESS_INTERVAL = 2.0
+
+# movie_type tier -> (height, video kbit/s, audio kbit/s)
+RENDITIONS = {
+    '360p': (360, 800, 96),
+    '480p': (480, 1400, 128),
+    '720p': (720, 2800, 128),
+    '1080p': (1080, 5000, 192),
+    '1080p Ultra': (1080, 8000, 192),
+}
+
+
+def tiers_for(movie_type, source_height):
+    # Every tier up to the movie's own, never above the source resolution
+    # (the lowest tier is always produced).
+    order = [tier for tier, _ in Movie.MovieTypeChoices]
+    wanted = order[:order.index(movie_type) + 1] if movie_type in order else order
+    tiers = [tier for tier in wanted if RENDITIONS[tier][0] <= source_height]
+    return tiers or wanted[:1]
+
+
+def output_key(video):
+    # Renditions live under the source's content hash, so a re-uploaded
+    # identical file is packaged once.
+    return blob_hash(video.video.name) or f'video-{video.pk}'
+
+
+def output_path(*parts):
+    return default_storage.path(os.path.join(HLS_DIR, *parts))
+
+
+def output_url(*parts):
+    return f'{settings.MEDIA_URL}{HLS_DIR}/' + '/'.join(parts)
+
+
+class FFmpegPackager:
+    # Transcodes one rendition at a time with the local ffmpeg binary into
+    # VOD HLS, with keyframes forced every SEGMENT_SECONDS so segments line
+    # up across tiers and players can switch at every boundary.
+
+    def __init__(self):
+        self.ffmpeg = getattr(settings, 'FFMPEG_BINARY', 'ffmpeg')
+        self.ffprobe = getattr(settings, 'FFPROBE_BINARY', 'ffprobe')
+
+    def probe(self, source):
+        output = subprocess.run(
+            [self.ffprobe, '-v', 'error', '-select_streams', 'v:0', '-show_entries',
+             'stream=width,height:format=duration', '-of', 'json', source],
+            check=True, capture_output=True, text=True).stdout
+        data = json.loads(output)
+        stream = data['streams'][0]
+        return {'width': stream['width'], 'height': stream['height'],
+                'duration': float(data['format'].get('duration') or 0)}
+
+    def package(self, source, target, tier, info, on_progress):
+        height, video_rate, audio_rate = RENDITIONS[tier]
+        command = [
+            self.ffmpeg, '-hide_banner', '-nostdin', '-nostats', '-y', '-i', source,
+            '-map', '0:v:0', '-map', '0:a:0?', '-vf', f'scale=-2:{height}',
+            '-c:v', 'libx264', '-preset', 'veryfast', '-profile:v', 'main',
+            '-b:v', f'{video_rate}k', '-maxrate', f'{int(video_rate * 1.07)}k', '-bufsize', f'{video_rate * 3 // 2}k',
+            '-sc_threshold', '0',
+            '-force_key_frames', f'expr:gte(t,n_forced*{SEGMENT_SECONDS})',
+            '-c:a', 'aac', '-b:a', f'{audio_rate}k', '-ac', '2',
+            '-f', 'hls', '-hls_time', str(SEGMENT_SECONDS), '-hls_playlist_type', 'vod',
+            '-hls_segment_filename', os.path.join(target, 'segment_%05d.ts'),
+            '-progress', 'pipe:1', os.path.join(target, 'index.m3u8'),
+        ]
+        # stderr goes to a file: a pipe nobody reads while stdout is being
+        # followed would fill up and stall ffmpeg. Only its tail is kept.
+        with tempfile.TemporaryFile() as stderr:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr, text=True)
+            try:
+                for line in process.stdout:
+                    key, _, value = line.strip().partition('=')
+                    if key == 'out_time_us' and value.isdigit() and info['duration']:
+                        on_progress(min(int(value) / 1e6 / info['duration'], 1.0))
+            except BaseException:
+                # Nobody would read its output any more.
+                process.kill()
+                process.wait()
+                raise
+            if process.wait():
+                stderr.seek(max(0, stderr.seek(0, os.SEEK_END) - 2000))
+                tail = stderr.read().decode(errors='replace')
+                raise RuntimeError(f'ffmpeg exited with {process.returncode}: {tail}')
+
+
+class StubPackager:
+    # Writes well-formed playlists with placeholder segments instead of
+    # transcoding; for tests and machines without ffmpeg.
+    width, height, duration = 1920, 1080, 60.0
+
+    def probe(self, source):
+        return {'width': self.width, 'height': self.height, 'duration': self.duration}
+
+    def package(self, source, target, tier, info, on_progress):
+        count = max(1, int(-(-info['duration'] // SEGMENT_SECONDS)))
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3', f'#EXT-X-TARGETDURATION:{SEGMENT_SECONDS}',
+                 '#EXT-X-PLAYLIST-TYPE:VOD', '#EXT-X-MEDIA-SEQUENCE:0']
+        for index in range(count):
+            length = min(SEGMENT_SECONDS, info['duration'] - index * SEGMENT_SECONDS)
+            with open(os.path.join(target, f'segment_{index:05d}.ts'), 'wb') as segment:
+                segment.write(tier.encode())
+            lines += [f'#EXTINF:{length:.3f},', f'segment_{index:05d}.ts']
+            on_progress((index + 1) / count)
+        with open(os.path.join(target, 'index.m3u8'), 'w') as playlist:
+            playlist.write('\n'.join(lines + ['#EXT-X-ENDLIST', '']))
+
+
+def get_packager():
+    return import_string(getattr(settings, 'VIDEO_PACKAGER', 'movie_app.packaging.FFmpegPackager'))()
+
+
+def enqueue(video_ids):
+    # Queues (or re-queues) packaging; the package_videos command runs it.
+    existing = set(VideoPackage.objects.filter(video_id__in=video_ids).values_list('video_id', flat=True))
+    VideoPackage.objects.bulk_create([VideoPackage(video_id=pk) for pk in set(video_ids) - existing])
+    VideoPackage.objects.filter(video_id__in=existing).exclude(status='running').update(
+        status='queued', progress=0, error='', updated_at=timezone.now())
+
+
+def claim(limit):
+    # A conditional UPDATE per job, so concurrent workers never run the same
+    # package twice, on any database backend.
+    claimed = []
+    for pk in VideoPackage.objects.filter(status='queued').order_by('created_date').values_list('pk', flat=True)[:limit * 2]:
+        if VideoPackage.objects.filter(pk=pk, status='queued').update(status='running', updated_at=timezone.now()):
+            claimed.append(pk)
+            if len(claimed) == limit:
+                break
+    return claimed
+
+
+def requeue_stale(minutes):
+    # Jobs left 'running' by a worker that died.
+    cutoff = timezone.now() - timedelta(minutes=minutes)
+    return VideoPackage.objects.filter(status='running', updated_at__lt=cutoff).update(
+        status='queued', updated_at=timezone.now())
+
+
+def run_package(package_id):
+    # Process-pool entry point: packages every tier of one video and records
+    # progress in its VideoPackage row as it goes.
+    close_old_connections()
+    package = VideoPackage.objects.select_related('video__movie').get(pk=package_id)
+    video = package.video
+    last_saved = 0.0
+
+    def report(fraction, force=False):
+        nonlocal last_saved
+        if force or time.monotonic() - last_saved >= PROGRESS_INTERVAL:
+            last_saved = time.monotonic()
+            VideoPackage.objects.filter(pk=package_id).update(progress=round(fraction, 4), updated_at=timezone.now())
+
+    try:
+        packager = get_packager()
+        source = default_storage.path(video.video.name)
+        info = packager.probe(source)
+        tiers = tiers_for(video.movie.movie_type, info['height'])
+        key = output_key(video)
+        renditions = []
+        for index, tier in enumerate(tiers):
+            target = output_path(key, tier)
+            height, video_rate, audio_rate = RENDITIONS[tier]
+            if not os.path.exists(os.path.join(target, 'index.m3u8')):
+                partial = f'{target}.partial-{os.getpid()}'
+                shutil.rmtree(partial, ignore_errors=True)
+                os.makedirs(partial)
+                packager.package(source, partial, tier, info,
+                                 lambda fraction: report((index + fraction) / len(tiers)))
+                shutil.rmtree(target, ignore_errors=True)
+                os.replace(partial, target)
+            width = round(info['width'] * height / info['height'] / 2) * 2
+            renditions.append({'tier': tier, 'width': width, 'height': height,
+                               'bandwidth': (video_rate + audio_rate) * 1000,
+                               'playlist': output_url(key, tier, 'index.m3u8')})
+            report((index + 1) / len(tiers), force=True)
+        VideoPackage.objects.filter(pk=package_id).update(
+            status='ready', progress=1, renditions=renditions, source=video.video.name, error='',
+            updated_at=timezone.now())
+        return package_id, 'ready'
+    except Exception as error:
+        VideoPackage.objects.filter(pk=package_id).update(
+            status='failed', error=str(error)[:4000], updated_at=timezone.now())
+        return package_id, 'failed'
+    finally:
+        close_old_connections()
+
+
+def master_playlist(package, build_url):
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-INDEPENDENT-SEGMENTS']
+    for rendition in sorted(package.renditions, key=lambda item: item['bandwidth']):
+        lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={rendition["bandwidth"]},'
+                     f'RESOLUTION={rendition["width"]}x{rendition["height"]},NAME="{rendition["tier"]}"')
+        lines.append(build_url(rendition['playlist']))
+    return '\n'.join(lines) + '\n'
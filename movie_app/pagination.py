@@ -1,11 +1,230 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import hashlib
+import json
 
+from django.conf import settings
+from django.core.cache import caches
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
-class MoviePagination(PageNumberPagination):
+
+class CachedCountPaginator(Paginator):
+    # COUNT(*) over a large filtered table is the expensive half of page-number
+    # pagination, so totals are cached per query for a short while. Unfiltered
+    # tables on PostgreSQL use the planner's row estimate once it is large.
+    count_timeout = 60
+    approximate_threshold = 100_000
+
+    @cached_property
+    def count(self):
+        if not isinstance(self.object_list, QuerySet):
+            return super().count
+        sql, params = self.object_list.query.sql_with_params()
+        key = 'pagination:count:' + hashlib.md5(f'{sql}|{params!r}'.encode()).hexdigest()
+        cache = caches[getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')]
+        total = cache.get(key)
+        if total is None:
+            total = self.approximate_count()
+            if total is None:
+                total = self.object_list.count()
+            cache.set(key, total, self.count_timeout)
+        return total
+
+    def approximate_count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql' or queryset.query.where:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                           [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        if row is None or row[0] < self.approximate_threshold:
+            return None
+        return row[0]
+
+
+class CachedCountPagination(PageNumberPagination):
+    django_paginator_class = CachedCountPaginator
+
+
+class KeysetPagination(BasePagination):
+    # Cursor pagination on (sort_key, id): the cursor carries the last row's
+    # sort value and id, so every page is an index range scan with no OFFSET
+    # and no COUNT, and rows sharing a sort value are never skipped or
+    # repeated. The sort key comes from OrderingFilter when the view declares
+    # `ordering_fields`, otherwise from `ordering`. With `page_numbers` set,
+    # ?page=N opts back into numbered pages with a cached total count.
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering = '-id'
+    page_numbers = False
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def get_page_number_paginator(self):
+        paginator = CachedCountPagination()
+        paginator.page_size = self.page_size
+        paginator.page_size_query_param = self.page_size_query_param
+        paginator.max_page_size = self.max_page_size
+        return paginator
+
+    def get_sort(self, queryset, view):
+        ordering = self.ordering
+        if getattr(view, 'ordering_fields', None) and queryset.query.order_by:
+            ordering = queryset.query.order_by[0]
+        descending = ordering.startswith('-')
+        field = ordering.lstrip('-')
+        if field in ('pk', queryset.model._meta.pk.name):
+            field = 'id'
+        return field, descending
+
+    def encode_cursor(self, item, reverse):
+        value = getattr(item, self.field)
+        value = value.isoformat() if hasattr(value, 'isoformat') else value
+        payload = json.dumps([value, item.pk, int(reverse)], separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            value, pk, reverse = json.loads(base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)))
+            value = model._meta.get_field(self.field).to_python(value)
+            return (value, int(pk)), bool(reverse)
+        except Exception:
+            raise NotFound('Invalid cursor')
+
+    def position_filter(self, position, descending):
+        value, pk = position
+        op = 'lt' if descending else 'gt'
+        if self.field == 'id':
+            return Q(**{f'id__{op}': pk})
+        return Q(**{f'{self.field}__{op}': value}) | Q(**{self.field: value, f'id__{op}': pk})
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        self.delegate = None
+        self.field, self.descending = self.get_sort(queryset, view)
+        fields = ['id'] if self.field == 'id' else [self.field, 'id']
+        if self.page_numbers and CachedCountPagination.page_query_param in request.query_params:
+            self.delegate = self.get_page_number_paginator()
+            ordering = [f'-{field}' if self.descending else field for field in fields]
+            return self.delegate.paginate_queryset(queryset.order_by(*ordering), request, view)
+
+        position, reverse = self.decode_cursor(request, queryset.model)
+        descending = self.descending != reverse
+        queryset = queryset.order_by(*[f'-{field}' if descending else field for field in fields])
+        if position is not None:
+            queryset = queryset.filter(self.position_filter(position, descending))
+
+        page_size = self.get_page_size(request)
+        items = list(queryset[:page_size + 1])
+        has_more = len(items) > page_size
+        items = items[:page_size]
+        if reverse:
+            items.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.page = items
+        return items
+
+    def get_next_link(self):
+        if self.delegate is not None:
+            return self.delegate.get_next_link()
+        if not self.has_next or not self.page:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(self.page[-1], False))
+
+    def get_previous_link(self):
+        if self.delegate is not None:
+            return self.delegate.get_previous_link()
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(self.page[0], True))
+
+    def get_paginated_response(self, data):
+        if self.delegate is not None:
+            return self.delegate.get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class MoviePagination(KeysetPagination):
     page_size = 5
+    ordering = 'id'
+    page_numbers = True
 
-class CategoryPagination(PageNumberPagination):
+
+class CategoryPagination(KeysetPagination):
     page_size = 4
+    ordering = 'id'
+    page_numbers = True
+
 
-class GenrePagination(PageNumberPagination):
+class GenrePagination(KeysetPagination):
     page_size = 6
+    ordering = 'id'
+    page_numbers = True
+
+
+class NestedMoviePagination(KeysetPagination):
+    page_size = 10
+    max_page_size = 50
+
+
+class MovieItemPagination(KeysetPagination):
+    pass
+
+
+class MovieMediaPagination(KeysetPagination):
+    ordering = 'id'
+
+
+class HistoryPagination(KeysetPagination):
+    ordering = '-created_date'
+
+
+class FavoriteItemPagination(KeysetPagination):
+    pass
+
+
+class ReviewLikePagination(KeysetPagination):
+    pass
+
+
+class LeaderboardPagination(KeysetPagination):
+    ordering = '-score'
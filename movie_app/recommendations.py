@@ -0,0 +1,282 @@
+import hashlib
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+from scipy import sparse
+
+from .cache import invalidate
+from .models import Movie, MovieNeighbors, Rating, History, FavoriteItem, RATING_STARS
+
+# Implicit signals on the same 0..1 scale as stars / max(stars).
+HISTORY_WEIGHT = 0.5
+FAVORITE_WEIGHT = 1.0
+# Co-rating similarity is damped by n / (n + SHRINKAGE) for n co-raters, so
+# two movies sharing a single fan do not look identical.
+SHRINKAGE = 10
+# Dense score block budget, in cells (movies x chunk).
+BLOCK_CELLS = 20_000_000
+# How many of a user's latest signals seed their recommendations.
+SEED_LIMIT = 30
+
+
+def neighbor_count():
+    return getattr(settings, 'RECOMMENDATION_NEIGHBORS', 20)
+
+
+def blend_weights():
+    return {'ratings': 0.6, 'genre': 0.25, 'cast': 0.15, **getattr(settings, 'RECOMMENDATION_WEIGHTS', {})}
+
+
+def rows(queryset, fields):
+    # The values_list() query run on a raw cursor, fetched in chunks into an
+    # (n, len(fields)) int64 array; model iteration would dominate training.
+    sql, params = queryset.order_by().values_list(*fields).query.sql_with_params()
+    chunks = [np.empty((0, len(fields)), dtype=np.int64)]
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(sql, params)
+        while batch := cursor.fetchmany(100_000):
+            chunks.append(np.array(batch, dtype=np.int64))
+    return np.concatenate(chunks)
+
+
+def positions(movie_ids, values):
+    # Index of each value in the sorted `movie_ids`, -1 when absent.
+    found = np.searchsorted(movie_ids, values)
+    found[found >= len(movie_ids)] = 0
+    return np.where(movie_ids[found] == values, found, -1) if len(movie_ids) else np.full(len(values), -1)
+
+
+def interaction_matrix(movie_ids):
+    # users x movies, keeping the strongest signal per pair.
+    ratings = rows(Rating.objects.all(), ['user_id', 'movie_id', 'stars'])
+    history = rows(History.objects.distinct(), ['user_id', 'movie_id'])
+    favorites = rows(FavoriteItem.objects.all(), ['favorite__user_id', 'movie_id'])
+    users = np.concatenate([ratings[:, 0], history[:, 0], favorites[:, 0]])
+    columns = positions(movie_ids, np.concatenate([ratings[:, 1], history[:, 1], favorites[:, 1]]))
+    weights = np.concatenate([ratings[:, 2] / max(RATING_STARS), np.full(len(history), HISTORY_WEIGHT),
+                              np.full(len(favorites), FAVORITE_WEIGHT)])
+    keep = columns >= 0
+    user_ids, user_rows = np.unique(users[keep], return_inverse=True)
+    keys = user_rows.astype(np.int64) * len(movie_ids) + columns[keep]
+    order = np.lexsort((weights[keep], keys))
+    keys, weights = keys[order], weights[keep][order]
+    last = np.append(keys[1:] != keys[:-1], True) if len(keys) else keys.astype(bool)
+    keys, weights = keys[last], weights[last]
+    matrix = sparse.csr_matrix((weights, (keys // len(movie_ids), keys % len(movie_ids))),
+                               shape=(len(user_ids), len(movie_ids)))
+    return matrix, user_ids
+
+
+def link_matrix(through, column, movie_ids):
+    # movies x linked objects (genres, actors, ...), 1 where linked.
+    links = rows(through.objects.all(), ['movie_id', column])
+    movie_rows = positions(movie_ids, links[:, 0])
+    keep = movie_rows >= 0
+    feature_ids, feature_columns = np.unique(links[keep, 1], return_inverse=True)
+    matrix = sparse.csr_matrix((np.ones(keep.sum()), (movie_rows[keep], feature_columns)),
+                               shape=(len(movie_ids), len(feature_ids)))
+    matrix.data[:] = 1
+    return matrix, feature_ids
+
+
+def scale(matrix, row_factors=None, column_factors=None):
+    if row_factors is not None:
+        matrix = sparse.diags(row_factors) @ matrix
+    if column_factors is not None:
+        matrix = matrix @ sparse.diags(column_factors)
+    return matrix
+
+
+def inverse_norms(matrix, axis):
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=axis)).ravel())
+    return np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+
+
+class Scorer:
+    # Blended similarity of every movie to a block of movies: cosine over
+    # co-ratings (damped by co-rater count), plus cosine over shared genres
+    # and over shared cast (actors and directors).
+
+    def __init__(self, interactions, genres, cast, weights):
+        normalized = scale(interactions, column_factors=inverse_norms(interactions, 0))
+        binary = interactions.copy()
+        binary.data[:] = 1
+        self.ratings, self.ratings_t = normalized.tocsc(), normalized.T.tocsr()
+        self.binary, self.binary_t = binary.tocsc(), binary.T.tocsr()
+        self.genres = scale(genres, row_factors=inverse_norms(genres, 1)).tocsr()
+        self.cast = scale(cast, row_factors=inverse_norms(cast, 1)).tocsr()
+        self.weights = weights
+
+    def block(self, columns):
+        ratings = (self.ratings_t @ self.ratings[:, columns]).toarray()
+        co_raters = (self.binary_t @ self.binary[:, columns]).toarray()
+        ratings *= co_raters / (co_raters + SHRINKAGE)
+        scores = self.weights['ratings'] * ratings
+        scores += self.weights['genre'] * (self.genres @ self.genres[columns].T).toarray()
+        scores += self.weights['cast'] * (self.cast @ self.cast[columns].T).toarray()
+        return scores
+
+
+def fingerprints(interactions, user_ids, links, salt):
+    # A digest per movie of everything its similarities depend on: who
+    # interacted with it and how strongly, and what it is linked to.
+    columns = interactions.tocsc()
+    stats = [np.diff(columns.indptr), np.asarray(columns.sum(axis=0)).ravel(),
+             interactions.T @ (user_ids % 1_000_003 + 1).astype(float)]
+    for matrix, feature_ids in links:
+        stats += [np.diff(matrix.indptr), matrix @ (feature_ids % 1_000_003 + 1).astype(float)]
+    stats = np.round(np.column_stack(stats), 6)
+    return [hashlib.md5(f'{salt}|{row.tolist()}'.encode()).hexdigest() for row in stats]
+
+
+def top_k(scores, ids, k):
+    # Per row, the k best (score, id) pairs in descending order, padded
+    # with (-inf, -1).
+    if scores.shape[1] < k:
+        padding = k - scores.shape[1]
+        scores = np.hstack([scores, np.full((len(scores), padding), -np.inf)])
+        ids = np.hstack([ids, np.full((len(ids), padding), -1, dtype=np.int64)])
+    elif scores.shape[1] > k:
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores, ids = np.take_along_axis(scores, best, 1), np.take_along_axis(ids, best, 1)
+    order = np.argsort(-scores, axis=1, kind='stable')
+    return np.take_along_axis(scores, order, 1), np.take_along_axis(ids, order, 1)
+
+
+def train(full=False):
+    # Item-item neighbors for every movie. Only movies whose fingerprint
+    # changed ("dirty") are rescored, against all movies; everyone else keeps
+    # their stored list, merged with their new scores against the dirty
+    # movies. A clean neighbor never needs rescoring because a pair's score
+    # only depends on its two movies. A dirty neighbor that sank out of a
+    # clean movie's list can leave a slot a full rebuild would refill;
+    # `full=True` recomputes everything.
+    started = time.perf_counter()
+    k, weights = neighbor_count(), blend_weights()
+    movie_ids = np.fromiter(Movie.objects.order_by('pk').values_list('pk', flat=True), dtype=np.int64)
+    n = len(movie_ids)
+    interactions, user_ids = interaction_matrix(movie_ids)
+    genres = link_matrix(Movie.genre.through, 'genre_id', movie_ids)
+    actors = link_matrix(Movie.actor.through, 'actor_id', movie_ids)
+    directors = link_matrix(Movie.director.through, 'director_id', movie_ids)
+    cast = sparse.hstack([actors[0], directors[0]]).tocsr()
+    prints = fingerprints(interactions, user_ids, [genres, actors, directors], f'{k}|{sorted(weights.items())}')
+
+    stored = {movie_id: (neighbor_ids, scores, fingerprint) for movie_id, neighbor_ids, scores, fingerprint
+              in MovieNeighbors.objects.values_list('movie_id', 'neighbor_ids', 'scores', 'fingerprint')}
+    dirty = np.array([full or stored.get(movie_id, (None, None, None))[2] != fingerprint
+                      for movie_id, fingerprint in zip(movie_ids.tolist(), prints)], dtype=bool)
+    best_scores, best_columns = np.full((n, k), -np.inf), np.full((n, k), -1, dtype=np.int64)
+    for row in np.flatnonzero(~dirty):
+        neighbor_ids, scores, _ = stored.get(int(movie_ids[row]), ([], [], None))
+        columns = positions(movie_ids, np.array(neighbor_ids, dtype=np.int64))
+        keep = (columns >= 0) & ~dirty[np.maximum(columns, 0)]
+        count = min(int(keep.sum()), k)
+        best_columns[row, :count] = columns[keep][:count]
+        best_scores[row, :count] = np.array(scores, dtype=float)[keep][:count]
+    initial_columns = best_columns.copy()
+
+    scorer = Scorer(interactions, genres[0], cast, weights)
+    dirty_rows = np.flatnonzero(dirty)
+    own_scores, own_columns = np.empty((len(dirty_rows), k)), np.empty((len(dirty_rows), k), dtype=np.int64)
+    chunk_size = max(1, min(512, BLOCK_CELLS // max(n, 1)))
+    for start in range(0, len(dirty_rows), chunk_size):
+        chunk = dirty_rows[start:start + chunk_size]
+        scores = scorer.block(chunk)
+        scores[chunk, np.arange(len(chunk))] = -np.inf
+        scores[scores <= 0] = -np.inf
+        # The matrix is symmetric: column j is dirty movie j's full row...
+        own_scores[start:start + len(chunk)], own_columns[start:start + len(chunk)] = top_k(
+            scores.T, np.broadcast_to(np.arange(n), (len(chunk), n)), k)
+        # ...and row i holds movie i's new scores against this chunk.
+        best_scores, best_columns = top_k(np.hstack([best_scores, scores]),
+                                          np.hstack([best_columns, np.broadcast_to(chunk, (n, len(chunk)))]), k)
+    best_scores[dirty_rows], best_columns[dirty_rows] = own_scores, own_columns
+    best_columns[np.isinf(best_scores)] = -1
+
+    changed = dirty | (best_columns != initial_columns).any(axis=1)
+    now = timezone.now()
+    entries = []
+    for row in np.flatnonzero(changed):
+        keep = best_columns[row] >= 0
+        entries.append(MovieNeighbors(
+            movie_id=int(movie_ids[row]), neighbor_ids=movie_ids[best_columns[row][keep]].tolist(),
+            scores=np.round(best_scores[row][keep], 5).tolist(), fingerprint=prints[row], updated_at=now))
+    # Replacing rows is much cheaper than bulk_update's CASE per column;
+    # readers see either the old or the new lists.
+    with transaction.atomic():
+        replaced = [entry.movie_id for entry in entries if entry.movie_id in stored]
+        for start in range(0, len(replaced), 500):
+            MovieNeighbors.objects.filter(movie_id__in=replaced[start:start + 500]).delete()
+        MovieNeighbors.objects.bulk_create(entries, batch_size=500)
+    if entries:
+        transaction.on_commit(lambda: invalidate('recommendations'))
+    return {
+        'movies': n, 'users': len(user_ids), 'interactions': interactions.nnz,
+        'rescored': int(dirty.sum()), 'written': len(entries),
+        'seconds': round(time.perf_counter() - started, 2),
+    }
+
+
+def similar_movies(movie_id, limit):
+    # One indexed row plus the movies it names: O(K).
+    row = MovieNeighbors.objects.filter(movie_id=movie_id).values_list('neighbor_ids', 'scores').first()
+    if row is None:
+        return []
+    neighbor_ids, scores = row[0][:limit], row[1][:limit]
+    movies = Movie.objects.for_list().in_bulk(neighbor_ids)
+    result = []
+    for movie_id, score in zip(neighbor_ids, scores):
+        if movie_id in movies:
+            movie = movies[movie_id]
+            movie.recommendation_score, movie.recommended_because = score, None
+            result.append(movie)
+    return result
+
+
+def user_seeds(user_id):
+    # movie -> weight from the user's latest signals. Ratings replace the
+    # implicit ones and go negative below the middle of the scale, so movies
+    # like the ones the user disliked are pushed down.
+    seeds = {}
+    watched = (History.objects.filter(user_id=user_id).order_by('-created_date', '-id')
+               .values_list('movie_id', flat=True)[:SEED_LIMIT])
+    seeds.update(dict.fromkeys(watched, HISTORY_WEIGHT))
+    favorites = FavoriteItem.objects.filter(favorite__user_id=user_id).order_by('-id').values_list('movie_id', flat=True)
+    seeds.update(dict.fromkeys(favorites[:SEED_LIMIT], FAVORITE_WEIGHT))
+    middle, spread = (min(RATING_STARS) + max(RATING_STARS)) / 2, (max(RATING_STARS) - min(RATING_STARS)) / 2
+    rated = Rating.objects.filter(user_id=user_id).order_by('-id').values_list('movie_id', 'stars')[:SEED_LIMIT]
+    seeds.update({movie_id: (stars - middle) / spread for movie_id, stars in rated})
+    return seeds
+
+
+def recommend_for_user(user_id, limit):
+    # "Because you watched": neighbors of the seeds, weighted by the seed,
+    # minus anything the user already rated, watched or saved. Reads one
+    # neighbor row per seed, so the cost is bounded by SEED_LIMIT x K.
+    seeds = user_seeds(user_id)
+    scores, because, strongest = {}, {}, {}
+    neighbor_rows = MovieNeighbors.objects.filter(movie_id__in=seeds).values_list('movie_id', 'neighbor_ids', 'scores')
+    for seed_id, neighbor_ids, neighbor_scores in neighbor_rows:
+        for movie_id, score in zip(neighbor_ids, neighbor_scores):
+            contribution = seeds[seed_id] * score
+            scores[movie_id] = scores.get(movie_id, 0) + contribution
+            if contribution > strongest.get(movie_id, 0):
+                strongest[movie_id], because[movie_id] = contribution, seed_id
+    candidates = [movie_id for movie_id, score in scores.items() if score > 0 and movie_id not in seeds]
+    seen = set(Rating.objects.filter(user_id=user_id, movie_id__in=candidates).values_list('movie_id', flat=True))
+    seen.update(History.objects.filter(user_id=user_id, movie_id__in=candidates).values_list('movie_id', flat=True))
+    seen.update(FavoriteItem.objects.filter(favorite__user_id=user_id, movie_id__in=candidates)
+                .values_list('movie_id', flat=True))
+    ranked = sorted((movie_id for movie_id in candidates if movie_id not in seen), key=scores.get, reverse=True)[:limit]
+    movies = Movie.objects.for_list().in_bulk(ranked)
+    result = []
+    for movie_id in ranked:
+        if movie_id in movies:
+            movie = movies[movie_id]
+            movie.recommendation_score, movie.recommended_because = round(scores[movie_id], 5), because.get(movie_id)
+            result.append(movie)
+    return result
@@ -0,0 +1,153 @@
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q, Case, When, Value, IntegerField
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from .models import Movie
+
+SEARCH_TABLE = 'movie_app_movie_search'
+TRANSLATED_MOVIE_FIELDS = ('movie_name_ru', 'movie_name_en', 'description_ru', 'description_en')
+
+# One row per movie; rowid is the movie id so updates and deletes are
+# primary-key lookups. Both languages live side by side, and actor and
+# director names share the `people` column.
+SQLITE_CREATE_SQL = f'''
+CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+    name_ru, name_en, description_ru, description_en, people,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+)
+'''
+
+PEOPLE_SQL = '''
+coalesce((SELECT group_concat(coalesce(a.full_name_ru, '') || ' ' || coalesce(a.full_name_en, ''), ' ')
+          FROM movie_app_movie_actor ma JOIN movie_app_actor a ON a.id = ma.actor_id
+          WHERE ma.movie_id = m.id), '')
+|| ' ' ||
+coalesce((SELECT group_concat(coalesce(d.full_name_ru, '') || ' ' || coalesce(d.full_name_en, ''), ' ')
+          FROM movie_app_movie_director md JOIN movie_app_director d ON d.id = md.director_id
+          WHERE md.movie_id = m.id), '')
+'''
+
+SQLITE_INDEX_SQL = f'''
+INSERT INTO {SEARCH_TABLE} (rowid, name_ru, name_en, description_ru, description_en, people)
+SELECT m.id, coalesce(m.movie_name_ru, ''), coalesce(m.movie_name_en, ''),
+       coalesce(m.description_ru, ''), coalesce(m.description_en, ''), {PEOPLE_SQL}
+FROM movie_app_movie m
+'''
+
+
+def search_terms(query):
+    return re.findall(r'\w+', query.lower())
+
+
+class SearchBackend:
+    def update_movies(self, movie_ids):
+        pass
+
+    def remove_movies(self, movie_ids):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def search(self, query, limit=20, offset=0):
+        # Movie ids ranked by relevance, best first.
+        raise NotImplementedError
+
+    def filter_queryset(self, queryset, query):
+        raise NotImplementedError
+
+
+class SQLiteFTSBackend(SearchBackend):
+    # bm25 weights per column: names outrank people, people outrank descriptions.
+    rank_function = 'bm25(10.0, 10.0, 1.0, 1.0, 3.0)'
+
+    def match_expression(self, query):
+        terms = search_terms(query)
+        return ' '.join(f'"{term}"*' for term in terms)
+
+    def update_movies(self, movie_ids):
+        movie_ids = list(movie_ids)
+        if not movie_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(movie_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})', movie_ids)
+            cursor.execute(f'{SQLITE_INDEX_SQL} WHERE m.id IN ({placeholders})', movie_ids)
+
+    def remove_movies(self, movie_ids):
+        movie_ids = list(movie_ids)
+        if not movie_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(movie_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})', movie_ids)
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(SQLITE_CREATE_SQL)
+            cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rank) VALUES ('rank', %s)", [self.rank_function])
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+            cursor.execute(SQLITE_INDEX_SQL)
+            cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+
+    def search(self, query, limit=20, offset=0):
+        expression = self.match_expression(query)
+        if not expression:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s '
+                'ORDER BY rank LIMIT %s OFFSET %s',
+                [expression, limit, offset],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def filter_queryset(self, queryset, query):
+        expression = self.match_expression(query)
+        if not expression:
+            return queryset
+        return queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s', [expression]))
+
+
+class DatabaseSearchBackend(SearchBackend):
+    # Portable fallback without a dedicated index: every term must match one
+    # of the translated movie, actor or director fields.
+    people_fields = ('actor__full_name_ru', 'actor__full_name_en',
+                     'director__full_name_ru', 'director__full_name_en')
+
+    def term_filter(self, term):
+        condition = Q()
+        for field in TRANSLATED_MOVIE_FIELDS + self.people_fields:
+            condition |= Q(**{f'{field}__icontains': term})
+        return condition
+
+    def filter_queryset(self, queryset, query):
+        for term in search_terms(query):
+            queryset = queryset.filter(pk__in=Movie.objects.filter(self.term_filter(term)).values('pk'))
+        return queryset
+
+    def search(self, query, limit=20, offset=0):
+        terms = search_terms(query)
+        if not terms:
+            return []
+        name_match = Q()
+        for term in terms:
+            name_match |= Q(movie_name_ru__icontains=term) | Q(movie_name_en__icontains=term)
+        movies = self.filter_queryset(Movie.objects.all(), query).annotate(
+            relevance=Case(When(name_match, then=Value(1)), default=Value(0), output_field=IntegerField()),
+        ).order_by('-relevance', '-id')
+        return list(movies.values_list('pk', flat=True)[offset:offset + limit])
+
+
+def get_search_backend():
+    path = getattr(settings, 'MOVIE_SEARCH_BACKEND', None)
+    if path is None:
+        path = ('movie_app.search.SQLiteFTSBackend' if connection.vendor == 'sqlite'
+                else 'movie_app.search.DatabaseSearchBackend')
+    return import_string(path)()
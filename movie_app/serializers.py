@@ -1,14 +1,33 @@
 from rest_framework import serializers
+from rest_framework.utils.urls import replace_query_param
+from django.http import QueryDict
+from django.urls import reverse
+from .pagination import NestedMoviePagination, MovieItemPagination, MovieMediaPagination
+from .images import srcset
 from .models import (
     UserProfile, Category, Genre, Country, Director, Actor,
     Movie, MovieVideo, MovieFrame, Review, History, Rating,
-    Favorite, FavoriteItem, ActorImage, ReviewLike
+    Favorite, FavoriteItem, ActorImage, ReviewLike, UploadSession
 )
+from django.conf import settings
 
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import authenticate
 
 
+class SrcsetField(serializers.Field):
+    # Responsive derivatives of an image field: {'width', 'height', 'src',
+    # 'avif', 'webp', 'jpeg'}, the last three as srcset strings. None until
+    # the derivatives exist; asking for them queues their generation.
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        return srcset(value.name if value else None, request.build_absolute_uri if request else None)
+
+
 class UserRegisterSerializer(serializers.ModelSerializer):
     class Meta:
         model = UserProfile
@@ -44,9 +63,11 @@ class UserLoginSerializer(serializers.Serializer):
 
 
 class UserProfileListSerializer(serializers.ModelSerializer):
+    user_photo_srcset = SrcsetField(source='user_photo')
+
     class Meta:
         model = UserProfile
-        fields = ['id', 'user_photo', 'username', 'status']
+        fields = ['id', 'user_photo', 'user_photo_srcset', 'username', 'status']
 
 
 class UserProfileDetailSerializer(serializers.ModelSerializer):
@@ -65,9 +86,11 @@ class UserProfileNameSerializer(serializers.ModelSerializer):
 
 
 class UserProfileReviewSerializer(serializers.ModelSerializer):
+    user_photo_srcset = SrcsetField(source='user_photo')
+
     class Meta:
         model = UserProfile
-        fields = ['user_photo', 'username']
+        fields = ['user_photo', 'user_photo_srcset', 'username']
 
 
 class CategoryListSerializer(serializers.ModelSerializer):
@@ -96,6 +119,35 @@ class GenreListSerializer(serializers.ModelSerializer):
         fields = ['id', 'genre_name']
 
 
+class FirstPageRequest:
+    # What a paginator reads of the request, for the first page of a nested
+    # list: no cursor or page size from the detail request's query string,
+    # and links to the standalone endpoint that carry the page size used.
+    def __init__(self, url, page_size):
+        self.query_params = QueryDict()
+        self.url = replace_query_param(url, 'page_size', page_size)
+
+    def build_absolute_uri(self):
+        return self.url
+
+
+def nested_page(context, queryset, pagination_class, serializer_class, url_name, pk):
+    # First cursor page of a related list; `next` points at the standalone
+    # `<url_name>` endpoint so clients can keep paging from there.
+    paginator = pagination_class()
+    url = context['request'].build_absolute_uri(reverse(url_name, kwargs={'pk': pk}))
+    page = paginator.paginate_queryset(queryset, FirstPageRequest(url, paginator.page_size))
+    return {
+        'next': paginator.get_next_link(),
+        'previous': paginator.get_previous_link(),
+        'results': serializer_class(page, many=True, context=context).data,
+    }
+
+
+def nested_movie_page(context, queryset, url_name, pk):
+    return nested_page(context, queryset.for_list(), NestedMoviePagination, MovieListSerializer, url_name, pk)
+
+
 class GenreDetailSerializer(serializers.ModelSerializer):
     movies = serializers.SerializerMethodField()
 
@@ -104,8 +156,7 @@ class GenreDetailSerializer(serializers.ModelSerializer):
         fields = ['genre_name', 'movies']
 
     def get_movies(self, obj):
-        movies = Movie.objects.filter(genre=obj)
-        return MovieListSerializer(movies, many=True).data
+        return nested_movie_page(self.context, Movie.objects.filter(genre=obj), 'genre_movies', obj.pk)
 
 
 class CountryListSerializer(serializers.ModelSerializer):
@@ -122,8 +173,7 @@ class CountryDetailSerializer(serializers.ModelSerializer):
         fields = ['id', 'country_name', 'movies']
 
     def get_movies(self, obj):
-        movies = Movie.objects.filter(country=obj)
-        return MovieListSerializer(movies, many=True).data
+        return nested_movie_page(self.context, Movie.objects.filter(country=obj), 'country_movies', obj.pk)
 
 
 class DirectorSerializer(serializers.ModelSerializer):
@@ -139,15 +189,43 @@ class ActorSerializer(serializers.ModelSerializer):
 
 
 class MovieVideoSerializer(serializers.ModelSerializer):
+    stream = serializers.HyperlinkedIdentityField(view_name='movie_video_stream')
+    hls = serializers.SerializerMethodField()
+
     class Meta:
         model = MovieVideo
-        fields = ['video_name', 'video']
+        fields = ['video_name', 'video', 'stream', 'hls']
+
+    def get_hls(self, obj):
+        # Master playlist URL once the renditions are packaged.
+        package = getattr(obj, 'package', None)
+        if package is None or package.status != 'ready':
+            return None
+        return self.context['request'].build_absolute_uri(reverse('movie_video_hls', kwargs={'pk': obj.pk}))
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = ['movie', 'video_name', 'filename', 'size']
+
+    def validate_size(self, size):
+        limit = getattr(settings, 'VIDEO_UPLOAD_MAX_SIZE', 50 << 30)
+        if not 0 < size <= limit:
+            raise serializers.ValidationError(f'Размер должен быть от 1 до {limit} байт')
+        return size
+
+
+class UploadCompleteSerializer(serializers.Serializer):
+    sha256 = serializers.RegexField(r'^[0-9a-fA-F]{64}$', required=False)
 
 
 class MovieFrameSerializer(serializers.ModelSerializer):
+    image_srcset = SrcsetField(source='image')
+
     class Meta:
         model = MovieFrame
-        fields = ['image']
+        fields = ['image', 'image_srcset']
 
 class RatingSerializer(serializers.ModelSerializer):
     created_date = serializers.DateTimeField(format('%d-%m-%Y %H:%M'))
@@ -169,22 +247,70 @@ class ReviewSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Review
-        fields = ['user', 'comment', 'created_date', 'parent']
+        fields = ['id', 'user', 'comment', 'created_date', 'parent']
+
+
+class ReviewThreadSerializer(serializers.ModelSerializer):
+    created_date = serializers.DateTimeField(format('%d-%m-%Y %H:%M'))
+    user = UserProfileReviewSerializer()
+    like_count = serializers.IntegerField(read_only=True)
+    replies = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Review
+        fields = ['id', 'user', 'comment', 'created_date', 'parent', 'depth', 'like_count', 'replies']
+
+    def get_replies(self, obj):
+        return ReviewThreadSerializer(obj.replies, many=True, context=self.context).data
 
 class ReviewCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Review
         fields = '__all__'
 
+    def validate(self, attrs):
+        parent = attrs.get('parent', getattr(self.instance, 'parent', None))
+        movie = attrs.get('movie', getattr(self.instance, 'movie', None))
+        error = (self.instance or Review()).parent_error(parent, getattr(movie, 'pk', None))
+        if error:
+            raise serializers.ValidationError({'parent': error})
+        return attrs
+
+
+def movie_item_queryset(name):
+    return {
+        'videos': MovieVideo.objects.select_related('package'),
+        'frames': MovieFrame.objects.all(),
+        'ratings': Rating.objects.select_related('user'),
+        'reviews': Review.objects.select_related('user'),
+    }[name]
+
 
 class MovieListSerializer(serializers.ModelSerializer):
     year = serializers.DateField(format('%Y'))
     country = CountryListSerializer(many=True)
     genre = GenreNameSerializer(many=True)
+    movie_poster_srcset = SrcsetField(source='movie_poster')
 
     class Meta:
         model = Movie
-        fields = ['id', 'movie_poster', 'movie_name', 'year', 'country', 'genre']
+        fields = ['id', 'movie_poster', 'movie_poster_srcset', 'movie_name', 'year', 'country', 'genre']
+
+
+class RecommendedMovieSerializer(MovieListSerializer):
+    # `because` is the movie from the user's history that contributed most.
+    score = serializers.FloatField(source='recommendation_score', read_only=True)
+    because = serializers.IntegerField(source='recommended_because', read_only=True)
+
+    class Meta(MovieListSerializer.Meta):
+        fields = MovieListSerializer.Meta.fields + ['score', 'because']
+
+
+class LeaderboardMovieSerializer(MovieListSerializer):
+    score = serializers.FloatField(source='leaderboard_score', read_only=True)
+
+    class Meta(MovieListSerializer.Meta):
+        fields = MovieListSerializer.Meta.fields + ['score']
 
 
 class MovieDetailSerializer(serializers.ModelSerializer):
@@ -193,19 +319,25 @@ class MovieDetailSerializer(serializers.ModelSerializer):
     director = DirectorSerializer(many=True)
     genre = GenreNameSerializer(many=True)
     actor = ActorSerializer(many=True)
-    videos = MovieVideoSerializer(many=True, read_only=True)
-    frames = MovieFrameSerializer(many=True, read_only=True)
-    ratings = RatingSerializer(many=True, read_only=True)
-    reviews = ReviewSerializer(many=True, read_only=True)
+    movie_poster_srcset = SrcsetField(source='movie_poster')
     get_avg_rating = serializers.SerializerMethodField()
     get_count_rating= serializers.SerializerMethodField()
 
+    # ?expand=ratings,reviews,frames,videos inlines the first page of each
+    # sub-resource; otherwise clients page them through movie/<pk>/<name>/.
+    expandable = {
+        'videos': (MovieMediaPagination, MovieVideoSerializer, 'movie_videos'),
+        'frames': (MovieMediaPagination, MovieFrameSerializer, 'movie_frames'),
+        'ratings': (MovieItemPagination, RatingSerializer, 'movie_ratings'),
+        'reviews': (MovieItemPagination, ReviewSerializer, 'movie_reviews'),
+    }
+
     class Meta:
         model = Movie
         fields = ['movie_name', 'year', 'country', 'country', 'genre', 'director',
-                  'movie_type', 'movie_time', 'actor', 'movie_poster', 'trailer',
-                  'description', 'status', 'videos', 'frames', 'get_avg_rating',
-                  'get_count_rating', 'ratings', 'reviews', ]
+                  'movie_type', 'movie_time', 'actor', 'movie_poster', 'movie_poster_srcset', 'trailer',
+                  'description', 'status', 'get_avg_rating',
+                  'get_count_rating', 'rating_histogram', ]
 
     def get_avg_rating(self, obj):
         return obj.get_avg_rating()
@@ -213,6 +345,24 @@ class MovieDetailSerializer(serializers.ModelSerializer):
     def get_count_rating(self, obj):
         return obj.get_count_rating()
 
+    def expansions(self):
+        request = self.context.get('request')
+        if request is None:
+            return []
+        expand = set(request.query_params.get('expand', '').split(','))
+        return [name for name in self.expandable if name in expand]
+
+    def expansion(self, pk, name):
+        pagination_class, serializer_class, url_name = self.expandable[name]
+        queryset = movie_item_queryset(name).filter(movie_id=pk)
+        return nested_page(self.context, queryset, pagination_class, serializer_class, url_name, pk)
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        for name in self.expansions():
+            data[name] = self.expansion(instance.pk, name)
+        return data
+
 class DirectorListSerializer(serializers.ModelSerializer):
     class Meta:
         model = Director
@@ -221,10 +371,15 @@ class DirectorListSerializer(serializers.ModelSerializer):
 
 class DirectorDetailSerializer(serializers.ModelSerializer):
     birth_date = serializers.DateField(format('%d-%m-%Y'))
-    director_movies = MovieListSerializer(many=True, read_only=True)
+    director_movies = serializers.SerializerMethodField()
+    director_photo_srcset = SrcsetField(source='director_photo')
+
     class Meta:
         model = Director
-        fields = ['full_name', 'director_photo', 'birth_date', 'bio', 'director_movies']
+        fields = ['full_name', 'director_photo', 'director_photo_srcset', 'birth_date', 'bio', 'director_movies']
+
+    def get_director_movies(self, obj):
+        return nested_movie_page(self.context, obj.director_movies.all(), 'director_movies', obj.pk)
 
 
 class ActorListSerializer(serializers.ModelSerializer):
@@ -235,34 +390,92 @@ class ActorListSerializer(serializers.ModelSerializer):
 
 class ActorDetailSerializer(serializers.ModelSerializer):
     birth_date = serializers.DateField(format('%d-%m-%Y'))
-    actor_movies = MovieListSerializer(many=True, read_only=True)
+    actor_movies = serializers.SerializerMethodField()
+    actor_photo_srcset = SrcsetField(source='actor_photo')
 
     class Meta:
         model = Actor
-        fields = ['full_name', 'actor_photo', 'birth_date', 'bio', 'actor_movies']
+        fields = ['full_name', 'actor_photo', 'actor_photo_srcset', 'birth_date', 'bio', 'actor_movies']
+
+    def get_actor_movies(self, obj):
+        return nested_movie_page(self.context, obj.actor_movies.all(), 'actor_movies', obj.pk)
 
 
 
+class MovieSummarySerializer(serializers.ModelSerializer):
+    year = serializers.DateField(format('%Y'))
+    movie_poster_srcset = SrcsetField(source='movie_poster')
+
+    class Meta:
+        model = Movie
+        fields = ['id', 'movie_poster', 'movie_poster_srcset', 'movie_name', 'year', 'status']
+
+
 class HistorySerializer(serializers.ModelSerializer):
+    user = serializers.HiddenField(default=serializers.CurrentUserDefault())
+    movie = MovieSummarySerializer(read_only=True)
+    movie_id = serializers.PrimaryKeyRelatedField(source='movie', queryset=Movie.objects.all(), write_only=True)
+
     class Meta:
         model = History
-        fields = '__all__'
+        fields = ['id', 'user', 'movie', 'movie_id', 'created_date']
+
+
+
+class HistoryEventSerializer(serializers.Serializer):
+    movie_id = serializers.IntegerField(min_value=1)
+
 
+class HistoryEventBatchSerializer(serializers.Serializer):
+    events = serializers.ListField(child=HistoryEventSerializer(), allow_empty=False, max_length=1000)
+
+    def validate_events(self, events):
+        movie_ids = {event['movie_id'] for event in events}
+        unknown = movie_ids - set(Movie.objects.filter(pk__in=movie_ids).values_list('pk', flat=True))
+        if unknown:
+            raise serializers.ValidationError(f'Неизвестные фильмы: {sorted(unknown)}')
+        return events
 
 
 class FavoriteSerializer(serializers.ModelSerializer):
+    user = serializers.HiddenField(default=serializers.CurrentUserDefault())
+
     class Meta:
         model = Favorite
-        fields = '__all__'
+        fields = ['id', 'user']
+
+    def validate(self, attrs):
+        # The declared HiddenField drops the OneToOne's UniqueValidator.
+        duplicates = Favorite.objects.filter(user=attrs['user'])
+        if self.instance is not None:
+            duplicates = duplicates.exclude(pk=self.instance.pk)
+        if duplicates.exists():
+            raise serializers.ValidationError({'user': 'Список избранного уже создан'})
+        return attrs
 
 
 class FavoriteItemSerializer(serializers.ModelSerializer):
+    movie = MovieSummarySerializer(read_only=True)
+    movie_id = serializers.PrimaryKeyRelatedField(source='movie', queryset=Movie.objects.all(), write_only=True)
+
     class Meta:
         model = FavoriteItem
-        fields = '__all__'
+        fields = ['id', 'movie', 'movie_id']
+
+    def validate(self, attrs):
+        movie = attrs.get('movie')
+        if movie is not None:
+            duplicates = FavoriteItem.objects.filter(favorite__user=self.context['request'].user, movie=movie)
+            if self.instance is not None:
+                duplicates = duplicates.exclude(pk=self.instance.pk)
+            if duplicates.exists():
+                raise serializers.ValidationError({'movie_id': 'Фильм уже в избранном'})
+        return attrs
 
 
 class ActorImageSerializer(serializers.ModelSerializer):
+    image_srcset = SrcsetField(source='image')
+
     class Meta:
         model = ActorImage
         fields = '__all__'
@@ -0,0 +1,244 @@
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import pre_delete, pre_save, post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .autocomplete import autocomplete_index, kind_for_model
+from .blobs import MEDIA_FIELDS, adjust_refcounts, file_names
+from .cache import RATING_CACHE_TAG, invalidate
+from .facets import facet_index
+from .images import IMAGE_FIELDS, image_pipeline
+from .jobs import dispatch, jobs_in_background
+from .packaging import enqueue as enqueue_packaging
+from .search import get_search_backend
+from .tasks import generate_image_derivatives, refresh_linked_movies, update_search_index
+from .models import (
+    RATING_AGGREGATE_FIELDS, Category, Genre, Country, Director, Actor,
+    Movie, MovieVideo, MovieFrame, Rating, Review, VideoPackage
+)
+
+CATALOG_CACHE_TAGS = {
+    Category: 'category',
+    Genre: 'genre',
+    Country: 'country',
+    Director: 'director',
+    Actor: 'actor',
+    Movie: 'movie',
+}
+
+
+@receiver(post_save, sender=Rating)
+def rating_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        Movie.apply_rating_changes(instance.movie_id, [(instance.stars, 1)])
+        instance._loaded_rating = (instance.movie_id, instance.stars)
+        return
+    loaded = getattr(instance, '_loaded_rating', None)
+    if loaded is None or None in loaded:
+        Movie.rebuild_rating_aggregates([instance.movie_id])
+    elif loaded[0] != instance.movie_id:
+        Movie.apply_rating_changes(loaded[0], [(loaded[1], -1)])
+        Movie.apply_rating_changes(instance.movie_id, [(instance.stars, 1)])
+    elif loaded[1] != instance.stars:
+        Movie.apply_rating_changes(instance.movie_id, [(loaded[1], -1), (instance.stars, 1)])
+    instance._loaded_rating = (instance.movie_id, instance.stars)
+
+
+def deleted_with_movie(origin):
+    return isinstance(origin, Movie) or (isinstance(origin, QuerySet) and origin.model is Movie)
+
+
+@receiver(post_delete, sender=Rating)
+def rating_deleted(sender, instance, origin=None, **kwargs):
+    # RatingQuerySet.delete() rebuilds the touched movies itself, and a movie
+    # being deleted takes its aggregates with it.
+    if deleted_with_movie(origin) or (isinstance(origin, QuerySet) and origin.model is Rating):
+        return
+    Movie.apply_rating_changes(instance.movie_id, [(instance.stars, -1)])
+
+
+# Movie payloads embed genre, country, director and actor names as well as
+# reviews, frames and videos, so changes there touch the movies' updated_at,
+# which the leaderboard refresh uses to find the movies to rescore.
+MOVIE_LINK_LOOKUPS = {
+    Genre: 'genre',
+    Country: 'country',
+    Director: 'director',
+    Actor: 'actor',
+}
+
+
+def touch_movies(**lookup):
+    Movie.objects.filter(**lookup).update(updated_at=timezone.now())
+
+
+SEARCHABLE_MOVIE_FIELDS = {'movie_name', 'movie_name_ru', 'movie_name_en',
+                           'description', 'description_ru', 'description_en'}
+
+
+RATING_UPDATE_FIELDS = set(RATING_AGGREGATE_FIELDS) | {'updated_at'}
+
+
+def catalog_changed(sender, instance, signal, created=False, update_fields=None, **kwargs):
+    if sender is Movie and signal is post_save and update_fields and set(update_fields) <= RATING_UPDATE_FIELDS:
+        invalidate(f'movie:{instance.pk}', RATING_CACHE_TAG)
+        return
+    tags = [CATALOG_CACHE_TAGS[sender]]
+    if sender is Movie:
+        tags.append(f'movie:{instance.pk}')
+        if signal is post_save:
+            if update_fields is None or SEARCHABLE_MOVIE_FIELDS & set(update_fields):
+                dispatch(update_search_index, key=f'search:movie:{instance.pk}', movie_ids=[instance.pk])
+        else:
+            get_search_backend().remove_movies([instance.pk])
+    elif sender in MOVIE_LINK_LOOKUPS and signal is post_save and not created:
+        link = MOVIE_LINK_LOOKUPS[sender]
+        dispatch(refresh_linked_movies, key=f'linked:{link}:{instance.pk}',
+                 link=link, pk=instance.pk, reindex=sender in (Actor, Director))
+    invalidate(*tags)
+
+
+@receiver(pre_delete, sender=Movie)
+def movie_deleting(sender, instance, **kwargs):
+    # The link rows vanish without m2m_changed, so bump the other side here.
+    now = timezone.now()
+    Genre.objects.filter(movie=instance).update(updated_at=now)
+    Country.objects.filter(movie=instance).update(updated_at=now)
+    Director.objects.filter(director_movies=instance).update(updated_at=now)
+    Actor.objects.filter(actor_movies=instance).update(updated_at=now)
+
+
+def movie_part_changed(sender, instance, origin=None, **kwargs):
+    if deleted_with_movie(origin):
+        return
+    if sender is not Rating:
+        touch_movies(pk=instance.movie_id)
+    invalidate(f'movie:{instance.movie_id}')
+
+
+def movie_links_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # pk_set is empty for clear(), so remember which movies lose the link.
+        instance._cleared_movie_ids = set(
+            sender.objects.filter(**{instance._meta.model_name: instance.pk}).values_list('movie_id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        movie_ids = {instance.pk}
+    elif action == 'post_clear':
+        movie_ids = getattr(instance, '_cleared_movie_ids', set())
+    else:
+        movie_ids = pk_set or set()
+    now = timezone.now()
+    Movie.objects.filter(pk__in=movie_ids).update(updated_at=now)
+    if reverse:
+        type(instance).objects.filter(pk=instance.pk).update(updated_at=now)
+    elif pk_set:
+        kwargs['model'].objects.filter(pk__in=pk_set).update(updated_at=now)
+    if sender in (Movie.actor.through, Movie.director.through):
+        dispatch(update_search_index, movie_ids=sorted(movie_ids))
+    if sender in (Movie.genre.through, Movie.country.through) and facet_index.is_built:
+        transaction.on_commit(lambda: facet_index.reload(movie_ids))
+    invalidate('movie', *[f'movie:{movie_id}' for movie_id in movie_ids])
+
+
+for model in CATALOG_CACHE_TAGS:
+    post_save.connect(catalog_changed, sender=model, dispatch_uid=f'catalog_cache_save_{model.__name__}')
+    post_delete.connect(catalog_changed, sender=model, dispatch_uid=f'catalog_cache_delete_{model.__name__}')
+
+for model in (MovieVideo, MovieFrame, Rating, Review):
+    post_save.connect(movie_part_changed, sender=model, dispatch_uid=f'catalog_cache_save_{model.__name__}')
+    post_delete.connect(movie_part_changed, sender=model, dispatch_uid=f'catalog_cache_delete_{model.__name__}')
+
+for field in (Movie.country, Movie.genre, Movie.director, Movie.actor):
+    m2m_changed.connect(movie_links_changed, sender=field.through,
+                        dispatch_uid=f'catalog_cache_links_{field.through.__name__}')
+
+
+def autocomplete_changed(sender, instance, signal, update_fields=None, **kwargs):
+    if not autocomplete_index.is_built:
+        return
+    kind, fields = kind_for_model(sender)
+    # After the commit, so a rolled back save never reaches the index.
+    pk = instance.pk
+    if signal is post_delete:
+        transaction.on_commit(lambda: autocomplete_index.remove(kind, pk))
+    elif update_fields is None or (set(fields) | {field.rsplit('_', 1)[0] for field in fields}) & set(update_fields):
+        names = [getattr(instance, field) for field in fields]
+        transaction.on_commit(lambda: autocomplete_index.update(kind, pk, names))
+
+
+for model in (Movie, Actor, Director, Genre):
+    post_save.connect(autocomplete_changed, sender=model, dispatch_uid=f'autocomplete_save_{model.__name__}')
+    post_delete.connect(autocomplete_changed, sender=model, dispatch_uid=f'autocomplete_delete_{model.__name__}')
+
+
+FACET_FIELDS = {'year', 'movie_type', 'status'}
+
+
+def facets_changed(sender, instance, signal, update_fields=None, **kwargs):
+    if not facet_index.is_built:
+        return
+    # Read now: deleting clears instance.pk before the commit.
+    pk = instance.pk
+    if signal is post_delete or update_fields is None or FACET_FIELDS & set(update_fields):
+        transaction.on_commit(lambda: facet_index.reload([pk]))
+
+
+post_save.connect(facets_changed, sender=Movie, dispatch_uid='facets_save_Movie')
+post_delete.connect(facets_changed, sender=Movie, dispatch_uid='facets_delete_Movie')
+
+
+def image_saved(sender, instance, update_fields=None, **kwargs):
+    fields = IMAGE_FIELDS[sender]
+    if update_fields is not None and not set(fields) & set(update_fields):
+        return
+    names = [getattr(instance, field).name for field in fields if getattr(instance, field)]
+    if jobs_in_background():
+        dispatch(generate_image_derivatives, names=names)
+    else:
+        transaction.on_commit(lambda: [image_pipeline.submit(name) for name in names])
+
+
+for model in IMAGE_FIELDS:
+    post_save.connect(image_saved, sender=model, dispatch_uid=f'image_derivatives_{model.__name__}')
+
+
+def media_saving(sender, instance, update_fields=None, **kwargs):
+    fields = MEDIA_FIELDS[sender]
+    if update_fields is not None and not set(fields) & set(update_fields):
+        instance._media_previous = None
+    elif instance._state.adding:
+        instance._media_previous = []
+    else:
+        instance._media_previous = [name for row in sender.objects.filter(pk=instance.pk).values_list(*fields)
+                                    for name in row if name]
+
+
+def media_saved(sender, instance, **kwargs):
+    previous = instance.__dict__.pop('_media_previous', None)
+    if previous is not None:
+        adjust_refcounts(added=file_names(instance, MEDIA_FIELDS[sender]), removed=previous)
+
+
+def media_deleted(sender, instance, **kwargs):
+    adjust_refcounts(removed=file_names(instance, MEDIA_FIELDS[sender]))
+
+
+for model in MEDIA_FIELDS:
+    pre_save.connect(media_saving, sender=model, dispatch_uid=f'media_refcount_pre_save_{model.__name__}')
+    post_save.connect(media_saved, sender=model, dispatch_uid=f'media_refcount_save_{model.__name__}')
+    post_delete.connect(media_deleted, sender=model, dispatch_uid=f'media_refcount_delete_{model.__name__}')
+
+
+@receiver(post_save, sender=MovieVideo)
+def video_saved(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    # New or replaced files are queued for HLS packaging (package_videos).
+    if raw or not instance.video or (update_fields is not None and 'video' not in update_fields):
+        return
+    if created or not VideoPackage.objects.filter(video=instance, source=instance.video.name).exists():
+        transaction.on_commit(lambda: enqueue_packaging([instance.pk]))
@@ -0,0 +1,167 @@
+import mimetypes
+import mmap
+import os
+import uuid
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date
+
+from .storage import blob_hash
+
+MAX_RANGES = 16
+MULTIPART_CHUNK_SIZE = 1 << 20
+
+
+def parse_range(header, size):
+    # Returns the merged (first, last) byte ranges of a `Range: bytes=...`
+    # header, [] when none of them is satisfiable, or None when the header
+    # should be ignored (malformed, not bytes, or too many ranges).
+    if not header or not header.startswith('bytes='):
+        return None
+    ranges = []
+    for spec in header[len('bytes='):].split(','):
+        first, dash, last = spec.strip().partition('-')
+        if not dash:
+            return None
+        try:
+            if first == '':
+                suffix = int(last)
+                if suffix <= 0 or size == 0:
+                    # Unsatisfiable, including any suffix of an empty file.
+                    continue
+                first, last = max(size - suffix, 0), size - 1
+            else:
+                first, last = int(first), int(last) if last else max(int(first), size - 1)
+        except ValueError:
+            return None
+        if last < first:
+            return None
+        if first < size:
+            ranges.append((first, min(last, size - 1)))
+    if len(ranges) > MAX_RANGES:
+        return None
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+
+class FileRange:
+    # Bounded reader over bytes [start, start + length) of an open file.
+    # Positioning is a plain seek, so nothing before `start` is read, and
+    # fileno() lets wsgi.file_wrapper (gunicorn) sendfile() the range using
+    # the response's Content-Length as the byte count.
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.name = file.name
+        self.remaining = length
+        self.close = file.close
+        file.seek(start)
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size) if size else b''
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+
+class VideoFileResponse(FileResponse):
+    block_size = 1 << 16
+
+
+def multipart_body(file, ranges, size, content_type, boundary):
+    parts = []
+    for i, (first, last) in enumerate(ranges):
+        head = (b'\r\n' if i else b'') + (f'--{boundary}\r\nContent-Type: {content_type}\r\n'
+                                           f'Content-Range: bytes {first}-{last}/{size}\r\n\r\n').encode()
+        parts.append((head, first, last))
+    tail = f'\r\n--{boundary}--\r\n'.encode()
+    length = sum(len(head) + last - first + 1 for head, first, last in parts) + len(tail)
+
+    def chunks():
+        # Parts are sliced out of a read-only memory map of the file, so the
+        # kernel pages in only the requested ranges.
+        try:
+            view = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, OSError, ValueError):
+            view = None
+        try:
+            for head, first, last in parts:
+                yield head
+                for start in range(first, last + 1, MULTIPART_CHUNK_SIZE):
+                    end = min(start + MULTIPART_CHUNK_SIZE, last + 1)
+                    if view is not None:
+                        yield view[start:end]
+                    else:
+                        file.seek(start)
+                        yield file.read(end - start)
+            yield tail
+        finally:
+            if view is not None:
+                view.close()
+
+    return chunks(), length
+
+
+def file_validators(name, size, modified):
+    digest = blob_hash(name)
+    return f'"{digest}"' if digest else f'"{size:x}-{int(modified):x}"', http_date(modified)
+
+
+def offload_response(name, content_type):
+    # Lets the front web server do the byte serving once Django has checked
+    # access: nginx (internal location) or Apache/lighttpd mod_xsendfile.
+    response = HttpResponse(content_type=content_type)
+    if settings.VIDEO_STREAM_OFFLOAD == 'x-accel-redirect':
+        prefix = getattr(settings, 'VIDEO_STREAM_ACCEL_PREFIX', '/protected-media/')
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + name
+    else:
+        response['X-Sendfile'] = default_storage.path(name)
+    return response
+
+
+def range_response(request, name):
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    if getattr(settings, 'VIDEO_STREAM_OFFLOAD', None):
+        return offload_response(name, content_type)
+    file = default_storage.open(name, 'rb')
+    size = default_storage.size(name)
+    etag, last_modified = file_validators(name, size, default_storage.get_modified_time(name).timestamp())
+    ranges = parse_range(request.headers.get('Range'), size)
+    if_range = request.headers.get('If-Range')
+    if if_range and if_range not in (etag, last_modified):
+        ranges = None
+    if ranges == []:
+        file.close()
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+    elif ranges is None:
+        response = VideoFileResponse(FileRange(file, 0, size), content_type=content_type)
+        response['Content-Length'] = size
+    elif len(ranges) == 1:
+        first, last = ranges[0]
+        response = VideoFileResponse(FileRange(file, first, last - first + 1), status=206,
+                                     content_type=content_type)
+        response['Content-Length'] = last - first + 1
+        response['Content-Range'] = f'bytes {first}-{last}/{size}'
+    else:
+        boundary = uuid.uuid4().hex
+        body, length = multipart_body(file, ranges, size, content_type, boundary)
+        response = StreamingHttpResponse(body, status=206, content_type=f'multipart/byteranges; boundary={boundary}')
+        response._resource_closers.append(file.close)
+        response['Content-Length'] = length
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = last_modified
+    response['Cache-Control'] = 'private, max-age=3600'
+    return response
@@ -0,0 +1,55 @@
+from django.utils import timezone
+
+from .images import generate
+from .jobs import periodic, task
+from .leaderboards import refresh
+from .models import Movie
+from .recommendations import train
+from .search import get_search_backend
+from .uploads import expire_sessions
+
+
+@task()
+def update_search_index(movie_ids):
+    get_search_backend().update_movies(movie_ids)
+
+
+@task()
+def refresh_linked_movies(link, pk, reindex=False):
+    # Fan-out of a genre/country/director/actor edit to every movie that
+    # embeds it: bump their validators and, for people, their search rows.
+    movies = Movie.objects.filter(**{link: pk})
+    movies.update(updated_at=timezone.now())
+    if reindex:
+        get_search_backend().update_movies(list(movies.values_list('pk', flat=True)))
+
+
+@task(max_attempts=3, backoff=60)
+def generate_image_derivatives(names):
+    for name in names:
+        generate(name)
+
+
+@periodic(every=24 * 3600)
+def rebuild_rating_aggregates(movie_ids=None):
+    # Repairs any drift of the incrementally maintained aggregates.
+    Movie.rebuild_rating_aggregates(movie_ids)
+
+
+@periodic(every=3600)
+def expire_upload_sessions():
+    expire_sessions()
+
+
+@periodic(every=3600)
+def train_recommendations(full=False):
+    # Incremental: only movies whose ratings, history, favorites or links
+    # changed are rescored.
+    train(full=full)
+
+
+@periodic(every=60)
+def refresh_leaderboards(full=False):
+    # Micro-batch of new views and edited movies into the trending and
+    # top-rated boards.
+    refresh(full=full)
@@ -1,3 +1,1400 @@
-from django.test import TestCase
+import datetime
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.db import OperationalError
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from .autocomplete import PrefixIndex
+from .blobs import collect, recount
+from .cache import invalidate, response_cache
+from .catalog_io import export_records, import_records, read_jsonl, write_jsonl
+from .db_routing import ReplicaRouter, ReplicaStickinessMiddleware, is_pinned, pin_cache, pin_to_primary, \
+    reading_from_replica
+from .facets import FacetIndex
+from .images import DerivativePipeline, alias_path, derivative_path, generate, srcset
+from .ingest import HistoryBuffer
+from .jobs import claim, execute, run_pending, task
+from .models import (
+    REVIEW_MAX_DEPTH, Actor, Category, Country, Director, Favorite, FavoriteItem, Genre, History, Job,
+    LeaderboardEntry, MediaBlob,
+    Movie, MovieNeighbors, MovieVideo, Rating, Review, UploadSession, UserProfile, VideoPackage, build_review_tree,
+)
+from .leaderboards import TOP_RATED, TRENDING, refresh
+from .packaging import StubPackager, master_playlist, output_path, run_package, tiers_for
+from .pagination import KeysetPagination
+from .recommendations import recommend_for_user, similar_movies, train
+from .search import DatabaseSearchBackend, SQLiteFTSBackend
+from .streaming import MAX_RANGES, parse_range, range_response
+from .uploads import expire_sessions, part_path, progress, upload_expiry
+
+
+def make_movie(name='Movie', year=2000, **fields):
+    return Movie.objects.create(**{
+        'movie_name': name, 'year': datetime.date(year, 1, 1), 'movie_type': '720p', 'movie_time': 100,
+        'movie_poster': 'movie_poster/p.png', 'trailer': 'https://example.com/trailer', 'description': '',
+        **fields,
+    })
+
+
+def make_genre(name='Genre'):
+    category, _ = Category.objects.get_or_create(category_name='Category')
+    return Genre.objects.create(genre_name=name, category=category)
+
+
+def make_user(username='user'):
+    return UserProfile.objects.create_user(username=username, password='secret')
+
+
+class RatingAggregateTests(TestCase):
+    # The aggregates stored on Movie must match what the Rating rows say
+    # after every kind of write, per-row or bulk.
+
+    def setUp(self):
+        self.movie, self.other = make_movie('First'), make_movie('Second')
+        self.users = [make_user(f'user{i}') for i in range(3)]
+
+    def rate(self, user, stars, movie=None):
+        return Rating.objects.create(user=user, movie=movie or self.movie, stars=stars)
+
+    def assertAggregates(self, movie, count, total, histogram=None):
+        movie.refresh_from_db()
+        self.assertEqual((movie.rating_count, movie.rating_sum), (count, total))
+        self.assertEqual(movie.rating_avg, round(total / count, 2) if count else 0)
+        for stars, expected in (histogram or {}).items():
+            self.assertEqual(movie.rating_histogram[str(stars)], expected)
+
+    def test_create_save_and_delete(self):
+        first = self.rate(self.users[0], 8)
+        self.rate(self.users[1], 4)
+        self.assertAggregates(self.movie, 2, 12, {8: 1, 4: 1})
+        first.stars = 6
+        first.save()
+        self.assertAggregates(self.movie, 2, 10, {8: 0, 6: 1})
+        first.movie = self.other
+        first.save()
+        self.assertAggregates(self.movie, 1, 4)
+        self.assertAggregates(self.other, 1, 6)
+        first.delete()
+        self.assertAggregates(self.other, 0, 0, {6: 0})
+
+    def test_instance_loaded_without_stars(self):
+        rating = self.rate(self.users[0], 8)
+        rating = Rating.objects.only('id', 'movie').get(pk=rating.pk)
+        rating.stars = 2
+        rating.save()
+        self.assertAggregates(self.movie, 1, 2, {8: 0, 2: 1})
+
+    def test_bulk_create(self):
+        Rating.objects.bulk_create([Rating(user=user, movie=self.movie, stars=10) for user in self.users])
+        self.assertAggregates(self.movie, 3, 30, {10: 3})
+
+    def test_bulk_update_stars_and_movie(self):
+        ratings = [self.rate(user, 5) for user in self.users]
+        ratings[0].stars = 9
+        ratings[1].movie = self.other
+        Rating.objects.bulk_update(ratings[:2], ['stars', 'movie'])
+        self.assertAggregates(self.movie, 2, 14, {5: 1, 9: 1})
+        self.assertAggregates(self.other, 1, 5)
+
+    def test_queryset_update(self):
+        for user in self.users:
+            self.rate(user, 3)
+        Rating.objects.filter(user=self.users[0]).update(stars=7)
+        self.assertAggregates(self.movie, 3, 13, {3: 2, 7: 1})
+        Rating.objects.filter(user__in=self.users[:2]).update(movie=self.other)
+        self.assertAggregates(self.movie, 1, 3)
+        self.assertAggregates(self.other, 2, 10)
+
+    def test_queryset_delete(self):
+        for user in self.users:
+            self.rate(user, 6)
+        self.rate(self.users[0], 2, movie=self.other)
+        Rating.objects.filter(stars=6, user__in=self.users[1:]).delete()
+        self.assertAggregates(self.movie, 1, 6)
+        self.assertAggregates(self.other, 1, 2)
+
+    def test_rebuild_repairs_drift(self):
+        self.rate(self.users[0], 4)
+        Movie.objects.filter(pk=self.movie.pk).update(rating_count=9, rating_sum=90, rating_avg=10)
+        Movie.rebuild_rating_aggregates([self.movie.pk])
+        self.assertAggregates(self.movie, 1, 4, {4: 1})
+
+
+class YearPagination(KeysetPagination):
+    page_size = 3
+    ordering = '-year'
+
+
+class KeysetPaginationTests(TestCase):
+    # Pages must cover every row exactly once in (sort key, id) order, even
+    # across runs of equal sort values, going forwards and backwards.
+
+    @classmethod
+    def setUpTestData(cls):
+        years = [2001, 2003, 2003, 2003, 2002, 2003, 2001, 2002]
+        for index, year in enumerate(years):
+            movie = make_movie(f'Movie {index}')
+            Movie.objects.filter(pk=movie.pk).update(year=datetime.date(year, 1, 1))
+        cls.expected = list(Movie.objects.order_by('-year', '-id').values_list('pk', flat=True))
+
+    def page(self, url):
+        paginator = YearPagination()
+        items = paginator.paginate_queryset(Movie.objects.all(), Request(APIRequestFactory().get(url)))
+        return [movie.pk for movie in items], paginator.get_next_link(), paginator.get_previous_link()
+
+    def test_forward_then_back(self):
+        pages, link = [], '/movie/'
+        while link:
+            ids, link, previous = self.page(link)
+            pages.append((ids, previous))
+        self.assertEqual([pk for ids, _ in pages for pk in ids], self.expected)
+        self.assertEqual([len(ids) for ids, _ in pages], [3, 3, 2])
+        self.assertIsNone(pages[0][1])
+
+        backwards, link = [], pages[-1][1]
+        while link:
+            ids, _, link = self.page(link)
+            backwards.insert(0, ids)
+        self.assertEqual(backwards, [ids for ids, _ in pages[:-1]])
+
+    def test_page_size_and_bad_cursor(self):
+        ids, link, _ = self.page('/movie/?page_size=5')
+        self.assertEqual(ids, self.expected[:5])
+        self.assertIn('page_size=5', link)
+        with self.assertRaises(NotFound):
+            self.page('/movie/?cursor=not-a-cursor')
+
+
+class ReviewTreeTests(TestCase):
+    # Moving a review carries its replies along, and moves that would leave
+    # the movie, close a cycle or nest too deep are refused.
+
+    def setUp(self):
+        self.movie = make_movie()
+        self.user = make_user()
+
+    def review(self, parent=None, movie=None):
+        return Review.objects.create(user=self.user, movie=movie or self.movie, parent=parent, comment='...')
+
+    def position(self, review):
+        review.refresh_from_db()
+        return review.root_id, review.depth, review.path
+
+    def test_replies_extend_the_path(self):
+        root = self.review()
+        reply = self.review(root)
+        nested = self.review(reply)
+        self.assertEqual(self.position(root), (root.pk, 0, f'{root.pk:010d}/'))
+        self.assertEqual(self.position(nested), (root.pk, 2, f'{root.pk:010d}/{reply.pk:010d}/{nested.pk:010d}/'))
+
+    def test_move_subtree(self):
+        first, second = self.review(), self.review()
+        branch = self.review(first)
+        leaf = self.review(branch)
+        branch.parent = second
+        branch.save()
+        self.assertEqual(self.position(leaf), (second.pk, 2, f'{second.path}{branch.pk:010d}/{leaf.pk:010d}/'))
+        branch.parent = None
+        branch.save()
+        self.assertEqual(self.position(branch), (branch.pk, 0, f'{branch.pk:010d}/'))
+        self.assertEqual(self.position(leaf), (branch.pk, 1, f'{branch.pk:010d}/{leaf.pk:010d}/'))
+        roots = build_review_tree(Review.objects.filter(movie=self.movie).thread_rows())
+        self.assertEqual([(review.pk, [reply.pk for reply in review.replies]) for review in roots],
+                         [(branch.pk, [leaf.pk]), (second.pk, []), (first.pk, [])])
+
+    def test_refused_moves(self):
+        root = self.review()
+        reply = self.review(root)
+        elsewhere = self.review(movie=make_movie('Other'))
+        for parent in (reply, root, elsewhere):
+            root.parent = parent
+            with self.assertRaises(ValueError):
+                root.save()
+        self.assertEqual(self.position(root), (root.pk, 0, f'{root.pk:010d}/'))
+
+    def test_depth_limit_counts_the_moved_subtree(self):
+        chain = [self.review()]
+        for _ in range(REVIEW_MAX_DEPTH):
+            chain.append(self.review(chain[-1]))
+        with self.assertRaises(ValueError):
+            self.review(chain[-1])
+        branch = self.review()
+        self.review(branch)
+        branch.parent = chain[-2]
+        with self.assertRaises(ValueError):
+            branch.save()
+        branch.parent = chain[-3]
+        branch.save()
+        self.assertEqual(self.position(branch)[1], REVIEW_MAX_DEPTH - 1)
+
+
+FAILURES = {}
+
+
+@task(name='tests.flaky', max_attempts=3, backoff=1)
+def flaky(label, failures):
+    # Fails the first `failures` times it runs for `label`.
+    FAILURES[label] = FAILURES.get(label, 0) + 1
+    if FAILURES[label] <= failures:
+        raise RuntimeError(f'attempt {FAILURES[label]}')
+
+
+class JobQueueTests(TransactionTestCase):
+    # execute() closes old connections, which a TestCase transaction does
+    # not survive.
+
+    def setUp(self):
+        FAILURES.clear()
+
+    def make_due(self):
+        Job.objects.update(run_after=timezone.now())
+
+    def test_key_coalesces_queued_jobs_only(self):
+        first = flaky.delay(key='k', label='k', failures=0)
+        self.assertEqual(flaky.delay(key='k', label='k', failures=0).pk, first.pk)
+        self.assertEqual(claim(5), [first.pk])
+        second = flaky.delay(key='k', label='k', failures=0)
+        self.assertNotEqual(second.pk, first.pk)
+        self.assertEqual(Job.objects.count(), 2)
+
+    def test_claim_takes_due_jobs_once(self):
+        due = [flaky.delay(label='job', failures=0) for _ in range(3)]
+        later = flaky.delay(countdown=3600, label='job', failures=0)
+        first, second = claim(2), claim(2)
+        self.assertEqual(first + second, [job.pk for job in due])
+        self.assertEqual(claim(2), [])
+        self.assertEqual(Job.objects.get(pk=later.pk).status, 'queued')
+        self.assertEqual(set(Job.objects.filter(status='running').values_list('pk', flat=True)), set(first + second))
+
+    def test_retry_with_backoff_then_done(self):
+        job = flaky.delay(key='retry', label='retry', failures=1)
+        self.assertEqual(run_pending(), [(job.pk, 'retry')])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertIn('attempt 1', job.last_error)
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertEqual(run_pending(), [])
+        self.make_due()
+        self.assertEqual(run_pending(), [(job.pk, 'done')])
+        self.assertEqual(Job.objects.get(pk=job.pk).attempts, 2)
+
+    def test_fails_after_max_attempts(self):
+        job = flaky.delay(key='fail', label='fail', failures=10)
+        outcomes = []
+        for _ in range(3):
+            self.make_due()
+            outcomes += [outcome for _, outcome in run_pending()]
+        self.assertEqual(outcomes, ['retry', 'retry', 'failed'])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 3))
+
+    def test_retry_superseded_by_newer_queued_job(self):
+        job = flaky.delay(key='same', label='same', failures=1)
+        claim(1)
+        newer = flaky.delay(key='same', label='same', failures=0)
+        self.assertEqual(execute(job.pk), (job.pk, 'retry'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        self.assertIn('superseded', job.last_error)
+        self.assertEqual(Job.objects.get(pk=newer.pk).status, 'queued')
+
+    def test_unknown_task_fails(self):
+        job = Job.objects.create(name='tests.missing')
+        self.assertEqual(run_pending(), [(job.pk, 'failed')])
+        self.assertIn('Unknown task', Job.objects.get(pk=job.pk).last_error)
+
+
+class FacetIndexTests(TestCase):
+    # Values of one facet are OR-ed, facets AND-ed, and each facet is counted
+    # with every filter but its own; signals keep the lists current.
+
+    def setUp(self):
+        self.index = FacetIndex(max_age=None)
+        for target in ('movie_app.signals.facet_index', 'movie_app.views.facet_index'):
+            patcher = mock.patch(target, self.index)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.drama, self.comedy = make_genre('Drama'), make_genre('Comedy')
+        self.france, self.japan = Country.objects.create(country_name='France'), Country.objects.create(country_name='Japan')
+        self.first = make_movie('First', 1994, status='pro')
+        self.second = make_movie('Second', 2001, movie_type='1080p')
+        self.third = make_movie('Third', 1999)
+        self.first.genre.add(self.drama)
+        self.second.genre.add(self.comedy)
+        self.third.genre.add(self.drama, self.comedy)
+        self.first.country.add(self.france)
+        self.second.country.add(self.france)
+        self.third.country.add(self.japan)
+        self.index.build()
+
+    def counts(self, filters, facet):
+        return dict(self.index.search(filters)[1][facet])
+
+    def test_or_within_and_across_facets(self):
+        movie_ids, counts = self.index.search({'genre': {self.drama.pk, self.comedy.pk}})
+        self.assertEqual(movie_ids.tolist(), [self.first.pk, self.second.pk, self.third.pk])
+        self.assertEqual(dict(counts['genre']), {self.drama.pk: 2, self.comedy.pk: 2})
+        movie_ids, counts = self.index.search({'genre': {self.drama.pk}, 'country': {self.france.pk}})
+        self.assertEqual(movie_ids.tolist(), [self.first.pk])
+        self.assertEqual(dict(counts['genre']), {self.drama.pk: 1, self.comedy.pk: 1})
+        self.assertEqual(dict(counts['country']), {self.france.pk: 1, self.japan.pk: 1})
+        self.assertEqual(dict(counts['year']), {1990: 1})
+        self.assertEqual(self.counts({}, 'year'), {1990: 2, 2000: 1})
+        self.assertEqual(self.index.search({'status': {'pro'}, 'year': {2000}})[0].tolist(), [])
+
+    def test_reload_after_save_relink_and_delete(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.second.year = datetime.date(1991, 1, 1)
+            self.second.save()
+        self.assertEqual(self.counts({}, 'year'), {1990: 3})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.first.genre.remove(self.drama)
+            self.first.genre.add(self.comedy)
+        self.assertEqual(self.counts({}, 'genre'), {self.drama.pk: 1, self.comedy.pk: 3})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.third.delete()
+        self.assertEqual(self.index.movie_ids.tolist(), [self.first.pk, self.second.pk])
+        self.assertEqual(self.counts({}, 'genre'), {self.comedy.pk: 2})
+        self.assertEqual(self.counts({}, 'country'), {self.france.pk: 2})
+
+    def test_endpoint_payload(self):
+        response = self.client.get(f'/en/movie/facets/?genre={self.drama.pk}&page_size=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual([movie['id'] for movie in response.data['results']], [self.first.pk])
+        self.assertIsNotNone(response.data['next'])
+        self.assertIn({'value': self.drama.pk, 'count': 2, 'name': 'Drama'}, response.data['facets']['genre'])
+        self.assertEqual(response.data['facets']['country'],
+                         [{'value': self.france.pk, 'count': 1, 'name': 'France'},
+                          {'value': self.japan.pk, 'count': 1, 'name': 'Japan'}])
+        response = self.client.get('/en/movie/facets/?year=abc')
+        self.assertEqual(response.status_code, 400)
+
+
+class NestedPageTests(TestCase):
+    # A detail payload embeds the first page of its movies whatever the
+    # detail request's query string says, linking on to the movie list.
+
+    def setUp(self):
+        caches['catalog'].clear()
+        self.genre = make_genre()
+        for index in range(12):
+            make_movie(f'Movie {index}').genre.add(self.genre)
+
+    def test_first_page_ignores_detail_query(self):
+        response = self.client.get(f'/en/genre/{self.genre.pk}/?cursor=junk&page_size=2')
+        self.assertEqual(response.status_code, 200)
+        movies = response.data['movies']
+        self.assertEqual(len(movies['results']), 10)
+        self.assertIsNone(movies['previous'])
+        self.assertIn(f'/en/genre/{self.genre.pk}/movies/?', movies['next'])
+        self.assertIn('page_size=10', movies['next'])
+        rest = self.client.get(movies['next'])
+        self.assertEqual(len(rest.data['results']), 2)
+        seen = [movie['id'] for movie in movies['results'] + rest.data['results']]
+        self.assertEqual(sorted(seen), sorted(self.genre.movie_set.values_list('pk', flat=True)))
+
+
+class ReplicaRoutingTests(TestCase):
+    # With a replica configured, catalog reads go to it unless the user wrote
+    # recently or the response is being refilled right after an invalidation.
+
+    def setUp(self):
+        self.user = make_user()
+        make_genre()
+        caches['catalog'].clear()
+        pin_cache().clear()
+        for target in ('movie_app.db_routing.replica_aliases', 'movie_app.cache.replica_aliases'):
+            patcher = mock.patch(target, return_value=['replica_0'])
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def reads(self, client, url):
+        # Whether each query of the request was routed to a replica; they
+        # all still run on the test database.
+        routed = []
+        route = ReplicaRouter.db_for_read
+
+        def db_for_read(router, model, **hints):
+            routed.append(route(router, model, **hints) != 'default')
+            return 'default'
+
+        with mock.patch.object(ReplicaRouter, 'db_for_read', db_for_read):
+            self.assertEqual(client.get(url).status_code, 200)
+        return set(routed)
+
+    def test_router(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(Movie), 'default')
+        token = reading_from_replica.set(True)
+        try:
+            self.assertEqual(router.db_for_read(Movie), 'replica_0')
+            self.assertEqual(router.db_for_write(Movie), 'default')
+        finally:
+            reading_from_replica.reset(token)
+        self.assertFalse(router.allow_migrate('replica_0', 'movie_app'))
+
+    def test_catalog_reads_use_replica_unless_pinned(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(self.reads(client, '/en/genre/'), {True})
+        pin_to_primary(self.user.pk)
+        caches['catalog'].clear()
+        self.assertEqual(self.reads(client, '/en/genre/'), {False})
+        self.assertEqual(self.reads(APIClient(), '/en/genre/?page=1'), {True})
+
+    def test_writes_pin_the_user(self):
+        request = RequestFactory().post('/en/favorite/')
+        request.user = self.user
+        ReplicaStickinessMiddleware(lambda request: HttpResponse(status=400))(request)
+        self.assertFalse(is_pinned(self.user.pk))
+        ReplicaStickinessMiddleware(lambda request: HttpResponse(status=201))(request)
+        self.assertTrue(is_pinned(self.user.pk))
+
+    def test_refill_after_invalidation_reads_primary(self):
+        invalidate('genre')
+        self.assertEqual(self.reads(APIClient(), '/en/genre/'), {False})
+        caches['catalog'].delete(response_cache.bumped_key('genre'))
+        invalidate('category')
+        self.assertEqual(self.reads(APIClient(), '/en/genre/?page=1'), {True})
+
+
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        caches['catalog'].clear()
+        self.genre = make_genre()
+
+    def test_matching_etag_is_not_modified(self):
+        response = self.client.get('/en/genre/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get('/en/genre/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertFalse(response.has_header('Last-Modified'))
+
+    def test_write_changes_etag(self):
+        etag = self.client.get('/en/genre/')['ETag']
+        self.genre.genre_name = 'Drama'
+        self.genre.save()
+        response = self.client.get('/en/genre/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn('Drama', response.content.decode())
+
+
+class AsyncConditionalGetTests(TransactionTestCase):
+    # The async views run their queries on executor threads, outside a
+    # TestCase transaction.
+
+    def setUp(self):
+        caches['catalog'].clear()
+        self.genre = make_genre()
+
+    def test_etag(self):
+        url = f'/en/async/genre/{self.genre.pk}/'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(response['ETag'], self.client.get(url)['ETag'])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.genre.genre_name = 'Drama'
+        self.genre.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class ResponseCacheInvalidationTests(TestCase):
+
+    def setUp(self):
+        caches['catalog'].clear()
+        self.user = make_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.movie = make_movie()
+        self.detail = f'/en/movie/{self.movie.pk}/'
+
+    def cache_status(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response['X-Cache']
+
+    def assertRefreshed(self, urls, write):
+        for url in urls:
+            self.cache_status(url)
+            self.assertEqual(self.cache_status(url), 'HIT')
+        write()
+        for url in urls:
+            self.assertEqual(self.cache_status(url), 'MISS')
+
+    def test_movie_write(self):
+        def write():
+            self.movie.movie_name = 'Renamed'
+            self.movie.save()
+        self.assertRefreshed(['/en/movie/', self.detail], write)
+        self.assertIn('Renamed', self.client.get('/en/movie/').content.decode())
+
+    def test_genre_link_write(self):
+        genre = make_genre()
+        self.assertRefreshed(['/en/movie/', self.detail], lambda: self.movie.genre.add(genre))
+        self.assertIn(genre.genre_name, self.client.get(self.detail).content.decode())
+
+    def test_review_write(self):
+        url = self.detail + '?expand=reviews'
+        self.assertRefreshed([url], lambda: Review.objects.create(user=self.user, movie=self.movie, comment='Great'))
+        self.assertIn('Great', self.client.get(url).content.decode())
+
+    def test_rating_write_only_refreshes_rating_dependent_pages(self):
+        for url in ['/en/movie/', self.detail, '/en/movie/?ordering=-rating_avg', '/en/movie/?rating_min=5']:
+            self.cache_status(url)
+        Rating.objects.create(user=self.user, movie=self.movie, stars=8)
+        self.assertEqual(self.cache_status('/en/movie/'), 'HIT')
+        self.assertEqual(self.cache_status('/en/movie/?ordering=-rating_avg'), 'MISS')
+        self.assertEqual(self.cache_status('/en/movie/?rating_min=5'), 'MISS')
+        self.assertEqual(self.client.get(self.detail).data['get_avg_rating'], 8)
+
+    def test_bulk_rating_rebuild_refreshes_detail(self):
+        Rating.objects.create(user=self.user, movie=self.movie, stars=8)
+        self.cache_status(self.detail)
+        Rating.objects.filter(movie=self.movie).update(stars=4)
+        self.assertEqual(self.client.get(self.detail).data['get_avg_rating'], 4)
+
+
+def temporary_media_root(test):
+    # A MEDIA_ROOT of its own for the duration of the test.
+    root = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, root, ignore_errors=True)
+    settings = override_settings(MEDIA_ROOT=root)
+    settings.enable()
+    test.addCleanup(settings.disable)
+    return root
+
+
+class ParseRangeTests(TestCase):
+    CASES = [
+        ('bytes=0-9', 100, [(0, 9)]),
+        ('bytes=-10', 100, [(90, 99)]),
+        ('bytes=-200', 100, [(0, 99)]),
+        ('bytes=90-', 100, [(90, 99)]),
+        ('bytes=95-200', 100, [(95, 99)]),
+        ('bytes=0-9, 5-19,20-29', 100, [(0, 29)]),
+        ('bytes=50-59,0-9', 100, [(0, 9), (50, 59)]),
+        ('bytes=0-9,100-', 100, [(0, 9)]),
+        ('bytes=100-', 100, []),
+        ('bytes=-0', 100, []),
+        ('bytes=0-', 0, []),
+        ('bytes=-5', 0, []),
+        ('bytes=5-1', 100, None),
+        ('bytes=a-9', 100, None),
+        ('bytes=5', 100, None),
+        ('items=0-9', 100, None),
+        ('', 100, None),
+        (None, 100, None),
+    ]
+
+    def test_cases(self):
+        for header, size, expected in self.CASES:
+            with self.subTest(header=header, size=size):
+                self.assertEqual(parse_range(header, size), expected)
+
+    def test_max_ranges(self):
+        specs = [f'{i * 10}-{i * 10 + 1}' for i in range(MAX_RANGES + 1)]
+        self.assertEqual(len(parse_range('bytes=' + ','.join(specs[:MAX_RANGES]), 1000)), MAX_RANGES)
+        self.assertIsNone(parse_range('bytes=' + ','.join(specs), 1000))
+
+
+class RangeResponseTests(TestCase):
+    DATA = bytes(range(100))
+
+    def setUp(self):
+        root = temporary_media_root(self)
+        os.makedirs(os.path.join(root, 'video_video'))
+        with open(os.path.join(root, 'video_video', 'clip.mp4'), 'wb') as file:
+            file.write(self.DATA)
+
+    def get(self, **headers):
+        response = range_response(RequestFactory().get('/', headers=headers), 'video_video/clip.mp4')
+        self.addCleanup(response.close)
+        return response, b''.join(response.streaming_content) if response.streaming else response.content
+
+    def test_no_range(self):
+        response, body = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.DATA)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+    def test_single_range(self):
+        response, body = self.get(Range='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/100')
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(body, self.DATA[10:20])
+
+    def test_unsatisfiable(self):
+        response, body = self.get(Range='bytes=200-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */100')
+
+    def test_multipart(self):
+        response, body = self.get(Range='bytes=0-4,90-')
+        self.assertEqual(response.status_code, 206)
+        boundary = response['Content-Type'].split('boundary=')[1]
+        self.assertEqual(int(response['Content-Length']), len(body))
+        self.assertIn(b'Content-Range: bytes 0-4/100\r\n\r\n' + self.DATA[:5] + b'\r\n--' + boundary.encode(), body)
+        self.assertIn(b'Content-Range: bytes 90-99/100\r\n\r\n' + self.DATA[90:], body)
+        self.assertTrue(body.endswith(f'--{boundary}--\r\n'.encode()))
+
+    def test_if_range(self):
+        response, _ = self.get()
+        response, body = self.get(Range='bytes=10-19', If_Range=response['ETag'])
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.DATA[10:20])
+        response, body = self.get(Range='bytes=10-19', If_Range='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.DATA)
+
+    def test_stream_endpoint(self):
+        video = MovieVideo.objects.create(video_name='Clip', video='video_video/clip.mp4', movie=make_movie())
+        client = APIClient()
+        client.force_authenticate(make_user())
+        response = client.get(f'/en/video/{video.pk}/stream/', HTTP_RANGE='bytes=95-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 95-99/100')
+        self.assertEqual(b''.join(response.streaming_content), self.DATA[95:])
+
+
+class ResumableUploadTests(TestCase):
+    DATA = os.urandom(1000)
+
+    def setUp(self):
+        temporary_media_root(self)
+        self.user = make_user()
+        self.user.is_staff = True
+        self.user.save()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.movie = make_movie()
+
+    def start(self, size=len(DATA)):
+        response = self.client.post('/en/video-uploads/', {
+            'movie': self.movie.pk, 'video_name': 'Clip', 'filename': 'clip.MP4', 'size': size}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['missing'], [[0, size - 1]])
+        return f'/en/video-uploads/{response.data["id"]}/'
+
+    def put(self, url, first, last, **headers):
+        return self.client.put(url, self.DATA[first:last + 1], content_type='application/octet-stream',
+                               HTTP_CONTENT_RANGE=f'bytes {first}-{last}/{len(self.DATA)}', **headers)
+
+    def test_out_of_order_chunks(self):
+        url = self.start()
+        self.assertEqual(self.put(url, 600, 999).data['missing'], [[0, 599]])
+        self.assertEqual(self.put(url, 0, 199).data['missing'], [[200, 599]])
+        self.assertEqual(self.put(url, 400, 599).data['missing'], [[200, 399]])
+        self.assertEqual(self.put(url, 200, 399).data['missing'], [])
+        session = UploadSession.objects.get()
+        response = self.client.post(url + 'complete/', {'sha256': hashlib.sha256(self.DATA).hexdigest()},
+                                    format='json')
+        self.assertEqual(response.status_code, 201)
+        video = MovieVideo.objects.get()
+        self.assertTrue(video.video.name.endswith('.mp4'))
+        with default_storage.open(video.video.name) as file:
+            self.assertEqual(file.read(), self.DATA)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(part_path(session)))
+
+    def test_chunk_checksum_mismatch(self):
+        url = self.start()
+        response = self.put(url, 0, 499, HTTP_X_CHUNK_SHA256='0' * 64)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(url).data['missing'], [[0, 999]])
+        checksum = hashlib.sha256(self.DATA[:500]).hexdigest()
+        self.assertEqual(self.put(url, 0, 499, HTTP_X_CHUNK_SHA256=checksum).data['missing'], [[500, 999]])
+
+    def test_bad_content_range(self):
+        url = self.start()
+        response = self.client.put(url, self.DATA[:10], content_type='application/octet-stream',
+                                   HTTP_CONTENT_RANGE='bytes 995-1004/1000')
+        self.assertEqual(response.status_code, 400)
+
+    def test_complete_with_hole(self):
+        url = self.start()
+        self.put(url, 0, 299)
+        self.put(url, 700, 999)
+        self.assertEqual(progress(UploadSession.objects.get())['missing'], [[300, 699]])
+        response = self.client.post(url + 'complete/', {}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(MovieVideo.objects.exists())
+        self.assertTrue(UploadSession.objects.exists())
+
+    def test_complete_checksum_mismatch(self):
+        url = self.start()
+        self.put(url, 0, 999)
+        response = self.client.post(url + 'complete/', {'sha256': '0' * 64}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertTrue(os.path.exists(part_path(UploadSession.objects.get())))
+
+    def test_expire_sessions(self):
+        stale, fresh = [UploadSession.objects.get(pk=self.start().split('/')[-2]) for _ in range(2)]
+        UploadSession.objects.filter(pk=stale.pk).update(
+            updated_at=timezone.now() - upload_expiry() - datetime.timedelta(minutes=1))
+        self.assertEqual(expire_sessions(dry_run=True)[0], 1)
+        self.assertTrue(os.path.exists(part_path(stale)))
+        self.assertEqual(expire_sessions()[0], 1)
+        self.assertFalse(os.path.exists(part_path(stale)))
+        self.assertEqual(list(UploadSession.objects.all()), [fresh])
+        self.assertTrue(os.path.exists(part_path(fresh)))
+
+
+class CatalogRoundTripTests(TestCase):
+
+    def setUp(self):
+        drama = make_genre('Drama')
+        comedy = Genre.objects.create(genre_name_en='Comedy', genre_name_ru='Комедия', category=drama.category)
+        country = Country.objects.create(country_name_en='France', country_name_ru='Франция')
+        director = Director.objects.create(full_name_en='Director', full_name_ru='Режиссёр', bio='Bio',
+                                           director_photo='director_images/d.png',
+                                           birth_date=datetime.date(1950, 5, 1))
+        actors = [Actor.objects.create(full_name=f'Actor {i}', bio='', actor_photo='actor_images/a.png',
+                                       birth_date=datetime.date(1970 + i, 1, 1)) for i in range(3)]
+        for i in range(3):
+            movie = make_movie(f'Movie {i}', 2000 + i, movie_name_ru=f'Фильм {i}', status='pro' if i else 'simple')
+            movie.genre.set([drama, comedy][:i + 1])
+            movie.country.add(country)
+            movie.director.add(director)
+            movie.actor.set(actors[i:])
+        # Same name, another year: a different natural key.
+        make_movie('Movie 0', 1990)
+
+    def snapshot(self, blank=''):
+        # CSV cells cannot tell '' from NULL; read_csv loads empty ones as NULL.
+        return sorted(json.dumps({column: blank if value == '' else value for column, value in record.items()},
+                                 sort_keys=True) for record in export_records(chunk_size=2))
+
+    def clear_catalog(self):
+        for model in (Movie, Actor, Director, Genre, Country, Category):
+            model.objects.all().delete()
+
+    def test_jsonl_round_trip(self):
+        before = self.snapshot()
+        stream = io.StringIO()
+        self.assertEqual(write_jsonl(export_records(chunk_size=2), stream), len(before))
+        self.clear_catalog()
+        stream.seek(0)
+        report = import_records(read_jsonl(stream), chunk_size=2)
+        self.assertEqual(report.errors, [])
+        self.assertEqual(report.created['movies'], 4)
+        self.assertEqual(self.snapshot(), before)
+        movie = Movie.objects.get(movie_name_en='Movie 2')
+        self.assertEqual(sorted(movie.genre.values_list('genre_name_en', flat=True)), ['Comedy', 'Drama'])
+        self.assertEqual(movie.actor.count(), 1)
+
+        stream.seek(0)
+        report = import_records(read_jsonl(stream))
+        self.assertEqual(sum(report.created.values()) + sum(report.updated.values()), 0)
+        self.assertEqual(self.snapshot(), before)
+
+    def test_csv_round_trip(self):
+        before = self.snapshot(blank=None)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        call_command('export_catalog', directory, format='csv', stderr=io.StringIO())
+        self.clear_catalog()
+        call_command('import_catalog', directory, format='csv', stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(self.snapshot(blank=None), before)
+
+
+class MovieListQueryTests(TestCase):
+    # The list costs the same number of queries whatever the page size.
+
+    def setUp(self):
+        genres = [make_genre(f'Genre {i}') for i in range(3)]
+        countries = [Country.objects.create(country_name=f'Country {i}') for i in range(3)]
+        self.actor = Actor.objects.create(full_name='Actor', bio='', actor_photo='actor_images/a.png',
+                                          birth_date=datetime.date(1970, 1, 1))
+        for i in range(12):
+            movie = make_movie(f'River {i}', 1990 + i)
+            movie.genre.set(genres[:i % 3 + 1])
+            movie.country.set(countries[i % 3:])
+            movie.actor.add(self.actor)
+        self.genre, self.country = genres[0], countries[2]
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        # The page, then the country and genre (with category) prefetches;
+        # numbered pages add their total count.
+        scenarios = {
+            'default': ('/en/movie/', 3),
+            'search': ('/en/movie/?search=river', 3),
+            'ordering': ('/en/movie/?ordering=-year', 3),
+            'country': (f'/en/movie/?country={self.country.pk}', 3),
+            'genre': (f'/en/movie/?genre={self.genre.pk}', 3),
+            'actor': (f'/en/movie/?actor={self.actor.pk}', 3),
+            'status': ('/en/movie/?status=simple', 3),
+            'page': ('/en/movie/?page=2', 4),
+        }
+        for name, (url, queries) in scenarios.items():
+            for page_size in (2, 10):
+                caches['catalog'].clear()
+                with self.subTest(name, page_size=page_size), self.assertNumQueries(queries):
+                    separator = '&' if '?' in url else '?'
+                    response = self.client.get(f'{url}{separator}page_size={page_size}')
+                    self.assertEqual(response.status_code, 200)
+
+
+class SearchTests(TestCase):
+
+    def setUp(self):
+        self.by_name = make_movie('Silent River', movie_name_ru='Тихая река', description='A quiet film')
+        self.by_description = make_movie('Summer', description='A film about a silent winter')
+        self.actor = Actor.objects.create(full_name_en='Silent Bob', full_name_ru='Молчаливый Боб', bio='',
+                                          actor_photo='actor_images/a.png', birth_date=datetime.date(1970, 1, 1))
+        self.by_actor = make_movie('Road')
+        self.by_actor.actor.add(self.actor)
+        make_movie('Empire')
+
+    def test_fts_ranks_names_over_people_over_descriptions(self):
+        backend = SQLiteFTSBackend()
+        backend.rebuild()
+        self.assertEqual(backend.search('silent'), [self.by_name.pk, self.by_actor.pk, self.by_description.pk])
+        self.assertEqual(backend.search('тих'), [self.by_name.pk])
+        self.assertEqual(backend.search('sil riv'), [self.by_name.pk])
+        self.assertEqual(backend.search('!!'), [])
+
+    def test_fts_follows_saves_and_deletes(self):
+        backend = SQLiteFTSBackend()
+        self.by_name.movie_name = 'Loud Ocean'
+        self.by_name.save()
+        self.assertEqual(backend.search('ocean'), [self.by_name.pk])
+        self.assertNotIn(self.by_name.pk, backend.search('river'))
+        self.actor.full_name_en = 'Bob Marley'
+        self.actor.save()
+        self.assertEqual(backend.search('marley'), [self.by_actor.pk])
+        self.by_actor.delete()
+        self.assertEqual(backend.search('marley'), [])
+
+    def test_search_endpoint(self):
+        response = self.client.get('/en/movie/search/?q=silent&page_size=2')
+        self.assertEqual([movie['id'] for movie in response.data['results']], [self.by_name.pk, self.by_actor.pk])
+        self.assertIsNotNone(response.data['next'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([movie['id'] for movie in response.data['results']], [self.by_description.pk])
+
+    def test_database_backend(self):
+        backend = DatabaseSearchBackend()
+        self.assertEqual(backend.search('silent')[0], self.by_name.pk)
+        self.assertEqual(set(backend.search('silent')), {self.by_name.pk, self.by_actor.pk, self.by_description.pk})
+        self.assertEqual(list(backend.filter_queryset(Movie.objects.all(), 'silent river')), [self.by_name])
+
+
+class PrefixIndexTests(TestCase):
+
+    def setUp(self):
+        self.river = make_movie('Silent River', movie_name_ru='Тихая река')
+        self.rivera = make_movie('Rivera')
+        self.genre = make_genre('Riverside')
+        self.index = PrefixIndex(max_age=None)
+        self.index.build()
+
+    def found(self, prefix, kind='movies'):
+        return [pk for pk, _ in self.index.search(prefix)[kind]]
+
+    def test_search(self):
+        # Names starting with the prefix come first, then shorter keys.
+        self.assertEqual(self.found('riv'), [self.rivera.pk, self.river.pk])
+        self.assertEqual(self.found('riv', 'genres'), [self.genre.pk])
+        self.assertEqual(self.found('тих'), [self.river.pk])
+        self.assertEqual(self.found('  '), [])
+        self.assertEqual(self.index.search('silent r')['movies'], [(self.river.pk, ('Тихая река', 'Silent River'))])
+
+    def test_overlay_then_merge(self):
+        self.index.update('movies', self.river.pk, ('', 'Loud Ocean'))
+        self.index.update('movies', 999, ('', 'River Run'))
+        self.index.remove('movies', self.rivera.pk)
+        stats = self.index.stats()
+        self.assertEqual(stats['void_objects'], 2)
+        self.assertEqual(stats['overlay_entries'], 4)
+        results = {prefix: self.found(prefix) for prefix in ('riv', 'oce', 'loud', 'silent')}
+        self.assertEqual(results, {'riv': [999], 'oce': [self.river.pk], 'loud': [self.river.pk], 'silent': []})
+
+        self.index.merge()
+        stats = self.index.stats()
+        self.assertEqual((stats['void_objects'], stats['overlay_entries']), (0, 0))
+        self.assertEqual(stats['entries'], len(self.index.keys))
+        self.assertEqual({prefix: self.found(prefix) for prefix in results}, results)
+
+    def test_updates_during_merge_are_replayed(self):
+        install = self.index.install
+
+        def install_after_update(*args, **kwargs):
+            self.index.update('movies', self.rivera.pk, ('', 'Ocean'))
+            install(*args, **kwargs)
+
+        self.index.update('movies', self.river.pk, ('', 'Loud River'))
+        with mock.patch.object(self.index, 'install', install_after_update):
+            self.index.merge()
+        self.assertEqual(self.found('oce'), [self.rivera.pk])
+        self.assertEqual(self.found('riv'), [self.river.pk])
+        self.assertIsNone(self.index.journal)
+
+    def test_max_entries(self):
+        index = PrefixIndex(max_entries=3, max_age=None)
+        index.build()
+        self.assertTrue(index.stats()['truncated'])
+        self.assertLessEqual(index.stats()['entries'], 3)
+
+    def test_signals_update_the_index(self):
+        with mock.patch('movie_app.signals.autocomplete_index', self.index):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.river.movie_name = 'Loud Ocean'
+                self.river.save()
+            self.assertEqual(self.found('oce'), [self.river.pk])
+            with self.captureOnCommitCallbacks(execute=True):
+                self.rivera.delete()
+        self.assertEqual(self.found('riv'), [])
+
+
+class UserScopedListTests(TestCase):
+
+    def setUp(self):
+        self.owner, self.other = make_user('owner'), make_user('other')
+        self.movie = make_movie()
+        self.history = History.objects.create(user=self.owner, movie=self.movie)
+        self.favorite = Favorite.objects.create(user=self.owner)
+        self.item = FavoriteItem.objects.create(favorite=self.favorite, movie=self.movie)
+        self.client = APIClient()
+        self.client.force_authenticate(self.other)
+
+    def test_other_users_rows_are_invisible(self):
+        for url in ('/en/history/', '/en/favorite-items/'):
+            with self.subTest(url):
+                self.assertEqual(self.client.get(url).data['results'], [])
+        # Favorites are not paginated.
+        self.assertEqual(self.client.get('/en/favorites/').data, [])
+        for url in (f'/en/history/{self.history.pk}/', f'/en/favorites/{self.favorite.pk}/',
+                    f'/en/favorite-items/{self.item.pk}/'):
+            with self.subTest(url):
+                self.assertEqual(self.client.get(url).status_code, 404)
+                self.assertEqual(self.client.delete(url).status_code, 404)
+        self.assertTrue(FavoriteItem.objects.filter(pk=self.item.pk).exists())
+        self.assertTrue(History.objects.filter(pk=self.history.pk).exists())
+
+    def test_owner_sees_rows_with_movie_summary(self):
+        self.client.force_authenticate(self.owner)
+        results = self.client.get('/en/history/').data['results']
+        self.assertEqual([(row['id'], row['movie']['id']) for row in results], [(self.history.pk, self.movie.pk)])
+        results = self.client.get('/en/favorite-items/').data['results']
+        self.assertEqual([row['id'] for row in results], [self.item.pk])
+
+    def test_anonymous_is_rejected(self):
+        self.assertEqual(APIClient().get('/en/history/').status_code, 401)
+
+    def test_favorite_items_go_to_the_callers_list(self):
+        response = self.client.post('/en/favorite-items/', {'movie_id': self.movie.pk}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(FavoriteItem.objects.get(pk=response.data['id']).favorite.user, self.other)
+        response = self.client.post('/en/favorite-items/', {'movie_id': self.movie.pk}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class HistoryBufferTests(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(HistoryBuffer, 'ensure_flusher')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.buffer = HistoryBuffer(max_events=5, flush_size=100, flush_interval=1, dedup_window=30, flush_retries=2)
+        self.user = make_user()
+        self.movies = [make_movie(f'Movie {i}').pk for i in range(4)]
+
+    def written(self):
+        return list(History.objects.order_by('id').values_list('movie_id', flat=True))
+
+    def test_collapse_refuse_and_flush(self):
+        first, second = self.movies[:2]
+        self.assertEqual(self.buffer.add(self.user.pk, [first, first, second]), (2, 1))
+        self.assertEqual(self.buffer.add(self.user.pk, [second]), (0, 1))
+        self.assertEqual(self.buffer.add(self.user.pk, self.movies), (0, 0))
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(self.written(), [first, second])
+        stats = self.buffer.stats()
+        self.assertEqual((stats['pending'], stats['rejected'], stats['rows_written']), (0, 4, 2))
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_failed_flush_is_retried_then_dropped(self):
+        failures = iter([OperationalError('database is locked')] * 3)
+        write = self.buffer.write
+
+        def flaky_write(batch):
+            error = next(failures, None)
+            if error is not None:
+                raise error
+            return write(batch)
+
+        a, b, c, _ = self.movies
+        self.buffer.add(self.user.pk, [a, b])
+        with mock.patch.object(self.buffer, 'write', flaky_write), \
+                self.assertLogs('movie_app.ingest', 'WARNING') as logs:
+            self.assertEqual(self.buffer.flush(), 0)
+            self.assertEqual(self.buffer.stats()['pending'], 2)
+            self.buffer.add(self.user.pk, [c])
+            self.assertEqual(self.buffer.flush(), 0)
+            self.assertEqual([movie_id for _, movie_id in self.buffer.pending], [a, b, c])
+            # a and b are out of retries; c has failed once.
+            self.assertEqual(self.buffer.flush(), 0)
+            self.assertEqual([movie_id for _, movie_id in self.buffer.pending], [c])
+            self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual([record.levelname for record in logs.records], ['WARNING', 'WARNING', 'ERROR'])
+        self.assertEqual(self.written(), [c])
+        stats = self.buffer.stats()
+        self.assertEqual((stats['flush_errors'], stats['rows_dropped'], stats['rows_written']), (3, 2, 1))
+
+
+@override_settings(IMAGE_DERIVATIVE_WIDTHS=(160, 320, 640), IMAGE_DERIVATIVE_FORMATS=('webp', 'jpeg'))
+class ImageDerivativeTests(TestCase):
+
+    def setUp(self):
+        self.root = temporary_media_root(self)
+        patcher = mock.patch('movie_app.images.image_pipeline', DerivativePipeline())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        os.makedirs(os.path.join(self.root, 'movie_poster'))
+        buffer = io.BytesIO()
+        Image.new('RGB', (700, 400), 'red').save(buffer, 'PNG')
+        self.data = buffer.getvalue()
+        for name in ('a.png', 'b.png'):
+            self.write(f'movie_poster/{name}', self.data)
+
+    def write(self, name, data):
+        with open(os.path.join(self.root, name), 'wb') as file:
+            file.write(data)
+
+    def test_identical_bytes_are_resized_once(self):
+        manifest, outcome = generate('movie_poster/a.png')
+        self.assertEqual(outcome, 'generated')
+        digest = hashlib.sha256(self.data).hexdigest()
+        self.assertEqual(manifest, {'hash': digest, 'width': 700, 'height': 400,
+                                    'widths': [160, 320, 640], 'formats': ['webp', 'jpeg']})
+        with Image.open(derivative_path('blobs', digest[:2], digest, '320.jpeg')) as image:
+            self.assertEqual(image.size, (320, 183))
+
+        with mock.patch('movie_app.images.Image.open', side_effect=AssertionError('resized again')):
+            self.assertEqual(generate('movie_poster/b.png'), (manifest, 'deduplicated'))
+        self.assertTrue(os.path.exists(alias_path('movie_poster/b.png')))
+        self.assertEqual(len(os.listdir(derivative_path('blobs', digest[:2]))), 1)
+
+        self.assertIn(f'/derivatives/blobs/{digest[:2]}/{digest}/640.webp 640w',
+                      srcset('movie_poster/b.png')['webp'])
+        self.assertTrue(srcset('movie_poster/b.png')['src'].endswith('/320.jpeg'))
+
+    def test_different_bytes_get_their_own_derivatives(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (100, 50), 'blue').save(buffer, 'PNG')
+        self.write('movie_poster/c.png', buffer.getvalue())
+        generate('movie_poster/a.png')
+        manifest, outcome = generate('movie_poster/c.png')
+        self.assertEqual(outcome, 'generated')
+        # Narrower than every configured width: kept at its own.
+        self.assertEqual(manifest['widths'], [100])
+        self.assertNotEqual(manifest['hash'], hashlib.sha256(self.data).hexdigest())
+
+
+class MediaBlobTests(TestCase):
+
+    def setUp(self):
+        temporary_media_root(self)
+
+    def make_actor(self, data, name='Actor'):
+        return Actor.objects.create(full_name=name, bio='', birth_date=datetime.date(1970, 1, 1),
+                                    actor_photo=ContentFile(data, name='photo.PNG'))
+
+    def refcounts(self):
+        return dict(MediaBlob.objects.values_list('name', 'refcount'))
+
+    def test_identical_uploads_share_one_blob(self):
+        first, second = self.make_actor(b'same'), self.make_actor(b'same')
+        name = first.actor_photo.name
+        self.assertEqual(name, second.actor_photo.name)
+        digest = hashlib.sha256(b'same').hexdigest()
+        self.assertEqual(name, f'blobs/{digest[:2]}/{digest}.png')
+        self.assertEqual(self.refcounts(), {name: 2})
+        self.assertEqual(MediaBlob.objects.get().size, 4)
+
+    def test_replace_and_delete(self):
+        first, second = self.make_actor(b'same'), self.make_actor(b'same')
+        old = first.actor_photo.name
+        first.actor_photo = ContentFile(b'other', name='photo.png')
+        first.save()
+        new = first.actor_photo.name
+        self.assertEqual(self.refcounts(), {old: 1, new: 1})
+        # Saves that leave the file alone do not count it again.
+        first.full_name = 'Renamed'
+        first.save()
+        first.save(update_fields=['full_name'])
+        self.assertEqual(self.refcounts(), {old: 1, new: 1})
+        second.delete()
+        self.assertEqual(self.refcounts(), {old: 0, new: 1})
+        self.assertTrue(default_storage.exists(old))
+
+        removed, freed = collect(grace=0)
+        self.assertEqual((removed, freed), ([old], 4))
+        self.assertFalse(default_storage.exists(old))
+        self.assertEqual(self.refcounts(), {new: 1})
+
+    def test_recount_repairs_bypassed_writes(self):
+        actor = self.make_actor(b'same')
+        name = actor.actor_photo.name
+        Actor.objects.filter(pk=actor.pk).update(actor_photo='')
+        self.assertEqual(self.refcounts(), {name: 1})
+        recount()
+        self.assertEqual(self.refcounts(), {name: 0})
+
+
+class TiersTests(TestCase):
+
+    def test_tiers_for(self):
+        cases = [
+            ('720p', 1080, ['360p', '480p', '720p']),
+            ('1080p Ultra', 1080, ['360p', '480p', '720p', '1080p', '1080p Ultra']),
+            ('1080p Ultra', 720, ['360p', '480p', '720p']),
+            ('480p', 2160, ['360p', '480p']),
+            ('1080p', 240, ['360p']),
+            ('unknown', 480, ['360p', '480p']),
+        ]
+        for movie_type, height, expected in cases:
+            with self.subTest(movie_type=movie_type, height=height):
+                self.assertEqual(tiers_for(movie_type, height), expected)
+
+
+@override_settings(VIDEO_PACKAGER='movie_app.packaging.StubPackager')
+class VideoPackagingTests(TransactionTestCase):
+    # run_package closes connections, which a TestCase transaction would not survive.
+
+    def setUp(self):
+        root = temporary_media_root(self)
+        os.makedirs(os.path.join(root, 'video_video'))
+        with open(os.path.join(root, 'video_video', 'a.mp4'), 'wb') as file:
+            file.write(b'video')
+        self.movie = make_movie(movie_type='720p')
+
+    def package(self):
+        video = MovieVideo.objects.create(video_name='Clip', video='video_video/a.mp4', movie=self.movie)
+        package = VideoPackage.objects.get(video=video)
+        self.assertEqual(package.status, 'queued')
+        self.assertEqual(run_package(package.pk), (package.pk, 'ready'))
+        package.refresh_from_db()
+        return video, package
+
+    def test_stub_packager_output(self):
+        video, package = self.package()
+        self.assertEqual(package.progress, 1)
+        self.assertEqual(package.source, video.video.name)
+        self.assertEqual([(r['tier'], r['width'], r['height'], r['bandwidth']) for r in package.renditions], [
+            ('360p', 640, 360, 896000), ('480p', 854, 480, 1528000), ('720p', 1280, 720, 2928000)])
+        key = f'video-{video.pk}'
+        self.assertEqual(package.renditions[0]['playlist'], f'/media/hls/{key}/360p/index.m3u8')
+        with open(output_path(key, '720p', 'index.m3u8')) as playlist:
+            lines = playlist.read().splitlines()
+        self.assertEqual(lines[0], '#EXTM3U')
+        self.assertEqual(lines[-1], '#EXT-X-ENDLIST')
+        self.assertEqual(lines.count('#EXTINF:6.000,'), StubPackager.duration / 6)
+        self.assertTrue(os.path.exists(output_path(key, '720p', 'segment_00009.ts')))
+
+        master = master_playlist(package, lambda url: f'http://testserver{url}').splitlines()
+        self.assertEqual(master[3], '#EXT-X-STREAM-INF:BANDWIDTH=896000,RESOLUTION=640x360,NAME="360p"')
+        self.assertEqual(master[4], f'http://testserver/media/hls/{key}/360p/index.m3u8')
+        self.assertEqual(len(master), 3 + 2 * 3)
+
+    def test_failure_is_recorded(self):
+        with mock.patch.object(StubPackager, 'package', side_effect=RuntimeError('ffmpeg exited with 1')):
+            video = MovieVideo.objects.create(video_name='Clip', video='video_video/a.mp4', movie=self.movie)
+            package = VideoPackage.objects.get(video=video)
+            self.assertEqual(run_package(package.pk), (package.pk, 'failed'))
+        package.refresh_from_db()
+        self.assertEqual((package.status, package.error), ('failed', 'ffmpeg exited with 1'))
+        self.assertFalse(os.path.exists(output_path(f'video-{video.pk}', '360p')))
+
+
+class RecommendationTests(TestCase):
+
+    def setUp(self):
+        self.genres = [make_genre(f'Genre {i}') for i in range(3)]
+        self.actor = Actor.objects.create(full_name='Actor', bio='', actor_photo='actor_images/a.png',
+                                          birth_date=datetime.date(1970, 1, 1))
+        self.movies = [make_movie(f'Movie {i}') for i in range(8)]
+        for i, movie in enumerate(self.movies):
+            movie.genre.set([self.genres[i % 3]])
+            if i < 3:
+                movie.actor.add(self.actor)
+        self.users = [make_user(f'user{i}') for i in range(4)]
+        for i, user in enumerate(self.users):
+            for j, movie in enumerate(self.movies[i:i + 4]):
+                Rating.objects.create(user=user, movie=movie, stars=10 - j * 2)
+
+    def neighbors(self):
+        lists = {}
+        for movie_id, neighbor_ids, scores in MovieNeighbors.objects.values_list('movie_id', 'neighbor_ids', 'scores'):
+            self.assertEqual(scores, sorted(scores, reverse=True))
+            lists[movie_id] = dict(zip(neighbor_ids, scores))
+        return lists
+
+    def test_incremental_train_matches_full_retrain(self):
+        stats = train()
+        self.assertEqual((stats['movies'], stats['rescored'], stats['written']), (8, 8, 8))
+        self.assertEqual(train()['rescored'], 0)
+        before = self.neighbors()
+
+        Rating.objects.create(user=self.users[0], movie=self.movies[6], stars=9)
+        History.objects.create(user=self.users[1], movie=self.movies[7])
+        self.movies[5].genre.add(self.genres[0])
+        stats = train()
+        self.assertLess(stats['rescored'], 8)
+        incremental = self.neighbors()
+        self.assertNotEqual(incremental, before)
+
+        train(full=True)
+        self.assertEqual(self.neighbors(), incremental)
+
+    def test_similar_and_recommended(self):
+        train()
+        first, second = self.movies[:2]
+        similar = similar_movies(first.pk, 3)
+        self.assertEqual(len(similar), 3)
+        self.assertNotIn(first.pk, [movie.pk for movie in similar])
+        self.assertEqual(similar[0].recommendation_score, MovieNeighbors.objects.get(movie=first).scores[0])
+
+        user = make_user('newcomer')
+        Rating.objects.create(user=user, movie=first, stars=10)
+        recommended = recommend_for_user(user.pk, 5)
+        self.assertTrue(recommended)
+        self.assertNotIn(first.pk, [movie.pk for movie in recommended])
+        self.assertEqual({movie.recommended_because for movie in recommended}, {first.pk})
+
+
+@override_settings(LEADERBOARD_HALF_LIFE_HOURS=48, LEADERBOARD_RATING_PRIOR=20)
+class LeaderboardTests(TestCase):
+
+    def setUp(self):
+        self.genre = make_genre()
+        self.old, self.recent, self.single, self.unseen = [make_movie(f'Movie {i}') for i in range(4)]
+        self.single.genre.add(self.genre)
+        self.user = make_user()
+
+    def view(self, movie, hours_ago, count=1):
+        when = timezone.now() - datetime.timedelta(hours=hours_ago)
+        for _ in range(count):
+            History.objects.filter(pk=History.objects.create(user=self.user, movie=movie).pk).update(created_date=when)
+
+    def rate(self, movie, stars, count):
+        start = UserProfile.objects.count()
+        users = UserProfile.objects.bulk_create([UserProfile(username=f'rater{start + i}') for i in range(count)])
+        Rating.objects.bulk_create([Rating(user=user, movie=movie, stars=stars) for user in users])
+
+    def board(self, name, **scope):
+        entries = LeaderboardEntry.objects.filter(board=name, scope=scope.get('scope', 'all'))
+        return list(entries.order_by('-score').values_list('movie_id', flat=True))
+
+    def test_trending_decays_old_views(self):
+        # Five half-lives ago, four views weigh 1/8 of one.
+        self.view(self.old, 240, count=4)
+        self.view(self.recent, 1, count=2)
+        self.view(self.single, 2)
+        refresh(full=True)
+        self.assertEqual(self.board(TRENDING), [self.recent.pk, self.single.pk, self.old.pk])
+        self.assertEqual(self.board(TRENDING, scope=f'genre:{self.genre.pk}'), [self.single.pk])
+
+        results = self.client.get('/en/movie/trending/').data['results']
+        self.assertEqual([movie['id'] for movie in results], [self.recent.pk, self.single.pk, self.old.pk])
+        self.assertAlmostEqual(results[0]['score'], 2, delta=0.05)
+        self.assertAlmostEqual(results[2]['score'], 0.125, delta=0.01)
+
+        # New settled views are folded in incrementally, as a rebuild would.
+        self.view(self.single, 0.1, count=3)
+        refresh()
+        incremental = self.board(TRENDING)
+        self.assertEqual(incremental[0], self.single.pk)
+        refresh(full=True)
+        self.assertEqual(self.board(TRENDING), incremental)
+
+    def test_top_rated_weighs_rating_counts(self):
+        self.rate(self.old, 10, 1)
+        self.rate(self.recent, 9, 30)
+        self.rate(self.single, 4, 10)
+        refresh()
+        self.assertEqual(self.board(TOP_RATED), [self.recent.pk, self.old.pk, self.single.pk])
+        results = self.client.get('/en/movie/top-rated/').data['results']
+        self.assertEqual([movie['id'] for movie in results], [self.recent.pk, self.old.pk, self.single.pk])
+        # Bayesian average, pulled towards the catalog mean by the prior.
+        mean = (10 + 9 * 30 + 4 * 10) / 41
+        self.assertAlmostEqual(results[0]['score'], (20 * mean + 270) / 50, places=3)
+
+        # Enough new low ratings move a movie down on the next refresh.
+        self.rate(self.recent, 1, 60)
+        refresh()
+        self.assertEqual(self.board(TOP_RATED)[-1], self.recent.pk)
+        self.assertNotIn(self.unseen.pk, self.board(TOP_RATED))
+
+
+class MovieFilterTests(TestCase):
+
+    def setUp(self):
+        caches['catalog'].clear()
+        self.drama, self.comedy = make_genre('Drama'), make_genre('Comedy')
+        self.france = Country.objects.create(country_name='France')
+        self.a = make_movie('A', 1985, movie_time=90, movie_type='360p', rating_avg=8.5)
+        self.b = make_movie('B', 1995, movie_time=120, movie_type='720p', rating_avg=6)
+        self.c = make_movie('C', 1999, movie_time=150, movie_type='1080p', rating_avg=7, status='pro')
+        self.a.genre.set([self.drama])
+        self.b.genre.set([self.drama, self.comedy])
+        self.c.genre.set([self.comedy])
+        self.c.country.add(self.france)
+
+    def found(self, query):
+        response = self.client.get(f'/en/movie/?page_size=100&{query}')
+        self.assertEqual(response.status_code, 200, response.data)
+        return [movie['id'] for movie in response.data['results']]
+
+    def test_ranges(self):
+        a, b, c = self.a.pk, self.b.pk, self.c.pk
+        self.assertEqual(self.found('year_min=1990'), [b, c])
+        self.assertEqual(self.found('year_max=1995'), [a, b])
+        # Year bounds are inclusive of the whole year.
+        self.assertEqual(self.found('year_min=1995&year_max=1995'), [b])
+        self.assertEqual(self.found('movie_time_min=100&movie_time_max=150'), [b, c])
+        self.assertEqual(self.found('rating_min=7'), [a, c])
+
+    def test_multi_select(self):
+        a, b, c = self.a.pk, self.b.pk, self.c.pk
+        self.assertEqual(self.found(f'genre={self.drama.pk},{self.comedy.pk}'), [a, b, c])
+        self.assertEqual(self.found(f'genre_all={self.drama.pk},{self.comedy.pk}'), [b])
+        self.assertEqual(self.found(f'genre_all={self.comedy.pk},{self.comedy.pk}'), [b, c])
+        self.assertEqual(self.found(f'country={self.france.pk}'), [c])
+        self.assertEqual(self.found('movie_type=360p,1080p'), [a, c])
+        self.assertEqual(self.found('status=pro'), [c])
+
+    def test_combined_with_ordering(self):
+        query = f'genre={self.drama.pk},{self.comedy.pk}&year_min=1990&ordering=-rating_avg'
+        self.assertEqual(self.found(query), [self.c.pk, self.b.pk])
+
+    def test_invalid_values(self):
+        for query in ('year_min=0', 'year_max=abc', 'genre=1,x', 'movie_time_min=long'):
+            with self.subTest(query):
+                self.assertEqual(self.client.get(f'/en/movie/?{query}').status_code, 400)
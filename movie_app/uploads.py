@@ -0,0 +1,147 @@
+import hashlib
+import os
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from .models import MovieVideo, UploadChunk, UploadSession
+
+UPLOAD_DIR = 'uploads'
+READ_SIZE = 1 << 20
+CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+class UploadError(Exception):
+    pass
+
+
+def max_chunk_size():
+    return getattr(settings, 'VIDEO_UPLOAD_MAX_CHUNK_SIZE', 64 << 20)
+
+
+def part_path(session):
+    return default_storage.path(f'{UPLOAD_DIR}/{session.pk}.part')
+
+
+def start(session):
+    # The part file is allocated sparse at its final size, so chunks can be
+    # written at their offsets in any order and by concurrent requests.
+    path = part_path(session)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as part:
+        part.truncate(session.size)
+
+
+def parse_content_range(header, session):
+    match = CONTENT_RANGE.match(header or '')
+    if not match:
+        raise UploadError('Нужен заголовок Content-Range: bytes <first>-<last>/<size>')
+    first, last, total = map(int, match.groups())
+    if total != session.size or last < first or last >= session.size:
+        raise UploadError('Content-Range не совпадает с размером загрузки')
+    if last - first + 1 > max_chunk_size():
+        raise UploadError(f'Часть больше {max_chunk_size()} байт')
+    return first, last - first + 1
+
+
+def write_chunk(session, offset, length, stream, expected_sha256=None):
+    # Streams the request body to its place in the part file with pwrite,
+    # hashing as it goes; nothing is buffered beyond READ_SIZE.
+    digest = hashlib.sha256()
+    descriptor = os.open(part_path(session), os.O_WRONLY)
+    try:
+        position, remaining = offset, length
+        while remaining:
+            data = stream.read(min(READ_SIZE, remaining)) if stream is not None else b''
+            if not data:
+                raise UploadError(f'Получено {length - remaining} из {length} байт')
+            digest.update(data)
+            os.pwrite(descriptor, data, position)
+            position += len(data)
+            remaining -= len(data)
+    finally:
+        os.close(descriptor)
+    checksum = digest.hexdigest()
+    if expected_sha256 and expected_sha256.lower() != checksum:
+        raise UploadError('Контрольная сумма части не совпадает')
+    UploadChunk.objects.update_or_create(session=session, offset=offset,
+                                         defaults={'length': length, 'sha256': checksum})
+    UploadSession.objects.filter(pk=session.pk).update(updated_at=timezone.now())
+    return checksum
+
+
+def received_ranges(session):
+    merged = []
+    for offset, length in session.chunks.order_by('offset').values_list('offset', 'length'):
+        if merged and offset <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], offset + length)
+        else:
+            merged.append([offset, offset + length])
+    return merged
+
+
+def progress(session):
+    ranges = received_ranges(session)
+    missing, position = [], 0
+    for first, end in ranges + [[session.size, session.size]]:
+        if first > position:
+            missing.append([position, first - 1])
+        position = max(position, end)
+    return {
+        'id': session.pk,
+        'size': session.size,
+        'received': sum(end - first for first, end in ranges),
+        'missing': missing,
+        'max_chunk_size': max_chunk_size(),
+        'expires': session.updated_at + upload_expiry(),
+    }
+
+
+def complete(session_id, user, sha256=None):
+    # The part file becomes the blob itself (see save_local): it is read
+    # once for the content hash and renamed, never copied.
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=session_id, user=user)
+        if progress(session)['missing']:
+            raise UploadError('Загружены не все части')
+        try:
+            name = default_storage.save_local(part_path(session), session.filename, expected_sha256=sha256)
+        except ValueError:
+            raise UploadError('Контрольная сумма файла не совпадает')
+        video = MovieVideo.objects.create(movie=session.movie, video_name=session.video_name, video=name)
+        session.delete()
+    return video
+
+
+def abort(session):
+    discard_part(session)
+    session.delete()
+
+
+def discard_part(session):
+    try:
+        os.remove(part_path(session))
+    except FileNotFoundError:
+        pass
+
+
+def upload_expiry():
+    return timedelta(hours=getattr(settings, 'VIDEO_UPLOAD_EXPIRY_HOURS', 24))
+
+
+def expire_sessions(dry_run=False):
+    # Sessions with no chunk written for VIDEO_UPLOAD_EXPIRY_HOURS are
+    # abandoned; their part files and rows go.
+    stale = list(UploadSession.objects.filter(updated_at__lt=timezone.now() - upload_expiry()))
+    freed = 0
+    for session in stale:
+        if os.path.exists(part_path(session)):
+            # part files are sparse until every chunk has arrived
+            freed += os.stat(part_path(session)).st_blocks * 512
+        if not dry_run:
+            abort(session)
+    return len(stale), freed
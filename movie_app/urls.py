@@ -6,34 +6,76 @@ from .views import (
     CountryListAPIView, CountryDetailAPIView,
     DirectorListAPIView, DirectorDetailAPIView,
     ActorListAPIView, ActorDetailAPIView,
-    MovieListAPIView, MovieDetailAPIView,
-    ReviewCreateAPIView, HistoryViewSet, RatingCreateAPIView,
+    MovieListAPIView, MovieDetailAPIView, MovieSearchAPIView, MovieFacetAPIView,
+    SimilarMovieListAPIView, UserRecommendationAPIView, TrendingMovieListAPIView, TopRatedMovieListAPIView,
+    AutocompleteAPIView, AutocompleteStatsAPIView,
+    MovieRatingListAPIView, MovieReviewListAPIView,
+    MovieFrameListAPIView, MovieVideoListAPIView, MovieVideoStreamAPIView, MovieVideoHLSAPIView,
+    UploadSessionCreateAPIView, UploadSessionAPIView, UploadSessionCompleteAPIView,
+    MovieReviewThreadListAPIView, ReviewThreadAPIView,
+    GenreMovieListAPIView, CountryMovieListAPIView,
+    DirectorMovieListAPIView, ActorMovieListAPIView,
+    ReviewCreateAPIView, HistoryViewSet, HistoryEventAPIView, HistoryBufferStatsAPIView, RatingCreateAPIView,
     FavoriteViewSet, FavoriteItemViewSet, ActorImageViewSet,
     ReviewLikeViewSet, RegisterView, LoginView, LogoutView
 )
+from .async_views import (
+    AsyncMovieListView, AsyncMovieDetailView, AsyncGenreDetailView,
+    AsyncActorDetailView, AsyncAutocompleteView
+)
 
 router = DefaultRouter()
 router.register(r'actor_image', ActorImageViewSet)
 router.register(r'review_like', ReviewLikeViewSet)
-router.register(r'favorites', FavoriteViewSet)
-router.register(r'favorite-items', FavoriteItemViewSet)
-router.register(r'history', HistoryViewSet)
+router.register(r'favorites', FavoriteViewSet, basename='favorite')
+router.register(r'favorite-items', FavoriteItemViewSet, basename='favoriteitem')
+router.register(r'history', HistoryViewSet, basename='history')
 
 urlpatterns = [
+    path('history/events/', HistoryEventAPIView.as_view(), name='history_events'),
+    path('history/events/stats/', HistoryBufferStatsAPIView.as_view(), name='history_events_stats'),
     path('', include(router.urls)),
     path('category/', CategoryListAPIView.as_view(), name='category_list'),
     path('category/<int:pk>/', CategoryDetailAPIView.as_view(), name='category_detail'),
     path('genre/', GenreListAPIView.as_view(), name='genre_list'),
     path('genre/<int:pk>/', GenreDetailAPIView.as_view(), name='genre_detail'),
+    path('genre/<int:pk>/movies/', GenreMovieListAPIView.as_view(), name='genre_movies'),
     path('country/', CountryListAPIView.as_view(), name='country_list'),
     path('country/<int:pk>/', CountryDetailAPIView.as_view(), name='country_detail'),
+    path('country/<int:pk>/movies/', CountryMovieListAPIView.as_view(), name='country_movies'),
     path('movie/', MovieListAPIView.as_view(), name='movie_list'),
+    path('autocomplete/', AutocompleteAPIView.as_view(), name='autocomplete'),
+    path('autocomplete/stats/', AutocompleteStatsAPIView.as_view(), name='autocomplete_stats'),
+    path('movie/search/', MovieSearchAPIView.as_view(), name='movie_search'),
+    path('movie/facets/', MovieFacetAPIView.as_view(), name='movie_facets'),
+    path('movie/trending/', TrendingMovieListAPIView.as_view(), name='movie_trending'),
+    path('movie/top-rated/', TopRatedMovieListAPIView.as_view(), name='movie_top_rated'),
     path('movie/<int:pk>/', MovieDetailAPIView.as_view(), name='movie_detail'),
+    path('movie/<int:pk>/similar/', SimilarMovieListAPIView.as_view(), name='movie_similar'),
+    path('movie/<int:pk>/ratings/', MovieRatingListAPIView.as_view(), name='movie_ratings'),
+    path('movie/<int:pk>/reviews/', MovieReviewListAPIView.as_view(), name='movie_reviews'),
+    path('movie/<int:pk>/threads/', MovieReviewThreadListAPIView.as_view(), name='movie_review_threads'),
+    path('review/<int:pk>/thread/', ReviewThreadAPIView.as_view(), name='review_thread'),
+    path('movie/<int:pk>/frames/', MovieFrameListAPIView.as_view(), name='movie_frames'),
+    path('movie/<int:pk>/videos/', MovieVideoListAPIView.as_view(), name='movie_videos'),
+    path('video/<int:pk>/stream/', MovieVideoStreamAPIView.as_view(), name='movie_video_stream'),
+    path('video/<int:pk>/hls/', MovieVideoHLSAPIView.as_view(), name='movie_video_hls'),
+    path('video-uploads/', UploadSessionCreateAPIView.as_view(), name='video_upload_create'),
+    path('video-uploads/<uuid:pk>/', UploadSessionAPIView.as_view(), name='video_upload'),
+    path('video-uploads/<uuid:pk>/complete/', UploadSessionCompleteAPIView.as_view(), name='video_upload_complete'),
     path('director/', DirectorListAPIView.as_view(), name='director_list'),
     path('director/<int:pk>/', DirectorDetailAPIView.as_view(), name='director_detail'),
+    path('director/<int:pk>/movies/', DirectorMovieListAPIView.as_view(), name='director_movies'),
     path('actor/', ActorListAPIView.as_view(), name='actor_list'),
     path('actor/<int:pk>/', ActorDetailAPIView.as_view(), name='actor_detail'),
+    path('actor/<int:pk>/movies/', ActorMovieListAPIView.as_view(), name='actor_movies'),
+    path('async/movie/', AsyncMovieListView.as_view(), name='async_movie_list'),
+    path('async/movie/<int:pk>/', AsyncMovieDetailView.as_view(), name='async_movie_detail'),
+    path('async/genre/<int:pk>/', AsyncGenreDetailView.as_view(), name='async_genre_detail'),
+    path('async/actor/<int:pk>/', AsyncActorDetailView.as_view(), name='async_actor_detail'),
+    path('async/autocomplete/', AsyncAutocompleteView.as_view(), name='async_autocomplete'),
     path('user/', UserProfileListAPIView.as_view(), name='user_list'),
+    path('user/recommendations/', UserRecommendationAPIView.as_view(), name='user_recommendations'),
     path('user/<int:pk>/', UserProfileDetailAPIView.as_view(), name='user_detail'),
     path('ratings/', RatingCreateAPIView.as_view(), name='rating_create'),
     path('reviews', ReviewCreateAPIView.as_view(), name='review_create'),
@@ -1,17 +1,40 @@
 from rest_framework import viewsets, generics, permissions, status
 from django_filters.rest_framework import DjangoFilterBackend
-from .filters import CountryFilter, GenreFilter, MovieFilter, ActorFilter
+from .filters import CountryFilter, GenreFilter, MovieFilter, ActorFilter, MovieSearchFilter
 from rest_framework.filters import SearchFilter, OrderingFilter
-from .pagination import MoviePagination, CategoryPagination, GenrePagination
+from .pagination import (
+    MoviePagination, CategoryPagination, GenrePagination,
+    NestedMoviePagination, MovieItemPagination, MovieMediaPagination,
+    HistoryPagination, FavoriteItemPagination, ReviewLikePagination, LeaderboardPagination
+)
 from .permissions import UserStatusPermissions, CreatePermissions
+from .cache import RATING_CACHE_TAG, CachedResponseMixin
+from .conditional import ConditionalGetMixin
+from .db_routing import ReplicaReadMixin
+from .search import get_search_backend
+from .autocomplete import autocomplete_index
+from .facets import FACETS, FACET_TYPES, facet_index
+from .ingest import history_buffer
+from .streaming import range_response
+from . import uploads
+from .packaging import master_playlist
+from .recommendations import neighbor_count, similar_movies, recommend_for_user
+from .leaderboards import TRENDING, TOP_RATED, display_score, scope
+from django.db.models import Prefetch, prefetch_related_objects
+from django.utils import timezone
+from django.utils.translation import get_language
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from django.http import Http404, HttpResponse
+from django.shortcuts import get_object_or_404
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework_simplejwt.tokens import RefreshToken
 
 from .models import (
     UserProfile, Category, Genre, Country, Director, Actor,
-    Movie, Review, History, Rating,
-    Favorite, FavoriteItem, ActorImage, ReviewLike
+    Movie, MovieVideo, Review, History, Rating, build_review_tree,
+    Favorite, FavoriteItem, ActorImage, ReviewLike, UploadSession, LeaderboardEntry, StatusChoices
 )
 from .serializers import (
     UserProfileListSerializer, UserProfileDetailSerializer,
@@ -20,12 +43,22 @@ from .serializers import (
     CountryListSerializer, CountryDetailSerializer,
     DirectorListSerializer, DirectorDetailSerializer,
     ActorSerializer, ActorListSerializer, ActorDetailSerializer,
-    MovieListSerializer, MovieDetailSerializer,
-    ReviewCreateSerializer, HistorySerializer, RatingSerializer, RatingCreateSerializer,
+    MovieListSerializer, MovieDetailSerializer, RecommendedMovieSerializer, LeaderboardMovieSerializer, movie_item_queryset,
+    MovieVideoSerializer, UploadSessionSerializer, UploadCompleteSerializer, MovieFrameSerializer, ReviewSerializer, ReviewThreadSerializer,
+    ReviewCreateSerializer, HistorySerializer, HistoryEventBatchSerializer, RatingSerializer, RatingCreateSerializer,
     FavoriteSerializer, FavoriteItemSerializer, ActorImageSerializer,
     ReviewLikeSerializer, UserRegisterSerializer, UserLoginSerializer
 )
 
+def query_int(request, name, default, maximum=None):
+    try:
+        value = int(request.query_params.get(name, default))
+    except ValueError:
+        value = default
+    value = max(value, 0)
+    return min(value, maximum) if maximum is not None else value
+
+
 class RegisterView(generics.CreateAPIView):
     serializer_class = UserRegisterSerializer
 
@@ -77,79 +110,471 @@ class UserProfileDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
     def get_queryset(self):
         return UserProfile.objects.filter(id=self.request.user.id)
 
-class CategoryListAPIView(generics.ListAPIView):
+class CategoryListAPIView(ReplicaReadMixin, ConditionalGetMixin, CachedResponseMixin, generics.ListAPIView):
     queryset = Category.objects.all()
+    cache_tags = ['category']
     serializer_class = CategoryListSerializer
     pagination_class = CategoryPagination
 
 
-class CategoryDetailAPIView(generics.RetrieveAPIView):
+class CategoryDetailAPIView(ReplicaReadMixin, ConditionalGetMixin, CachedResponseMixin, generics.RetrieveAPIView):
     queryset = Category.objects.all()
+    cache_tags = ['category', 'genre']
     serializer_class = CategoryDetailSerializer
 
 
-class GenreListAPIView(generics.ListAPIView):
+class GenreListAPIView(ReplicaReadMixin, ConditionalGetMixin, CachedResponseMixin, generics.ListAPIView):
     queryset = Genre.objects.all()
+    cache_tags = ['genre']
     serializer_class = GenreListSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_class = GenreFilter
     pagination_class = GenrePagination
 
 
-class GenreDetailAPIView(generics.RetrieveAPIView):
+class GenreDetailAPIView(ReplicaReadMixin, ConditionalGetMixin, CachedResponseMixin, generics.RetrieveAPIView):
     queryset = Genre.objects.all()
+    cache_tags = ['genre', 'movie', 'country']
     serializer_class = GenreDetailSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_class = GenreFilter
 
 
-class CountryListAPIView(generics.ListAPIView):
+class CountryListAPIView(ReplicaReadMixin, ConditionalGetMixin, CachedResponseMixin, generics.ListAPIView):
     queryset = Country.objects.all()
+    cache_tags = ['country']
     serializer_class = CountryListSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_class = CountryFilter
 
 
-class CountryDetailAPIView(generics.RetrieveAPIView):
+class CountryDetailAPIView(ReplicaReadMixin, ConditionalGetMixin, CachedResponseMixin, generics.RetrieveAPIView):
     queryset = Country.objects.all()
+    cache_tags = ['country', 'movie', 'genre']
     serializer_class = CountryDetailSerializer
 
 
-class DirectorListAPIView(generics.ListAPIView):
+class DirectorListAPIView(ReplicaReadMixin, ConditionalGetMixin, CachedResponseMixin, generics.ListAPIView):
     queryset = Director.objects.all()
+    cache_tags = ['director']
     serializer_class = DirectorListSerializer
 
 
-class DirectorDetailAPIView(generics.RetrieveAPIView):
+class DirectorDetailAPIView(ReplicaReadMixin, ConditionalGetMixin, CachedResponseMixin, generics.RetrieveAPIView):
     queryset = Director.objects.all()
+    cache_tags = ['director', 'movie', 'country', 'genre']
     serializer_class = DirectorDetailSerializer
 
 
-class ActorListAPIView(generics.ListAPIView):
+class ActorListAPIView(ReplicaReadMixin, ConditionalGetMixin, CachedResponseMixin, generics.ListAPIView):
     queryset = Actor.objects.all()
+    cache_tags = ['actor']
     serializer_class = ActorListSerializer
 
 
-class ActorDetailAPIView(generics.RetrieveAPIView):
+class ActorDetailAPIView(ReplicaReadMixin, ConditionalGetMixin, CachedResponseMixin, generics.RetrieveAPIView):
     queryset = Actor.objects.all()
+    cache_tags = ['actor', 'movie', 'country', 'genre']
     serializer_class = ActorDetailSerializer
 
 
-class MovieListAPIView(generics.ListAPIView):
-    queryset = Movie.objects.all()
+class MovieListAPIView(ReplicaReadMixin, ConditionalGetMixin, CachedResponseMixin, generics.ListAPIView):
+    queryset = Movie.objects.for_list()
+    cache_tags = ['movie', 'country', 'genre']
     serializer_class = MovieListSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
-    filterset_fields = ['country', 'genre', 'status', 'actor']
+    filter_backends = [DjangoFilterBackend, MovieSearchFilter, OrderingFilter]
+    filterset_class = MovieFilter
     search_fields = ['movie_name']
-    ordering_fields = ['year']
+    ordering_fields = ['year', 'rating_avg', 'movie_time']
+    ordering = ['id']
     pagination_class = MoviePagination
 
-class MovieDetailAPIView(generics.RetrieveAPIView):
+    def get_cache_tags(self):
+        tags = super().get_cache_tags()
+        params = self.request.query_params
+        if 'rating_avg' in params.get(OrderingFilter.ordering_param, '') or params.get('rating_min'):
+            tags.append(RATING_CACHE_TAG)
+        return tags
+
+class MovieSearchAPIView(ReplicaReadMixin, generics.GenericAPIView):
+    # Relevance-ranked full-text search with prefix matching, e.g. ?q=матр
+    serializer_class = MovieListSerializer
+    page_size = 20
+    max_page_size = 100
+
+    def get(self, request, *args, **kwargs):
+        query = request.query_params.get('q', '')
+        page_size = query_int(request, 'page_size', self.page_size, self.max_page_size) or self.page_size
+        page = query_int(request, 'page', 1) or 1
+        movie_ids = get_search_backend().search(query, limit=page_size + 1, offset=(page - 1) * page_size)
+        has_next = len(movie_ids) > page_size
+        movie_ids = movie_ids[:page_size]
+        movies = Movie.objects.for_list().in_bulk(movie_ids)
+        url = request.build_absolute_uri()
+        return Response({
+            'next': replace_query_param(url, 'page', page + 1) if has_next else None,
+            'previous': replace_query_param(url, 'page', page - 1) if page > 1 else None,
+            'results': self.get_serializer([movies[pk] for pk in movie_ids if pk in movies], many=True).data,
+        })
+
+
+class MovieFacetAPIView(ReplicaReadMixin, generics.GenericAPIView):
+    # Faceted browsing from the in-process posting lists, e.g.
+    # ?genre=3,5&year=1990&status=pro: a page of the matching movies by id
+    # plus per-value counts of every facet. Comma-separated values of one
+    # facet are OR-ed, different facets AND-ed.
+    serializer_class = MovieListSerializer
+    page_size = 20
+    max_page_size = 100
+
+    def get(self, request, *args, **kwargs):
+        filters = {}
+        for facet in FACETS:
+            raw = request.query_params.get(facet)
+            if not raw:
+                continue
+            try:
+                filters[facet] = {FACET_TYPES[facet](value) for value in raw.split(',') if value}
+            except ValueError:
+                raise ValidationError({facet: ['Ожидается список чисел через запятую']})
+        facet_index.ensure_fresh()
+        movie_ids, counts = facet_index.search(filters)
+
+        page_size = query_int(request, 'page_size', self.page_size, self.max_page_size) or self.page_size
+        page = query_int(request, 'page', 1) or 1
+        page_ids = movie_ids[(page - 1) * page_size:page * page_size].tolist()
+        movies = Movie.objects.for_list().in_bulk(page_ids)
+        url = request.build_absolute_uri()
+        return Response({
+            'count': len(movie_ids),
+            'next': replace_query_param(url, 'page', page + 1) if page * page_size < len(movie_ids) else None,
+            'previous': replace_query_param(url, 'page', page - 1) if page > 1 else None,
+            'facets': self.facets(counts),
+            'results': self.get_serializer([movies[pk] for pk in page_ids if pk in movies], many=True).data,
+        })
+
+    def facets(self, counts):
+        facets = {facet: [{'value': value, 'count': count} for value, count in items]
+                  for facet, items in counts.items()}
+        names = {
+            'genre': {pk: genre.genre_name for pk, genre in
+                      Genre.objects.in_bulk([item['value'] for item in facets['genre']]).items()},
+            'country': {pk: country.country_name for pk, country in
+                        Country.objects.in_bulk([item['value'] for item in facets['country']]).items()},
+        }
+        for facet, labels in names.items():
+            for item in facets[facet]:
+                item['name'] = labels.get(item['value'])
+        return facets
+
+
+class AutocompleteAPIView(generics.GenericAPIView):
+    # Per-keystroke suggestions served from the in-process prefix index.
+    limit = 5
+    max_limit = 20
+
+    def get(self, request, *args, **kwargs):
+        autocomplete_index.ensure_fresh()
+        return Response(self.suggestions(request))
+
+    def suggestions(self, request):
+        limit = query_int(request, 'limit', self.limit, self.max_limit) or self.limit
+        matches = autocomplete_index.search(request.query_params.get('q', ''), limit=limit)
+        language_index = 0 if (get_language() or '').startswith('ru') else 1
+        return {
+            kind: [{'id': pk, 'name': names[language_index] or names[1 - language_index]} for pk, names in items]
+            for kind, items in matches.items()
+        }
+
+
+class AutocompleteStatsAPIView(generics.GenericAPIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(autocomplete_index.stats())
+
+
+class RelatedMovieListAPIView(ReplicaReadMixin, generics.ListAPIView):
+    serializer_class = MovieListSerializer
+    pagination_class = NestedMoviePagination
+    movie_lookup = None
+
+    def get_queryset(self):
+        return Movie.objects.for_list().filter(**{self.movie_lookup: self.kwargs['pk']})
+
+
+class GenreMovieListAPIView(RelatedMovieListAPIView):
+    movie_lookup = 'genre'
+
+
+class CountryMovieListAPIView(RelatedMovieListAPIView):
+    movie_lookup = 'country'
+
+
+class DirectorMovieListAPIView(RelatedMovieListAPIView):
+    movie_lookup = 'director'
+
+
+class ActorMovieListAPIView(RelatedMovieListAPIView):
+    movie_lookup = 'actor'
+
+
+class SimilarMovieListAPIView(ReplicaReadMixin, generics.GenericAPIView):
+    # Precomputed nearest neighbors (see recommendations.py), best first.
+    serializer_class = RecommendedMovieSerializer
+    limit = 10
+
+    def get(self, request, pk):
+        limit = query_int(request, 'limit', self.limit, neighbor_count()) or self.limit
+        movies = similar_movies(pk, limit)
+        if not movies and not Movie.objects.filter(pk=pk).exists():
+            raise Http404
+        return Response({'results': self.get_serializer(movies, many=True).data})
+
+
+class UserRecommendationAPIView(generics.GenericAPIView):
+    serializer_class = RecommendedMovieSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    limit = 10
+    max_limit = 50
+
+    def get(self, request, *args, **kwargs):
+        limit = query_int(request, 'limit', self.limit, self.max_limit) or self.limit
+        movies = recommend_for_user(request.user.pk, limit)
+        return Response({'results': self.get_serializer(movies, many=True).data})
+
+
+class LeaderboardAPIView(ReplicaReadMixin, generics.ListAPIView):
+    # A precomputed board (see leaderboards.py), best first, paged by score.
+    # ?genre=, ?country= and ?status= each narrow it within the same index.
+    serializer_class = LeaderboardMovieSerializer
+    pagination_class = LeaderboardPagination
+    board = None
+
+    def get_queryset(self):
+        status_tier = self.request.query_params.get('status')
+        if status_tier and status_tier not in dict(StatusChoices):
+            raise ValidationError({'status': ['Неизвестный статус']})
+        entries = LeaderboardEntry.objects.filter(
+            board=self.board,
+            scope=scope(query_int(self.request, 'genre', 0), query_int(self.request, 'country', 0)))
+        if status_tier:
+            entries = entries.filter(status=status_tier)
+        return entries.select_related('movie')
+
+    def list(self, request, *args, **kwargs):
+        entries = self.paginate_queryset(self.get_queryset())
+        movies = [entry.movie for entry in entries]
+        now = timezone.now()
+        for entry in entries:
+            entry.movie.leaderboard_score = display_score(self.board, entry.score, now)
+        prefetch_related_objects(movies, 'country', Prefetch('genre', queryset=Genre.objects.select_related('category')))
+        return self.get_paginated_response(self.get_serializer(movies, many=True).data)
+
+
+class TrendingMovieListAPIView(LeaderboardAPIView):
+    board = TRENDING
+
+
+class TopRatedMovieListAPIView(LeaderboardAPIView):
+    board = TOP_RATED
+
+
+class MovieDetailAPIView(ReplicaReadMixin, ConditionalGetMixin, CachedResponseMixin, generics.RetrieveAPIView):
     queryset = Movie.objects.all()
+    cache_tags = ['movie:{pk}', 'country', 'genre', 'director', 'actor']
     serializer_class = MovieDetailSerializer
-    permission_classes = [UserStatusPermissions]
+    permission_classes = [permissions.IsAuthenticated, UserStatusPermissions]
+
+
+class MovieItemListAPIView(generics.ListAPIView):
+    permission_classes = [permissions.IsAuthenticated, UserStatusPermissions]
+    pagination_class = MovieItemPagination
+    item_name = None
+
+    def get_queryset(self):
+        movie = get_object_or_404(Movie.objects.only('id', 'status'), pk=self.kwargs['pk'])
+        self.check_object_permissions(self.request, movie)
+        return movie_item_queryset(self.item_name).filter(movie_id=movie.pk)
+
+
+class MovieRatingListAPIView(MovieItemListAPIView):
+    serializer_class = RatingSerializer
+    item_name = 'ratings'
+
+
+class MovieReviewListAPIView(MovieItemListAPIView):
+    serializer_class = ReviewSerializer
+    item_name = 'reviews'
+
+
+class MovieFrameListAPIView(MovieItemListAPIView):
+    serializer_class = MovieFrameSerializer
+    pagination_class = MovieMediaPagination
+    item_name = 'frames'
 
 
+class MovieVideoListAPIView(MovieItemListAPIView):
+    serializer_class = MovieVideoSerializer
+    pagination_class = MovieMediaPagination
+    item_name = 'videos'
+
+
+class MovieVideoStreamAPIView(generics.GenericAPIView):
+    # Byte-serves a video with Range support so players can seek; access
+    # follows the parent movie's pro/simple status.
+    permission_classes = [permissions.IsAuthenticated, UserStatusPermissions]
+
+    def perform_content_negotiation(self, request, force=False):
+        # Players send Accept: video/*, which no API renderer matches.
+        return super().perform_content_negotiation(request, force=True)
+
+    def get(self, request, pk):
+        video = get_object_or_404(MovieVideo.objects.select_related('movie').only('video', 'movie__status'), pk=pk)
+        self.check_object_permissions(request, video.movie)
+        if not video.video:
+            raise Http404
+        return range_response(request, video.video.name)
+
+
+class MovieVideoHLSAPIView(generics.GenericAPIView):
+    # HLS master playlist of a packaged video; GET with ?status=1 returns
+    # the packaging status and progress as JSON instead.
+    permission_classes = [permissions.IsAuthenticated, UserStatusPermissions]
+
+    def perform_content_negotiation(self, request, force=False):
+        return super().perform_content_negotiation(request, force=True)
+
+    def get(self, request, pk):
+        video = get_object_or_404(MovieVideo.objects.select_related('movie', 'package'), pk=pk)
+        self.check_object_permissions(request, video.movie)
+        package = getattr(video, 'package', None)
+        if 'status' in request.query_params:
+            if package is None:
+                raise Http404
+            return Response({'status': package.status, 'progress': package.progress,
+                             'renditions': [rendition['tier'] for rendition in package.renditions],
+                             'error': package.error})
+        if package is None or package.status != 'ready':
+            return Response({'detail': 'Видео ещё не подготовлено',
+                             'status': package.status if package else None},
+                            status=status.HTTP_404_NOT_FOUND)
+        response = HttpResponse(master_playlist(package, request.build_absolute_uri),
+                                content_type='application/vnd.apple.mpegurl')
+        response['Cache-Control'] = 'private, max-age=60'
+        return response
+
+
+class UploadSessionCreateAPIView(generics.CreateAPIView):
+    # Starts a resumable video upload: PUT the bytes in chunks to
+    # video-uploads/<id>/ with Content-Range, GET it for progress, then
+    # POST video-uploads/<id>/complete/.
+    serializer_class = UploadSessionSerializer
+    permission_classes = [permissions.IsAdminUser]
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        session = serializer.save(user=request.user)
+        uploads.start(session)
+        return Response(uploads.progress(session), status=status.HTTP_201_CREATED)
+
+
+class UploadSessionAPIView(generics.GenericAPIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(user=self.request.user)
+
+    def get(self, request, *args, **kwargs):
+        return Response(uploads.progress(self.get_object()))
+
+    def put(self, request, *args, **kwargs):
+        # The body is read straight from the request stream, never parsed.
+        session = self.get_object()
+        try:
+            offset, length = uploads.parse_content_range(request.headers.get('Content-Range'), session)
+            if int(request.headers.get('Content-Length') or 0) != length:
+                raise uploads.UploadError('Content-Length не совпадает с Content-Range')
+            uploads.write_chunk(session, offset, length, request.stream, request.headers.get('X-Chunk-SHA256'))
+        except uploads.UploadError as error:
+            return Response({'detail': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(uploads.progress(session))
+
+    def delete(self, request, *args, **kwargs):
+        uploads.abort(self.get_object())
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class UploadSessionCompleteAPIView(generics.GenericAPIView):
+    serializer_class = UploadCompleteSerializer
+    permission_classes = [permissions.IsAdminUser]
+
+    def post(self, request, pk):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        get_object_or_404(UploadSession, pk=pk, user=request.user)
+        try:
+            video = uploads.complete(pk, request.user, serializer.validated_data.get('sha256'))
+        except UploadSession.DoesNotExist:
+            raise Http404
+        except uploads.UploadError as error:
+            return Response({'detail': str(error)}, status=status.HTTP_409_CONFLICT)
+        return Response(MovieVideoSerializer(video, context=self.get_serializer_context()).data,
+                        status=status.HTTP_201_CREATED)
+
+
+
+class MovieReviewThreadListAPIView(generics.GenericAPIView):
+    # Newest top-level threads of a movie, each with its first `replies`
+    # replies, fetched in a single query and assembled into trees in O(n).
+    serializer_class = ReviewThreadSerializer
+    permission_classes = [permissions.IsAuthenticated, UserStatusPermissions]
+    page_size = 10
+    max_page_size = 50
+    replies = 3
+    max_replies = 50
+
+    def get(self, request, *args, **kwargs):
+        movie = get_object_or_404(Movie.objects.only('id', 'status'), pk=self.kwargs['pk'])
+        self.check_object_permissions(request, movie)
+        page_size = query_int(request, 'page_size', self.page_size, self.max_page_size) or self.page_size
+        replies = query_int(request, 'replies', self.replies, self.max_replies)
+        before = query_int(request, 'before', 0)
+
+        roots = Review.objects.filter(movie_id=movie.pk, depth=0).order_by('-id')
+        if before:
+            roots = roots.filter(id__lt=before)
+        rows = Review.objects.filter(root_id__in=roots.values('id')[:page_size + 1]).thread_rows(replies)
+        threads = build_review_tree(rows)
+
+        next_link = None
+        if len(threads) > page_size:
+            threads = threads[:page_size]
+            next_link = replace_query_param(request.build_absolute_uri(), 'before', threads[-1].pk)
+        return Response({
+            'next': next_link,
+            'results': self.get_serializer(threads, many=True).data,
+        })
+
+
+class ReviewThreadAPIView(generics.GenericAPIView):
+    serializer_class = ReviewThreadSerializer
+    permission_classes = [permissions.IsAuthenticated, UserStatusPermissions]
+
+    def get(self, request, *args, **kwargs):
+        root_id = Review.objects.filter(pk=self.kwargs['pk']).values('root_id')
+        rows = list(Review.objects.filter(root_id__in=root_id).thread_rows()
+                    .select_related('movie').only('movie__id', 'movie__status', *self.thread_fields()))
+        if not rows:
+            raise Http404
+        self.check_object_permissions(request, rows[0].movie)
+        return Response(self.get_serializer(build_review_tree(rows)[0]).data)
+
+    def thread_fields(self):
+        return ['id', 'parent_id', 'root_id', 'path', 'depth', 'comment', 'created_date',
+                'user__id', 'user__username', 'user__user_photo']
+
 
 class ReviewCreateAPIView(generics.CreateAPIView):
     queryset = Review.objects.all()
@@ -158,8 +583,37 @@ class ReviewCreateAPIView(generics.CreateAPIView):
 
 
 class HistoryViewSet(viewsets.ModelViewSet):
-    queryset = History.objects.all()
     serializer_class = HistorySerializer
+    pagination_class = HistoryPagination
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        # movie summaries come from the same query as the page
+        return History.objects.filter(user=self.request.user).select_related('movie')
+
+
+class HistoryEventAPIView(generics.GenericAPIView):
+    # Batched watch events, written asynchronously by the history buffer.
+    serializer_class = HistoryEventBatchSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        movie_ids = [event['movie_id'] for event in serializer.validated_data['events']]
+        accepted, collapsed = history_buffer.add(request.user.pk, movie_ids)
+        if not accepted and not collapsed:
+            return Response({'detail': 'История временно перегружена, повторите позже'},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            headers={'Retry-After': str(max(1, round(history_buffer.flush_interval)))})
+        return Response({'accepted': accepted, 'collapsed': collapsed}, status=status.HTTP_202_ACCEPTED)
+
+
+class HistoryBufferStatsAPIView(generics.GenericAPIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(history_buffer.stats())
 
 
 class RatingCreateAPIView(generics.CreateAPIView):
@@ -168,13 +622,24 @@ class RatingCreateAPIView(generics.CreateAPIView):
     permission_classes = [permissions.IsAuthenticated, CreatePermissions]
 
 class FavoriteViewSet(viewsets.ModelViewSet):
-    queryset = Favorite.objects.all()
     serializer_class = FavoriteSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return Favorite.objects.filter(user=self.request.user)
 
 
 class FavoriteItemViewSet(viewsets.ModelViewSet):
-    queryset = FavoriteItem.objects.all()
     serializer_class = FavoriteItemSerializer
+    pagination_class = FavoriteItemPagination
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return FavoriteItem.objects.filter(favorite__user=self.request.user).select_related('movie')
+
+    def perform_create(self, serializer):
+        favorite, _ = Favorite.objects.get_or_create(user=self.request.user)
+        serializer.save(favorite=favorite)
 
 
 class ActorImageViewSet(viewsets.ModelViewSet):
@@ -185,3 +650,4 @@ class ActorImageViewSet(viewsets.ModelViewSet):
 class ReviewLikeViewSet(viewsets.ModelViewSet):
     queryset = ReviewLike.objects.all()
     serializer_class = ReviewLikeSerializer
+    pagination_class = ReviewLikePagination
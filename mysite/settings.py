@@ -58,6 +58,7 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     "allauth.account.middleware.AccountMiddleware",
+    'movie_app.db_routing.ReplicaStickinessMiddleware',
 ]
 
 ROOT_URLCONF = 'mysite.urls'
@@ -82,14 +83,109 @@ WSGI_APPLICATION = 'mysite.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
+# DB_ENGINE=postgresql switches to PostgreSQL (DB_NAME, DB_USER, DB_PASSWORD,
+# DB_HOST, DB_PORT). DB_POOL_MAX_SIZE > 0 uses psycopg's connection pool,
+# otherwise connections persist for DB_CONN_MAX_AGE seconds.
+# DB_REPLICA_HOSTS (comma-separated) adds read replicas, used by catalog
+# views through movie_app.db_routing. The SQLite default runs in WAL mode.
+
+DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite')
+if DB_ENGINE == 'postgresql':
+    DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 0))
+    PRIMARY_DATABASE = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.getenv('DB_NAME', 'movie'),
+        'USER': os.getenv('DB_USER', 'postgres'),
+        'PASSWORD': os.getenv('DB_PASSWORD', ''),
+        'HOST': os.getenv('DB_HOST', 'localhost'),
+        'PORT': os.getenv('DB_PORT', '5432'),
+        # pooled connections must not also be persistent
+        'CONN_MAX_AGE': 0 if DB_POOL_MAX_SIZE else int(os.getenv('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'pool': {
+            'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+            'max_size': DB_POOL_MAX_SIZE,
+            'timeout': int(os.getenv('DB_POOL_TIMEOUT', 10)),
+        }} if DB_POOL_MAX_SIZE else {},
+    }
+    DATABASES = {'default': PRIMARY_DATABASE}
+    for index, host in enumerate(host for host in os.getenv('DB_REPLICA_HOSTS', '').split(',') if host.strip()):
+        DATABASES[f'replica_{index}'] = {**PRIMARY_DATABASE, 'HOST': host.strip(), 'TEST': {'MIRROR': 'default'}}
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                # WAL lets readers run alongside the single writer; IMMEDIATE
+                # transactions take the write lock up front instead of
+                # failing with "database is locked" on upgrade.
+                'init_command': ('PRAGMA journal_mode=WAL;PRAGMA synchronous=NORMAL;'
+                                 'PRAGMA temp_store=MEMORY;PRAGMA cache_size=-20000;'
+                                 'PRAGMA mmap_size=134217728'),
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20,
+            },
+        }
+    }
+
+DATABASE_ROUTERS = ['movie_app.db_routing.ReplicaRouter']
+# Seconds a user's reads stay on the primary after they write something. The
+# pins live in the REPLICA_PIN_CACHE_ALIAS cache (see Caches below).
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', 10))
+
+
+# Caches
+# The catalog alias backs movie_app's response cache; point it at a shared
+# backend (e.g. django.core.cache.backends.redis.RedisCache or
+# django.core.cache.backends.filebased.FileBasedCache) when running several
+# processes, otherwise invalidations stay local to one worker. The same goes
+# for the replica_pins alias holding read-your-writes pins: with a
+# per-process cache, a user's next read on another worker is served by a
+# replica that may not have their write yet. It defaults to the catalog
+# backend; REPLICA_PIN_CACHE_BACKEND / _LOCATION override it.
 
-DATABASES = {
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': {
+        'BACKEND': os.getenv('CATALOG_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CATALOG_CACHE_LOCATION', 'catalog'),
+        'TIMEOUT': int(os.getenv('CATALOG_CACHE_TIMEOUT', 300)),
+    },
+    'replica_pins': {
+        'BACKEND': os.getenv('REPLICA_PIN_CACHE_BACKEND',
+                             os.getenv('CATALOG_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')),
+        'LOCATION': os.getenv('REPLICA_PIN_CACHE_LOCATION', os.getenv('CATALOG_CACHE_LOCATION', 'replica_pins')),
+    },
 }
 
+CATALOG_CACHE_ALIAS = 'catalog'
+REPLICA_PIN_CACHE_ALIAS = 'replica_pins'
+
+# In-process autocomplete prefix index: hard cap on entries, and how many
+# seconds a worker may serve it before rebuilding to pick up other
+# processes' writes (None = only this process's signals update it).
+AUTOCOMPLETE_MAX_ENTRIES = int(os.getenv('AUTOCOMPLETE_MAX_ENTRIES', 1_000_000))
+AUTOCOMPLETE_MAX_AGE = int(os.getenv('AUTOCOMPLETE_MAX_AGE', 300))
+
+# In-process facet posting lists behind movie/facets/; seconds a worker may
+# serve them before rebuilding to pick up other processes' writes.
+FACETS_MAX_AGE = int(os.getenv('FACETS_MAX_AGE', 300))
+
+# Watch events posted to history/events/ are buffered per process and
+# bulk-inserted every HISTORY_BUFFER_FLUSH_SIZE events or
+# HISTORY_BUFFER_FLUSH_INTERVAL seconds. Batches that would push the buffer
+# past HISTORY_BUFFER_MAX_EVENTS get a 503 with Retry-After. Repeats of a
+# user's last movie within HISTORY_DEDUP_WINDOW seconds are collapsed. A
+# batch whose INSERT fails is retried HISTORY_BUFFER_FLUSH_RETRIES times.
+HISTORY_BUFFER_MAX_EVENTS = int(os.getenv('HISTORY_BUFFER_MAX_EVENTS', 50_000))
+HISTORY_BUFFER_FLUSH_SIZE = int(os.getenv('HISTORY_BUFFER_FLUSH_SIZE', 500))
+HISTORY_BUFFER_FLUSH_INTERVAL = float(os.getenv('HISTORY_BUFFER_FLUSH_INTERVAL', 1.0))
+HISTORY_DEDUP_WINDOW = int(os.getenv('HISTORY_DEDUP_WINDOW', 30))
+HISTORY_BUFFER_FLUSH_RETRIES = int(os.getenv('HISTORY_BUFFER_FLUSH_RETRIES', 3))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -139,6 +235,64 @@ STATIC_URL = 'static/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# Uploads are stored once per distinct content under MEDIA_ROOT/blobs;
+# collect_media_garbage removes the ones no row refers to any more.
+STORAGES = {
+    'default': {'BACKEND': 'movie_app.storage.ContentAddressedStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+# Resized copies of uploaded images, written under MEDIA_ROOT/derivatives by
+# a per-process thread pool and by the generate_image_derivatives command.
+IMAGE_DERIVATIVE_WIDTHS = (160, 320, 640, 1280)
+IMAGE_DERIVATIVE_FORMATS = ('avif', 'webp', 'jpeg')
+IMAGE_DERIVATIVE_WORKERS = int(os.getenv('IMAGE_DERIVATIVE_WORKERS', 2))
+
+# Videos are byte-served by Django unless VIDEO_STREAM_OFFLOAD hands the
+# transfer to the web server after the access check: 'x-accel-redirect'
+# (nginx internal location at VIDEO_STREAM_ACCEL_PREFIX aliased to
+# MEDIA_ROOT) or 'x-sendfile' (Apache/lighttpd).
+VIDEO_STREAM_OFFLOAD = os.getenv('VIDEO_STREAM_OFFLOAD', '')
+VIDEO_STREAM_ACCEL_PREFIX = os.getenv('VIDEO_STREAM_ACCEL_PREFIX', '/protected-media/')
+
+# Resumable video uploads (video-uploads/): chunk and file size limits, and
+# how long an untouched session lives before collect_media_garbage drops it.
+VIDEO_UPLOAD_MAX_CHUNK_SIZE = int(os.getenv('VIDEO_UPLOAD_MAX_CHUNK_SIZE', 64 << 20))
+VIDEO_UPLOAD_MAX_SIZE = int(os.getenv('VIDEO_UPLOAD_MAX_SIZE', 50 << 30))
+VIDEO_UPLOAD_EXPIRY_HOURS = float(os.getenv('VIDEO_UPLOAD_EXPIRY_HOURS', 24))
+
+# HLS packaging run by the package_videos command. VIDEO_PACKAGER may be
+# movie_app.packaging.StubPackager where ffmpeg is not installed.
+VIDEO_PACKAGER = os.getenv('VIDEO_PACKAGER', 'movie_app.packaging.FFmpegPackager')
+VIDEO_PACKAGING_WORKERS = int(os.getenv('VIDEO_PACKAGING_WORKERS', 2))
+FFMPEG_BINARY = os.getenv('FFMPEG_BINARY', 'ffmpeg')
+FFPROBE_BINARY = os.getenv('FFPROBE_BINARY', 'ffprobe')
+
+# Background jobs (movie_app/jobs.py), run by the run_jobs command. With
+# JOBS_BACKGROUND off, search-index, fan-out and image work stays inline;
+# JOBS_EAGER runs enqueued jobs immediately (tests, local runs).
+JOBS_BACKGROUND = os.getenv('JOBS_BACKGROUND', 'false').lower() == 'true'
+JOBS_EAGER = os.getenv('JOBS_EAGER', 'false').lower() == 'true'
+JOBS_WORKERS = int(os.getenv('JOBS_WORKERS', 4))
+
+# Item-item recommendations (movie_app/recommendations.py), retrained
+# hourly by run_jobs or on demand with train_recommendations. Each movie
+# keeps RECOMMENDATION_NEIGHBORS neighbors; scores blend co-rating cosine
+# with shared-genre and shared-cast cosine by RECOMMENDATION_WEIGHTS.
+RECOMMENDATION_NEIGHBORS = int(os.getenv('RECOMMENDATION_NEIGHBORS', 20))
+RECOMMENDATION_WEIGHTS = {
+    'ratings': float(os.getenv('RECOMMENDATION_WEIGHT_RATINGS', 0.6)),
+    'genre': float(os.getenv('RECOMMENDATION_WEIGHT_GENRE', 0.25)),
+    'cast': float(os.getenv('RECOMMENDATION_WEIGHT_CAST', 0.15)),
+}
+
+# Trending / top-rated leaderboards (movie_app/leaderboards.py), refreshed
+# every minute by run_jobs. A view's weight halves every
+# LEADERBOARD_HALF_LIFE_HOURS; top-rated scores shrink each movie's average
+# towards the catalog mean as if it had LEADERBOARD_RATING_PRIOR extra votes.
+LEADERBOARD_HALF_LIFE_HOURS = float(os.getenv('LEADERBOARD_HALF_LIFE_HOURS', 48))
+LEADERBOARD_RATING_PRIOR = float(os.getenv('LEADERBOARD_RATING_PRIOR', 20))
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'movie_app.UserProfile'